@@ -1,7 +1,20 @@
+import os
 import random 
 import copy
+import heapq
+import time
+from collections import defaultdict, deque
 import networkx as nx
 import numpy as np
+import pandas as pd
+from routing import SinkTrees, get_tree_cache, sink_tree_costs, tree_path_array
+from drivers import DriverArrays, as_driver_arrays
+from compiled_net import CompiledNet, as_compiled
+from results import ArrivalCurve, ResultsSink
+from checkpoint import load_state, save_state
+from profiling import RunProfile
+from limits import PartialResult, RunLimits
+from congestion import EdgeCapacity, edge_capacities
 
 def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) -> list:
         
@@ -23,66 +36,1146 @@ def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) ->
         return drivers
 
 
-def run_model(drivers: list, network: nx.Graph(), origin_node: int, end_node: int, prob_wrong_turn: float) -> int:
+def run_model(drivers, network: nx.Graph(), origin_node: int, end_node: int, prob_wrong_turn: float,
+              next_hop: np.ndarray = None, checkpoint: str = None, checkpoint_every: int = 10000,
+              profile: RunProfile = None, limits: RunLimits = None):
         """
         run_model runs a model with the given generated drivers
 
         Params:
-        drivers: array of drivers of given attributes
-        network: networkx graph object
+        drivers: DriverArrays or list of drivers from generate_drivers, a
+        DriverArrays is reset and left with this run's iterations and nodes
+        network: CompiledNet or networkx graph object
         origin_node: node point of origin 
         end_node: node point of sink
         prob_wrong_turn: probablity that bad driver makes a random turn
         at a given node
+        next_hop: sink tree of end_node from routing.sink_tree_array, taken
+        from the process-wide routing.TreeCache when not given
+        checkpoint: .npz file the whole state is saved to every
+        checkpoint_every ticks, with the state of the random module; a
+        run given an existing checkpoint goes on from it and ends exactly
+        like the run that saved it, and the file is removed once all
+        drivers arrived; it is also saved when a limit stops the run
+        checkpoint_every: number of ticks between two checkpoints
+        profile: profiling.RunProfile that records routing time, ticks,
+        moves, wrong turns and peak queue lengths, none when None
+        limits: limits.RunLimits of the run, counted from where a
+        checkpoint left off, it runs until every driver arrived when None
 
         Returns:
         number of iterations required for all drivers to get to final
-        destination
+        destination, or a limits.PartialResult when a limit stopped the run
         """
 
-
-        network.nodes[origin_node]["Queue"] += drivers
-        good_driver_path = nx.shortest_path(network, source=origin_node, target=end_node, method='dijkstra', weight="length")
-        init_drivers = [list(driver.keys())[0] for driver in network.nodes[origin_node]["Queue"]]
-        end_drivers = []
+        started = time.perf_counter()
+        # The model runs on node indices of the compiled network, queues
+        # hold driver rows of the DriverArrays
+        net = as_compiled(network)
+        origin = net.index_of[origin_node]
+        end = net.index_of[end_node]
+        drivers = as_driver_arrays(drivers)
+        drivers.reset()
+        bad_code = drivers.code("bad")
+        num_drivers = len(drivers)
+        position = np.full(num_drivers, origin, dtype=np.int64)
+        queues = defaultdict(deque)
+        queues[origin].extend(range(num_drivers))
+        # One reverse search from the sink answers every on-path step, the
+        # good driver path is the branch of the tree starting at the origin
+        # (tree_path_array raises if the sink cannot be reached)
+        if profile is not None:
+                profile.queue_length(origin, num_drivers)
+                profile.start("routing")
+        if next_hop is None:
+                next_hop = get_tree_cache().tree(net, end, weight="length")
+        tree_path_array(next_hop, origin, end)
+        next_hop = next_hop.tolist()
+        if profile is not None:
+                profile.stop("routing")
+        # Count arrivals at the sink as they happen instead of comparing
+        # the sink queue against every driver after each pass, drivers
+        # starting at the sink have arrived
+        arrived = num_drivers if origin == end else 0
+        # The active set holds node ids, not indices: a set of ints is
+        # walked in an order set by their values, and that order decides
+        # which driver moves first, so seeded runs match the original model
+        node_ids = net.node_ids.tolist()
+        index_of = net.index_of
         active_nodes = {origin_node}
         iterations = 0
+        last_arrival = 0
+        reason = None
+        # The walking order of a set depends on what was added and removed
+        # before, not only on what it holds, so a checkpoint keeps every
+        # change of the active set (index + 1 added, -(index + 1) removed)
+        # and a resumed run replays them
+        active_log = None
+
+        if checkpoint is not None:
+                run_key = [net.fingerprint, origin, end, num_drivers, prob_wrong_turn]
+                active_log = [origin + 1]
+                meta, state = load_state(checkpoint)
+                if meta is not None:
+                        if meta["run_key"] != run_key or not np.array_equal(state["state"], drivers.state):
+                                raise ValueError(f"Checkpoint {checkpoint} was saved by another run.")
+                        position = state["position"]
+                        drivers.iterations[:] = state["driver_iterations"]
+                        queues = defaultdict(deque)
+                        queue_drivers = np.split(state["queue_drivers"], np.cumsum(state["queue_sizes"])[:-1])
+                        for node, queue in zip(state["queue_nodes"].tolist(), queue_drivers):
+                                queues[node].extend(queue.tolist())
+                        active_log = state["active_log"].tolist()
+                        active_nodes = set()
+                        for change in active_log:
+                                if change > 0:
+                                        active_nodes.add(node_ids[change - 1])
+                                else:
+                                        active_nodes.remove(node_ids[-change - 1])
+                        arrived, iterations, last_arrival = meta["arrived"], meta["iterations"], meta["last_arrival"]
+                        version, internal, gauss = meta["random"]
+                        random.setstate((version, tuple(internal), gauss))
 
-        while len(end_drivers) == 0 or sorted(init_drivers) != sorted(end_drivers):
+        # The original model checked the sink after each pass, so it always
+        # ran at least one
+        while iterations == 0 or arrived < num_drivers:
+                if limits is not None:
+                        reason = limits.exceeded(iterations, last_arrival, started)
+                if checkpoint is not None and (iterations % checkpoint_every == 0 or reason is not None):
+                        # Drivers at the sink never leave its queue again
+                        waiting = [node for node, queue in queues.items() if queue and node != end]
+                        save_state(checkpoint, {"run_key": run_key, "arrived": arrived, "iterations": iterations,
+                                                "last_arrival": last_arrival, "random": random.getstate()},
+                                   position=position, driver_iterations=drivers.iterations, state=drivers.state,
+                                   queue_nodes=np.array(waiting, dtype=np.int64),
+                                   queue_sizes=np.array([len(queues[node]) for node in waiting], dtype=np.int64),
+                                   queue_drivers=np.array([driver for node in waiting for driver in queues[node]],
+                                                          dtype=np.int64),
+                                   active_log=np.array(active_log, dtype=np.int64))
+                if reason is not None:
+                        break
                 iterations+=1
+                tick_moves = 0
+                tick_active = len(active_nodes)
                 # Keep this as copy or for loop behavior changes
-                for node in copy.copy(active_nodes):
-                        if node != end_node:
+                for node_id in copy.copy(active_nodes):
+                        node = index_of[node_id]
+                        if node != end:
                                 try:        
-                                        drivers = network.nodes[node]["Queue"]
-                                        
-                                        first_out = drivers.pop(0)
-                                        state = list(first_out.values())[0]
-                                        if state == "good":
-                                                current_node_ind = good_driver_path.index(node)
-                                                next_step = good_driver_path[current_node_ind + 1]
-                                                network.nodes[next_step]["Queue"].append(first_out)
-                                                active_nodes.add(next_step)
+                                        first_out = queues[node].popleft()
+                                        if drivers.state[first_out] != bad_code:
+                                                next_step = next_hop[node]
                                         else:
                                                 # at each step cause a bad driver to make a wrong turn with given prob.
                                                 turn_choice = random.choices(["on_path", "off_path"], 
                                                                              [1-prob_wrong_turn, prob_wrong_turn])[0]
                                                 if turn_choice == "off_path":
-                                                        next_step = random.choice([n for n in network.neighbors(node)])
+                                                        next_step = int(random.choice(net.neighbors(node)))
+                                                        if profile is not None:
+                                                                profile.count("wrong_turns")
                                                 else: 
-                                                        bad_driver_path = nx.shortest_path(network, source=node, target=end_node, method='dijkstra', weight="length")
-                                                        current_node_ind = bad_driver_path.index(node)
-                                                        next_step = bad_driver_path[current_node_ind+1]
-                                                network.nodes[next_step]["Queue"].append(first_out)
-                                                active_nodes.add(next_step)
+                                                        next_step = next_hop[node]
+                                        queues[next_step].append(first_out)
+                                        if active_log is not None and node_ids[next_step] not in active_nodes:
+                                                active_log.append(next_step + 1)
+                                        active_nodes.add(node_ids[next_step])
+                                        position[first_out] = next_step
+                                        drivers.iterations[first_out] += 1
+                                        if next_step == end:
+                                                arrived += 1
+                                                last_arrival = iterations
+                                        if profile is not None:
+                                                tick_moves += 1
+                                                if next_step != end:
+                                                        profile.queue_length(next_step, len(queues[next_step]))
                                 except IndexError:
                                         # Once all drivers are dequed remove node from active
                                         # nodes list
-                                        active_nodes.remove(node)
-                                  
-                end_drivers = [list(driver.keys())[0] for driver in network.nodes[end_node]["Queue"]]
+                                        active_nodes.remove(node_id)
+                                        if active_log is not None:
+                                                active_log.append(-node - 1)
+                if profile is not None:
+                        profile.tick(tick_moves, tick_active, arrived)
+
+        if checkpoint is not None and reason is None and os.path.exists(checkpoint):
+                os.remove(checkpoint)
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        drivers.node[:] = net.node_ids[position]
+        if reason is not None:
+                return PartialResult(reason, iterations, drivers, position == end)
+        return iterations
+
+
+def _next_entries(net: CompiledNet, next_hop, end: int) -> list:
+        """
+        _next_entries finds the adjacency entry of the on-path step of every
+        node, -1 for the sink and nodes that cannot reach it
+        """
+
+        sources = net.sources()
+        on_path = (net.indices == np.asarray(next_hop)[sources]) & (sources != end)
+        next_entry = np.full(net.num_nodes, -1, dtype=np.int64)
+        # Reversed so the first entry wins if an edge is listed twice
+        next_entry[sources[on_path][::-1]] = np.flatnonzero(on_path)[::-1]
+        return next_entry.tolist()
+
+
+def run_model_events(drivers, network: nx.Graph(), origin_node: int, end_node: int, prob_wrong_turn: float,
+                     next_hop: np.ndarray = None, time_weight: str = None, headway: float = 1.0,
+                     profile: RunProfile = None, limits: RunLimits = None):
+        """
+        run_model_events runs the single-sink model as a discrete event
+        simulation: a heap holds the times at which drivers reach a node
+        and at which a node can let its next driver go, so the cost grows
+        with the number of driver moves instead of ticks times active nodes
+
+        It is a different model from run_model, not a faster copy of it.
+        With time_weight None every move takes one tick and every node
+        lets one driver go per tick, so a driver moves at most once per
+        tick; run_model walks the active nodes in set order and moves a
+        driver again in the same tick when its next node comes later in
+        that order. Without wrong turns both give the same ticks, with
+        them this engine takes longer (about 3% on a 15x15 grid at
+        prob_wrong_turn 0.3) and the random draws differ, so runs do not
+        match run_model seed for seed
+
+        Params:
+        drivers: DriverArrays or list of drivers from generate_drivers, a
+        DriverArrays is reset and left with this run's iterations and nodes
+        network: CompiledNet or networkx graph object
+        origin_node: node point of origin 
+        end_node: node point of sink
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        next_hop: sink tree of end_node from routing.sink_tree_array, taken
+        from the process-wide routing.TreeCache when not given
+        time_weight: edge attribute used as the time of a move, e.g.
+        "travel_time", or None for one tick per move
+        headway: time between two drivers leaving the same node
+        profile: profiling.RunProfile that records routing time, events,
+        moves, wrong turns and peak queue lengths (there are no ticks),
+        none when None
+        limits: limits.RunLimits of the run, checked before every event
+        with the event time as ticks, it runs until every driver arrived
+        when None
+
+        Returns:
+        time at which the last driver got to the final destination, the
+        number of ticks when time_weight is None, or a limits.PartialResult
+        when a limit stopped the run
+        """
+
+        started = time.perf_counter()
+        net = as_compiled(network)
+        origin = net.index_of[origin_node]
+        end = net.index_of[end_node]
+        drivers = as_driver_arrays(drivers)
+        drivers.reset()
+        # Plain lists are much faster than numpy scalars in the event loop
+        is_bad = (drivers.state == drivers.code("bad")).tolist()
+        num_drivers = len(drivers)
+        if profile is not None:
+                profile.queue_length(origin, num_drivers)
+                profile.start("routing")
+        if next_hop is None:
+                next_hop = get_tree_cache().tree(net, end, weight="length")
+        tree_path_array(next_hop, origin, end)
+        next_hop = next_hop.tolist()
+        if profile is not None:
+                profile.stop("routing")
+        indptr = net.indptr.tolist()
+        indices = net.indices.tolist()
+        if time_weight is None:
+                move_time = None
+        else:
+                move_time = net.weights(time_weight).tolist()
+                # Adjacency entry of every on-path step, to look up its time
+                next_entry = _next_entries(net, next_hop, end)
+
+        position = [origin] * num_drivers
+        moves = [0] * num_drivers
+        queues = defaultdict(deque)
+        queues[origin].extend(range(num_drivers))
+        # A node is scheduled while its queue has drivers; free_at is the
+        # earliest time it can let the next one go
+        scheduled = {origin}
+        free_at = defaultdict(float)
+        # Events are (time, kind, seq, node, driver), arrivals (kind 0) at a
+        # time come before departures (kind 1) so a driver can leave a node
+        # at the time it gets there
+        events = [(0, 1, 0, origin, -1)]
+        seq = 1
+        # Drivers starting at the sink have arrived at time 0
+        arrived = num_drivers if origin == end else 0
+        finish = 0
+        reason = None
+
+        while arrived < num_drivers:
+                if limits is not None:
+                        reason = limits.exceeded(events[0][0], finish, started)
+                        if reason is not None:
+                                break
+                now, kind, _, node, driver = heapq.heappop(events)
+                if profile is not None:
+                        profile.count("events")
+                if kind == 0:
+                        queues[node].append(driver)
+                        if node == end:
+                                arrived += 1
+                                finish = now
+                        else:
+                                if profile is not None:
+                                        profile.queue_length(node, len(queues[node]))
+                                if node not in scheduled:
+                                        scheduled.add(node)
+                                        heapq.heappush(events, (max(now, free_at[node]), 1, seq, node, -1))
+                                        seq += 1
+                        continue
+
+                first_out = queues[node].popleft()
+                # at each step cause a bad driver to make a wrong turn with given prob.
+                if is_bad[first_out] and random.random() < prob_wrong_turn:
+                        entry = random.choice(range(indptr[node], indptr[node + 1]))
+                        next_step = indices[entry]
+                        if profile is not None:
+                                profile.count("wrong_turns")
+                else:
+                        next_step = next_hop[node]
+                        entry = next_entry[node] if move_time is not None else -1
+                step_time = 1 if move_time is None else move_time[entry]
+                position[first_out] = next_step
+                moves[first_out] += 1
+                if profile is not None:
+                        profile.moves += 1
+                heapq.heappush(events, (now + step_time, 0, seq, next_step, first_out))
+                seq += 1
+
+                free_at[node] = now + headway
+                if queues[node]:
+                        heapq.heappush(events, (free_at[node], 1, seq, node, -1))
+                        seq += 1
+                else:
+                        scheduled.discard(node)
+
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        drivers.iterations += np.array(moves, dtype=drivers.iterations.dtype)
+        drivers.node[:] = net.node_ids[position]
+        if reason is not None:
+                # A driver moving toward the sink counts as finished only once
+                # its arrival event was handled
+                finished = np.zeros(num_drivers, dtype=bool)
+                finished[list(queues[end])] = True
+                return PartialResult(reason, events[0][0], drivers, finished)
+        return finish if move_time is not None else int(finish)
 
+
+def run_model_batch(drivers, network: nx.Graph(), origin_node: int, end_node: int, prob_wrong_turn: float,
+                    next_hop: np.ndarray = None, seed: int = None, checkpoint: str = None,
+                    checkpoint_every: int = 10000, profile: RunProfile = None, limits: RunLimits = None):
+        """
+        run_model_batch runs the single-sink model moving the queue heads
+        of all active nodes in one numpy step per tick: one random draw
+        decides every wrong turn, next hops come from the sink tree array,
+        wrong turns pick a neighbor from the CSR offsets, and the moved
+        drivers join their new queues in bulk
+
+        Every node lets one driver go per tick and a driver moves at most
+        once per tick, the model of run_model_events with unit steps
+        rather than that of run_model, see run_model_events
+
+        Params:
+        drivers: DriverArrays or list of drivers from generate_drivers, a
+        DriverArrays is reset and left with this run's iterations and nodes
+        network: CompiledNet or networkx graph object
+        origin_node: node point of origin 
+        end_node: node point of sink
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        next_hop: sink tree of end_node from routing.sink_tree_array, taken
+        from the process-wide routing.TreeCache when not given
+        seed: seed of the numpy generator, drawn from the random module
+        when None so random.seed still makes runs repeatable
+        checkpoint: .npz file the whole state is saved to every
+        checkpoint_every ticks; a run given an existing checkpoint goes on
+        from it and ends exactly like the run that saved it, and the file
+        is removed once all drivers arrived; it is also saved when a limit
+        stops the run, so a run with larger limits can go on from there
+        checkpoint_every: number of ticks between two checkpoints
+        profile: profiling.RunProfile that records routing time, ticks,
+        moves, wrong turns and peak queue lengths, none when None
+        limits: limits.RunLimits of the run, counted from where a
+        checkpoint left off, it runs until every driver arrived when None
+
+        Returns:
+        number of iterations required for all drivers to get to final
+        destination, or a limits.PartialResult when a limit stopped the run
+        """
+
+        started = time.perf_counter()
+        net = as_compiled(network)
+        origin = net.index_of[origin_node]
+        end = net.index_of[end_node]
+        drivers = as_driver_arrays(drivers)
+        drivers.reset()
+        is_bad = drivers.state == drivers.code("bad")
+        num_drivers = len(drivers)
+        if profile is not None:
+                profile.start("routing")
+        if next_hop is None:
+                next_hop = get_tree_cache().tree(net, end, weight="length")
+        tree_path_array(next_hop, origin, end)
+        next_hop = np.asarray(next_hop, dtype=np.int64)
+        if profile is not None:
+                profile.stop("routing")
+        rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+        # Each queue is a linked list of driver rows: head and tail per node,
+        # after per driver, -1 when there is none
+        head = np.full(net.num_nodes, -1, dtype=np.int64)
+        tail = np.full(net.num_nodes, -1, dtype=np.int64)
+        after = np.full(num_drivers, -1, dtype=np.int64)
+        position = np.full(num_drivers, origin, dtype=np.int64)
+        if num_drivers:
+                head[origin] = 0
+                tail[origin] = num_drivers - 1
+                after[:-1] = np.arange(1, num_drivers)
+        # Drivers starting at the sink have arrived, and the sink lets
+        # nobody go
+        active = np.array([origin] if origin != end else [], dtype=np.int64)
+        arrived = num_drivers if origin == end else 0
+        iterations = 0
+        reason = None
+
+        if checkpoint is not None:
+                run_key = [net.fingerprint, origin, end, num_drivers, prob_wrong_turn]
+                meta, state = load_state(checkpoint)
+                if meta is not None:
+                        if meta["run_key"] != run_key or not np.array_equal(state["is_bad"], is_bad):
+                                raise ValueError(f"Checkpoint {checkpoint} was saved by another run.")
+                        head, tail, after = state["head"], state["tail"], state["after"]
+                        position, active = state["position"], state["active"]
+                        drivers.iterations[:] = state["driver_iterations"]
+                        arrived, iterations = meta["arrived"], meta["iterations"]
+                        rng.bit_generator.state = meta["rng"]
+        last_arrival = iterations
+        if profile is not None:
+                # Queue lengths are only kept while profiling, every driver
+                # not at the sink waits in the queue of its position
+                queue_length = np.bincount(position[position != end], minlength=net.num_nodes)
+                profile.queue_lengths(active, queue_length[active])
+
+        # At least one tick like run_model
+        while iterations == 0 or arrived < num_drivers:
+                if limits is not None:
+                        reason = limits.exceeded(iterations, last_arrival, started)
+                if checkpoint is not None and (iterations % checkpoint_every == 0 or reason is not None):
+                        save_state(checkpoint, {"run_key": run_key, "arrived": int(arrived), "iterations": iterations,
+                                                "rng": rng.bit_generator.state},
+                                   head=head, tail=tail, after=after, position=position, active=active,
+                                   driver_iterations=drivers.iterations, is_bad=is_bad)
+                if reason is not None:
+                        break
+                iterations += 1
+                # Pop the head of every active queue
+                first_out = head[active]
+                head[active] = after[first_out]
+                after[first_out] = -1
+                tail[active[head[active] < 0]] = -1
+
+                # One draw for the turn and one for the neighbor of every head
+                draws = rng.random((2, len(active)))
+                wrong = is_bad[first_out] & (draws[0] < prob_wrong_turn)
+                next_step = next_hop[active]
+                start = net.indptr[active[wrong]]
+                degree = net.indptr[active[wrong] + 1] - start
+                next_step[wrong] = net.indices[start + (draws[1][wrong] * degree).astype(np.int64)]
+                position[first_out] = next_step
+                drivers.iterations[first_out] += 1
+                at_end = next_step == end
+                if at_end.any():
+                        arrived += np.count_nonzero(at_end)
+                        last_arrival = iterations
+                if profile is not None:
+                        profile.count("wrong_turns", int(np.count_nonzero(wrong)))
+                        queue_length[active] -= 1
+                        np.add.at(queue_length, next_step[~at_end], 1)
+                        touched = np.unique(next_step[~at_end])
+                        profile.queue_lengths(touched, queue_length[touched])
+                        profile.tick(len(active), len(active), arrived)
+
+                # Push the other drivers to the back of their new queues, in
+                # order of the node they left
+                movers = first_out[~at_end]
+                targets = next_step[~at_end]
+                if len(movers):
+                        order = np.argsort(targets, kind="stable")
+                        movers = movers[order]
+                        targets = targets[order]
+                        same = targets[1:] == targets[:-1]
+                        after[movers[:-1][same]] = movers[1:][same]
+                        first = np.concatenate(([True], ~same))
+                        last = np.concatenate((~same, [True]))
+                        nodes = targets[first]
+                        has_tail = tail[nodes] >= 0
+                        after[tail[nodes[has_tail]]] = movers[first][has_tail]
+                        head[nodes[~has_tail]] = movers[first][~has_tail]
+                        tail[nodes] = movers[last]
+                else:
+                        nodes = targets
+                active = np.union1d(active[head[active] >= 0], nodes)
+
+        if checkpoint is not None and reason is None and os.path.exists(checkpoint):
+                os.remove(checkpoint)
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        drivers.node[:] = net.node_ids[position]
+        if reason is not None:
+                return PartialResult(reason, iterations, drivers, position == end)
         return iterations
 
 
+def run_model_congestion(drivers, network: nx.Graph(), origin_node: int, end_node: int, prob_wrong_turn: float,
+                         next_hop: np.ndarray = None, capacity: EdgeCapacity = None, tick_seconds: float = 1.0,
+                         reroute_every: int = None, profile: RunProfile = None, limits: RunLimits = None):
+        """
+        run_model_congestion runs the model on capacity-constrained edges:
+        a driver leaves a node over an edge only while the edge has flow
+        left in the tick and room for another car, and then needs the
+        travel ticks of the edge to reach the next node. A node lets its
+        drivers go in queue order until the head driver is held back, so
+        release rates follow the roads leaving the node instead of one
+        driver per tick, and queues build up in front of narrow or full
+        roads
+
+        Full edges can block each other in a ring (gridlock); give limits
+        with stall_ticks to stop such runs
+
+        With reroute_every the on-path steps follow the current traffic: every
+        reroute_every ticks the sink tree is rebuilt over queue-adjusted
+        costs, the travel ticks of an edge plus the drivers on it over its
+        flow plus the queue at its end over the flow leaving that node. One
+        dijkstra per rebuild serves every driver, paths are at most
+        reroute_every ticks stale. A held back driver keeps the edge it
+        queued for
+
+        Params:
+        drivers: DriverArrays or list of drivers from generate_drivers, a
+        DriverArrays is reset and left with this run's iterations and nodes
+        network: CompiledNet or networkx graph object, with speed_kph,
+        highway and travel_time for realistic capacities
+        origin_node: node point of origin 
+        end_node: node point of sink
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        next_hop: sink tree of end_node from routing.sink_tree_array, taken
+        from the process-wide routing.TreeCache when not given; unused
+        with reroute_every
+        capacity: congestion.EdgeCapacity of the network, built from it
+        with tick_seconds when not given
+        tick_seconds: length of a tick in seconds when capacity is built
+        reroute_every: number of ticks between two rebuilds of the sink
+        tree, the tree stays fixed when None. The first tree is then built
+        over the travel ticks of the edges, so the rebuilds only change
+        routes where there is traffic
+        profile: profiling.RunProfile that records routing and rerouting
+        time, ticks, moves, wrong turns, blocked releases and peak queue
+        lengths, none when None
+        limits: limits.RunLimits of the run, it runs until every driver
+        arrived when None
+
+        Returns:
+        tick at which the last driver got to the final destination, or a
+        limits.PartialResult when a limit stopped the run
+        """
+
+        started = time.perf_counter()
+        net = as_compiled(network)
+        origin = net.index_of[origin_node]
+        end = net.index_of[end_node]
+        drivers = as_driver_arrays(drivers)
+        drivers.reset()
+        is_bad = (drivers.state == drivers.code("bad")).tolist()
+        num_drivers = len(drivers)
+        if capacity is None:
+                capacity = edge_capacities(net, tick_seconds=tick_seconds)
+        if profile is not None:
+                profile.queue_length(origin, num_drivers)
+                profile.start("routing")
+        if reroute_every is not None:
+                # The cost of the rebuilds on an empty network
+                travel_cost = capacity.travel_ticks.astype(np.float64)
+                next_hop = sink_tree_costs(net, end, travel_cost)
+        elif next_hop is None:
+                next_hop = get_tree_cache().tree(net, end, weight="length")
+        tree_path_array(next_hop, origin, end)
+        next_hop = next_hop.tolist()
+        if profile is not None:
+                profile.stop("routing")
+        indptr = net.indptr.tolist()
+        indices = net.indices.tolist()
+        next_entry = _next_entries(net, next_hop, end)
+
+        # Per edge state: drivers on it and flow credit, topped up lazily
+        # with the flow of the ticks since credit_tick, at most one tick of
+        # flow (or one driver) banked, starting full
+        flow = capacity.flow.tolist()
+        storage = capacity.storage.tolist()
+        travel_ticks = capacity.travel_ticks.tolist()
+        most_credit = [max(f, 1.0) for f in flow]
+        credit = list(most_credit)
+        credit_tick = [0] * len(indices)
+        occupancy = [0] * len(indices)
+        if reroute_every is not None:
+                out_flow = np.maximum(np.bincount(net.sources(), weights=capacity.flow, minlength=net.num_nodes),
+                                      1e-9)
+                rerouted = 0
+
+        position = [origin] * num_drivers
+        moves = [0] * num_drivers
+        # Edge chosen by a held back head driver, so it does not choose again
+        wanted = [-1] * num_drivers
+        queues = defaultdict(deque)
+        # Drivers starting at the sink have arrived at tick 0
+        if origin != end:
+                queues[origin].extend(range(num_drivers))
+        active = {origin} if origin != end else set()
+        # Drivers on an edge as (tick they reach its end, driver, edge)
+        on_edges = []
+        tick = 0
+        arrived = num_drivers if origin == end else 0
+        finish = 0
+        reason = None
+
+        while arrived < num_drivers:
+                if not active:
+                        # Every driver is on an edge, skip to the next arrival
+                        tick = on_edges[0][0] - 1
+                if limits is not None:
+                        reason = limits.exceeded(tick, finish, started)
+                        if reason is not None:
+                                break
+                tick += 1
+                if reroute_every is not None and tick - rerouted >= reroute_every:
+                        rerouted = tick
+                        if profile is not None:
+                                profile.start("rerouting")
+                        queue_length = np.zeros(net.num_nodes)
+                        for node in active:
+                                queue_length[node] = len(queues[node])
+                        costs = travel_cost + np.array(occupancy) / capacity.flow + (queue_length / out_flow)[net.indices]
+                        next_entry = _next_entries(net, sink_tree_costs(net, end, costs), end)
+                        if profile is not None:
+                                profile.stop("rerouting")
+                tick_active = len(active)
+                while on_edges and on_edges[0][0] == tick:
+                        _, driver, entry = heapq.heappop(on_edges)
+                        occupancy[entry] -= 1
+                        node = indices[entry]
+                        position[driver] = node
+                        if node == end:
+                                arrived += 1
+                                finish = tick
+                        else:
+                                queues[node].append(driver)
+                                active.add(node)
+                                if profile is not None:
+                                        profile.queue_length(node, len(queues[node]))
+
+                tick_moves = 0
+                for node in list(active):
+                        queue = queues[node]
+                        while queue:
+                                driver = queue[0]
+                                entry = wanted[driver]
+                                if entry < 0:
+                                        # at each step cause a bad driver to make a wrong turn with given prob.
+                                        if is_bad[driver] and random.random() < prob_wrong_turn:
+                                                entry = random.randrange(indptr[node], indptr[node + 1])
+                                                if profile is not None:
+                                                        profile.count("wrong_turns")
+                                        else:
+                                                entry = next_entry[node]
+                                        wanted[driver] = entry
+                                if credit_tick[entry] != tick:
+                                        credit[entry] = min(most_credit[entry],
+                                                            credit[entry] + flow[entry] * (tick - credit_tick[entry]))
+                                        credit_tick[entry] = tick
+                                if credit[entry] < 1 or occupancy[entry] >= storage[entry]:
+                                        if profile is not None:
+                                                profile.count("blocked")
+                                        break
+                                credit[entry] -= 1
+                                occupancy[entry] += 1
+                                queue.popleft()
+                                wanted[driver] = -1
+                                moves[driver] += 1
+                                tick_moves += 1
+                                heapq.heappush(on_edges, (tick + travel_ticks[entry], driver, entry))
+                        if not queue:
+                                active.discard(node)
+                if profile is not None:
+                        profile.tick(tick_moves, tick_active, arrived)
+
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        drivers.iterations += np.array(moves, dtype=drivers.iterations.dtype)
+        drivers.node[:] = net.node_ids[position]
+        if reason is not None:
+                return PartialResult(reason, tick, drivers, np.array(position) == end)
+        return finish
+
+
+def run_model_od(drivers, network: nx.Graph(), prob_wrong_turn: float, trees: SinkTrees = None,
+                 profile: RunProfile = None, limits: RunLimits = None):
+        """
+        run_model_od runs a model where every driver drives from its own
+        origin to its own destination and enters the network at its
+        departure tick, e.g. the drivers of scenarios.od_drivers. Drivers
+        follow the sink tree of their destination, so one search per
+        distinct destination routes all of them
+
+        Params:
+        drivers: DriverArrays with node set to the origin node id, dest to
+        the destination node id and depart to the departure tick of every
+        driver; it is reset and left with this run's iterations, arrival
+        ticks and end nodes, so node must be set to the origins again
+        before the same drivers run twice
+        network: CompiledNet or networkx graph object
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        trees: routing.SinkTrees of the network to reuse trees across
+        runs, a new one when not given
+        profile: profiling.RunProfile that records routing time, ticks,
+        moves, wrong turns and peak queue lengths, none when None
+        limits: limits.RunLimits of the run, it runs until every driver
+        arrived or is stranded when None
+
+        Returns:
+        tick of the last arrival, or a limits.PartialResult when a limit
+        stopped the run. A driver whose wrong turn takes it to a node that
+        cannot reach its destination is stranded: it leaves the road there
+        with arrive -1 and no longer holds up the run
+        """
+
+        started = time.perf_counter()
+        net = as_compiled(network)
+        drivers = as_driver_arrays(drivers)
+        drivers.reset()
+        is_bad = (drivers.state == drivers.code("bad")).tolist()
+        num_drivers = len(drivers)
+        origins = net.to_index(drivers.node)
+        dests = net.to_index(drivers.dest)
+        if profile is not None:
+                profile.start("routing")
+        if trees is None:
+                trees = SinkTrees(net, weight="length")
+        sinks, dest_slot = np.unique(dests, return_inverse=True)
+        trees.build(sinks)
+        sink_trees = [trees.tree(end) for end in sinks.tolist()]
+        for slot, next_hop in enumerate(sink_trees):
+                stranded = np.count_nonzero(next_hop[origins[dest_slot == slot]] < 0)
+                if stranded:
+                        raise nx.NetworkXNoPath(f"{stranded} drivers cannot reach node {net.node_ids[sinks[slot]]}.")
+        # Drivers with the same destination share one list of its tree
+        hop_lists = [next_hop.tolist() for next_hop in sink_trees]
+        hop = [hop_lists[slot] for slot in dest_slot.tolist()]
+        if profile is not None:
+                profile.stop("routing")
+
+        indptr = net.indptr.tolist()
+        indices = net.indices.tolist()
+        depart = np.maximum(drivers.depart, 0)
+        # Drivers waiting to depart, in order of departure
+        order = np.argsort(depart, kind="stable").tolist()
+        depart = depart.tolist()
+        dest = dests.tolist()
+        position = origins.tolist()
+        arrive = [-1] * num_drivers
+        moves = [0] * num_drivers
+        queues = defaultdict(deque)
+        active = set()
+        waiting = 0
+        arrived = 0
+        stranded = 0
+        tick = 0
+        last_arrival = 0
+        reason = None
+
+        while arrived + stranded < num_drivers:
+                if not active and waiting < num_drivers and depart[order[waiting]] > tick:
+                        # Nobody on the road, skip to the next departure; an
+                        # empty road is not a stall
+                        tick = depart[order[waiting]]
+                        last_arrival = tick
+                if limits is not None:
+                        reason = limits.exceeded(tick, last_arrival, started)
+                        if reason is not None:
+                                break
+                while waiting < num_drivers and depart[order[waiting]] <= tick:
+                        driver = order[waiting]
+                        waiting += 1
+                        node = position[driver]
+                        if node == dest[driver]:
+                                arrive[driver] = tick
+                                arrived += 1
+                                last_arrival = tick
+                                continue
+                        queues[node].append(driver)
+                        active.add(node)
+                        if profile is not None:
+                                profile.queue_length(node, len(queues[node]))
+                tick += 1
+                tick_moves = 0
+                tick_active = len(active)
+                for node in list(active):
+                        queue = queues[node]
+                        if not queue:
+                                active.discard(node)
+                                continue
+                        driver = queue.popleft()
+                        # at each step cause a bad driver to make a wrong turn with given prob.
+                        if is_bad[driver] and random.random() < prob_wrong_turn:
+                                next_step = indices[random.choice(range(indptr[node], indptr[node + 1]))]
+                                if profile is not None:
+                                        profile.count("wrong_turns")
+                        else:
+                                next_step = hop[driver][node]
+                        position[driver] = next_step
+                        moves[driver] += 1
+                        tick_moves += 1
+                        if next_step == dest[driver]:
+                                arrive[driver] = tick
+                                arrived += 1
+                                last_arrival = tick
+                        elif hop[driver][next_step] < 0:
+                                # Off its tree for good, no route leads back
+                                stranded += 1
+                                if profile is not None:
+                                        profile.count("stranded")
+                        else:
+                                queues[next_step].append(driver)
+                                active.add(next_step)
+                                if profile is not None:
+                                        profile.queue_length(next_step, len(queues[next_step]))
+                        if not queue:
+                                active.discard(node)
+                if profile is not None:
+                        profile.tick(tick_moves, tick_active, arrived)
+
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        drivers.iterations += np.array(moves, dtype=drivers.iterations.dtype)
+        drivers.node[:] = net.node_ids[position]
+        drivers.arrive[:] = arrive
+        if reason is not None:
+                return PartialResult(reason, tick, drivers, drivers.arrive >= 0)
+        return last_arrival
+
+
+def run_model_schedule(schedule, network: nx.Graph(), prob_wrong_turn: float, trees: SinkTrees = None,
+                       states: list = ["good", "bad"], results: ResultsSink = None,
+                       profile: RunProfile = None, limits: RunLimits = None):
+        """
+        run_model_schedule runs a model whose drivers come from a departure
+        schedule, e.g. schedules.scheduled_drivers. A driver is only taken
+        from the schedule on its departure tick and dropped once it
+        arrives, so memory grows with the drivers on the road rather than
+        with all drivers of the run, and a whole day of traffic fits.
+        Drivers follow the sink tree of their destination like in
+        run_model_od
+
+        Params:
+        schedule: iterable of schedules.Departure in order of departure
+        network: CompiledNet or networkx graph object
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        trees: routing.SinkTrees of the network to reuse trees across
+        runs, a new one when not given
+        states: state of drivers, the state codes of the schedule index it
+        results: results.ResultsSink the arrival curves and the iterations
+        of every driver are streamed to as drivers arrive, none when None
+        profile: profiling.RunProfile that records routing time, ticks,
+        moves, wrong turns and peak queue lengths, none when None
+        limits: limits.RunLimits of the run, it runs until the schedule is
+        done and every driver arrived or is stranded when None
+
+        Returns:
+        tick of the last arrival, or a limits.PartialResult when a limit
+        stopped the run, whose drivers are the ones on the road, whose
+        arrived counts every driver that arrived and whose stranded counts
+        every stranded driver. A driver whose wrong turn takes it to a node
+        that cannot reach its destination is stranded like in run_model_od
+        """
+
+        started = time.perf_counter()
+        net = as_compiled(network)
+        bad_code = states.index("bad")
+        if trees is None:
+                trees = SinkTrees(net, weight="length")
+        indptr = net.indptr.tolist()
+        indices = net.indices.tolist()
+        index_of = net.index_of
+        # Next hop lists of the destinations seen so far
+        hop_lists = dict()
+        # Drivers on the road live in slots, reused once a driver arrives
+        slot_id = []
+        slot_state = []
+        slot_position = []
+        slot_dest = []
+        slot_hop = []
+        slot_moves = []
+        free_slots = []
+        queues = defaultdict(deque)
+        active = set()
+        arrived = [0] * len(states)
+        stranded = [0] * len(states)
+        done_ids = []
+        done_states = []
+        done_moves = []
+        if results is not None:
+                run_id = results.start_run(model="run_model_schedule", prob_wrong_turn=prob_wrong_turn,
+                                           states=states)
+                curves = [ArrivalCurve(results, run_id, code) for code in range(len(states))]
+
+        def finish(slot: int) -> None:
+                arrived[slot_state[slot]] += 1
+                if results is not None:
+                        curves[slot_state[slot]].update(arrived[slot_state[slot]], tick)
+                        done_ids.append(slot_id[slot])
+                        done_states.append(slot_state[slot])
+                        done_moves.append(slot_moves[slot])
+                        if len(done_ids) >= 4096:
+                                results.drivers(run_id, done_ids, done_states, done_moves)
+                                done_ids.clear()
+                                done_states.clear()
+                                done_moves.clear()
+                slot_hop[slot] = None
+                free_slots.append(slot)
+
+        schedule = iter(schedule)
+        pending = next(schedule, None)
+        tick = 0
+        last_arrival = 0
+        reason = None
+
+        while pending is not None or active:
+                if not active and pending.tick > tick:
+                        # Nobody on the road, skip to the next departure; an
+                        # empty road is not a stall
+                        tick = pending.tick
+                        last_arrival = tick
+                if limits is not None:
+                        reason = limits.exceeded(tick, last_arrival, started)
+                        if reason is not None:
+                                break
+                while pending is not None and pending.tick <= tick:
+                        origin = index_of[pending.origin]
+                        dest = index_of[pending.dest]
+                        if dest not in hop_lists:
+                                if profile is not None:
+                                        profile.start("routing")
+                                hop_lists[dest] = trees.tree(dest).tolist()
+                                if profile is not None:
+                                        profile.stop("routing")
+                        if hop_lists[dest][origin] < 0:
+                                raise nx.NetworkXNoPath(f"Driver {pending.id} cannot reach node {pending.dest}.")
+                        if free_slots:
+                                slot = free_slots.pop()
+                        else:
+                                slot = len(slot_id)
+                                for column in (slot_id, slot_state, slot_position, slot_dest, slot_hop, slot_moves):
+                                        column.append(None)
+                        slot_id[slot] = pending.id
+                        slot_state[slot] = pending.state
+                        slot_position[slot] = origin
+                        slot_dest[slot] = dest
+                        slot_hop[slot] = hop_lists[dest]
+                        slot_moves[slot] = 0
+                        if origin == dest:
+                                finish(slot)
+                                last_arrival = tick
+                        else:
+                                queues[origin].append(slot)
+                                active.add(origin)
+                                if profile is not None:
+                                        profile.queue_length(origin, len(queues[origin]))
+                        pending = next(schedule, None)
+                if not active:
+                        continue
+                tick += 1
+                tick_moves = 0
+                tick_active = len(active)
+                for node in list(active):
+                        queue = queues[node]
+                        if not queue:
+                                active.discard(node)
+                                continue
+                        slot = queue.popleft()
+                        # at each step cause a bad driver to make a wrong turn with given prob.
+                        if slot_state[slot] == bad_code and random.random() < prob_wrong_turn:
+                                next_step = indices[random.choice(range(indptr[node], indptr[node + 1]))]
+                                if profile is not None:
+                                        profile.count("wrong_turns")
+                        else:
+                                next_step = slot_hop[slot][node]
+                        slot_position[slot] = next_step
+                        slot_moves[slot] += 1
+                        tick_moves += 1
+                        if next_step == slot_dest[slot]:
+                                finish(slot)
+                                last_arrival = tick
+                        elif slot_hop[slot][next_step] < 0:
+                                # Off its tree for good, no route leads back
+                                stranded[slot_state[slot]] += 1
+                                if profile is not None:
+                                        profile.count("stranded")
+                                slot_hop[slot] = None
+                                free_slots.append(slot)
+                        else:
+                                queues[next_step].append(slot)
+                                active.add(next_step)
+                                if profile is not None:
+                                        profile.queue_length(next_step, len(queues[next_step]))
+                        if not queue:
+                                active.discard(node)
+                                del queues[node]
+                if profile is not None:
+                        profile.tick(tick_moves, tick_active, sum(arrived))
+
+        if profile is not None:
+                profile.finish(node_ids=net.node_ids)
+        if results is not None:
+                for curve in curves:
+                        curve.close()
+                if done_ids:
+                        results.drivers(run_id, done_ids, done_states, done_moves)
+                results.end_run(run_id, iterations=tick, num_drivers=sum(arrived), stranded=sum(stranded),
+                                stopped_by=reason)
+        if reason is not None:
+                on_road = [slot for slot in range(len(slot_id)) if slot_hop[slot] is not None]
+                drivers = DriverArrays(ids=[slot_id[slot] for slot in on_road],
+                                       state=[slot_state[slot] for slot in on_road], states=states,
+                                       iterations=[slot_moves[slot] for slot in on_road],
+                                       node=net.node_ids[[slot_position[slot] for slot in on_road]],
+                                       dest=net.node_ids[[slot_dest[slot] for slot in on_road]])
+                partial = PartialResult(reason, tick, drivers, np.zeros(len(on_road), dtype=bool))
+                partial.arrived = dict(zip(states, arrived))
+                partial.stranded = dict(zip(states, stranded))
+                partial.num_drivers += sum(arrived) + sum(stranded)
+                return partial
+        return last_arrival
+
+
+def run_model_rand_init(driver_list, net: nx.Graph, prob_wrong_turn: float, trees: SinkTrees = None,
+                        results: ResultsSink = None):
+        """
+        run_model_rand_init runs a model where every driver starts at a
+        random node and drives to its own random destination
+
+        Params:
+        driver_list: DriverArrays or list of drivers from generate_drivers, a
+        DriverArrays is reset and left with this run's iterations and nodes
+        net: CompiledNet or networkx graph object
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        trees: routing.SinkTrees of net to reuse trees across runs, a new
+        one when not given
+        results: results.ResultsSink the arrival curves and driver
+        iterations are streamed to while running, none when None
+
+        Returns:
+        iterations of each driver divided by its initial path length,
+        dataframe of good driver completions, dataframe of bad driver
+        completions and the average initial path length
+        """
+
+        net = as_compiled(net)
+        drivers = as_driver_arrays(driver_list)
+        drivers.reset()
+        bad_code = drivers.code("bad")
+        num_drivers = len(drivers)
+        curr_nodes = random.choices(range(net.num_nodes), k=num_drivers)
+        end_nodes = random.choices(range(net.num_nodes), k=num_drivers)
+        # Drivers follow the sink tree of their destination, so a wrong turn
+        # needs no new search; one search per distinct destination builds
+        # every initial path
+        if trees is None:
+                trees = SinkTrees(net, weight="length")
+        offsets, _ = trees.paths(curr_nodes, end_nodes)
+        path_length = np.diff(offsets)
+        hops = [trees.tree(end) for end in end_nodes]
+        queues = defaultdict(deque)
+        for i in range(num_drivers):
+                queues[curr_nodes[i]].append(i)
+        position = list(curr_nodes)
+        complete = np.zeros(num_drivers, dtype=bool)
+
+        incomplete = 1
+        iteration = 0
+        good_finished = 0
+        bad_finished = 0
+        comp_good = dict()
+        comp_bad = dict()
+        if results is not None:
+                run_id = results.start_run(model="run_model_rand_init", num_drivers=num_drivers,
+                                           prob_wrong_turn=prob_wrong_turn, states=drivers.states)
+                curve_good = ArrivalCurve(results, run_id, drivers.code("good"))
+                curve_bad = ArrivalCurve(results, run_id, bad_code)
+        while incomplete != 0:
+                incomplete = 0
+                pop_nodes = []
+                for i in range(num_drivers):
+                        if not complete[i]:
+                                node = position[i]
+                                if queues[node][0] == i:
+                                        if node == end_nodes[i]:
+                                                complete[i] = True
+                                                if drivers.state[i] != bad_code:
+                                                        good_finished += 1
+                                                else:
+                                                        bad_finished += 1
+                                        else:
+                                                wrong_turn = False
+                                                if drivers.state[i] == bad_code:
+                                                        turn_choice = random.choices(["on_path", "off_path"],
+                                                                                     [1-prob_wrong_turn, prob_wrong_turn])[0]
+                                                        if turn_choice == "off_path":
+                                                                wrong_turn = True
+                                                if wrong_turn:
+                                                        next_node = int(random.choice(net.neighbors(node)))
+                                                else:
+                                                        next_node = int(hops[i][node])
+                                                queues[next_node].append(i)
+                                                position[i] = next_node
+                                        # Mark node for popping
+                                        pop_nodes.append(node)
+                        if not complete[i]:
+                                incomplete += 1
+                                drivers.iterations[i] += 1
+                iteration += 1
+                if good_finished != 0:
+                        comp_good[good_finished] = iteration
+                        if results is not None:
+                                curve_good.update(good_finished, iteration)
+                if bad_finished != 0:
+                        comp_bad[bad_finished] = iteration
+                        if results is not None:
+                                curve_bad.update(bad_finished, iteration)
+                for node in pop_nodes:
+                        queues[node].popleft()
+
+        drivers.node[:] = net.node_ids[position]
+        drivers.dest[:] = net.node_ids[end_nodes]
+        iteration_list = list(drivers.iterations / path_length)
+        final_good = pd.DataFrame.from_dict(comp_good, orient='index')
+        final_bad = pd.DataFrame.from_dict(comp_bad, orient='index')
+        av_path_length = path_length.sum() / num_drivers
+        if results is not None:
+                curve_good.close()
+                curve_bad.close()
+                results.drivers(run_id, drivers.ids, drivers.state, drivers.iterations)
+                results.end_run(run_id, iterations=iteration, av_path_length=av_path_length)
 
+        return iteration_list, final_good, final_bad, av_path_length
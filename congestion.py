@@ -0,0 +1,74 @@
+import numpy as np
+
+# Lanes per direction of every road class, classes not listed get one
+LANES = {'motorway': 2,
+         'trunk': 2,
+         'primary': 2,
+         'secondary': 1,
+         'tertiary': 1,
+         'unclassified': 1,
+         'residential': 1,
+         'service': 1,
+         'motorway_link': 1,
+         'trunk_link': 1,
+         'primary_link': 1,
+         'secondary_link': 1,
+         'motorway_junction': 1}
+# Speed used when an edge has none, the fallback of gen_data
+FALLBACK_SPEED_KPH = 80.4672
+# Road taken by a stopped car and time gap kept by a moving one
+JAM_SPACING = 7.5
+REACTION_TIME = 1.5
+
+
+class EdgeCapacity:
+    """
+    EdgeCapacity holds the congestion limits of every adjacency entry of a
+    CompiledNet, as arrays aligned with its indices
+
+    Params:
+    flow: drivers the edge takes in per tick
+    storage: most drivers on the edge at once
+    travel_ticks: ticks a driver needs to cross the edge
+    tick_seconds: length of a tick in seconds
+    """
+
+    def __init__(self, flow: np.ndarray, storage: np.ndarray, travel_ticks: np.ndarray, tick_seconds: float):
+        self.flow = flow
+        self.storage = storage
+        self.travel_ticks = travel_ticks
+        self.tick_seconds = tick_seconds
+
+
+def edge_capacities(net, tick_seconds: float = 1.0) -> EdgeCapacity:
+    """
+    edge_capacities derives the capacity of every edge from its road class
+    and speed: the class gives the lanes, the speed the flow of one lane
+    (one car every JAM_SPACING plus REACTION_TIME of road), lanes times
+    length the cars that fit on it and the travel time the ticks to cross
+    it. Edges without a class get one lane, edges without a speed
+    FALLBACK_SPEED_KPH
+
+    Params:
+    net: CompiledNet, best with speed_kph, highway and travel_time
+    tick_seconds: length of a tick in seconds
+
+    Returns:
+    EdgeCapacity of the network
+    """
+
+    num_entries = len(net.indices)
+    if net.highway is None:
+        lanes = np.ones(num_entries)
+    else:
+        lanes = np.array([LANES.get(road, 1) for road in net.highway.tolist()], dtype=np.float64)
+    speed = np.full(num_entries, FALLBACK_SPEED_KPH) if net.speed_kph is None else net.speed_kph.copy()
+    speed[~(speed > 0)] = FALLBACK_SPEED_KPH
+    speed = speed / 3.6
+    flow = lanes * speed / (JAM_SPACING + speed * REACTION_TIME) * tick_seconds
+    storage = np.maximum(1, np.floor(lanes * net.length / JAM_SPACING)).astype(np.int64)
+    travel_time = net.length / speed
+    if net.travel_time is not None:
+        travel_time = np.where(net.travel_time > 0, net.travel_time, travel_time)
+    travel_ticks = np.maximum(1, np.ceil(travel_time / tick_seconds)).astype(np.int64)
+    return EdgeCapacity(flow, storage, travel_ticks, tick_seconds)
@@ -0,0 +1,221 @@
+import numpy as np
+
+
+class DriverArrays:
+    """
+    DriverArrays stores a population of drivers as one numpy array per
+    attribute instead of one dict per driver
+
+    Params:
+    ids: driver ids
+    state: state code of each driver, an index into states
+    states: names of the driver states
+    iterations: number of moves made by each driver
+    node: current node of each driver (-1 when not on the network)
+    dest: destination node of each driver (-1 when unset)
+    path_capacity: number of visited nodes to record per driver, 0 to
+    disable the path buffer
+    grow_paths: double the path buffer when a driver fills it instead of
+    dropping further steps
+    depart: tick each driver enters the network (0 when unset)
+    arrive: tick each driver reached its destination (-1 until then)
+    """
+
+    def __init__(self, ids: np.ndarray, state: np.ndarray, states: list,
+                 iterations: np.ndarray = None, node: np.ndarray = None,
+                 dest: np.ndarray = None, path_capacity: int = 0, grow_paths: bool = False,
+                 depart: np.ndarray = None, arrive: np.ndarray = None):
+        num_drivers = len(ids)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.state = np.asarray(state, dtype=np.int8)
+        self.states = list(states)
+        self.iterations = (np.zeros(num_drivers, dtype=np.int64) if iterations is None
+                           else np.asarray(iterations, dtype=np.int64))
+        self.node = (np.full(num_drivers, -1, dtype=np.int64) if node is None
+                     else np.asarray(node, dtype=np.int64))
+        self.dest = (np.full(num_drivers, -1, dtype=np.int64) if dest is None
+                     else np.asarray(dest, dtype=np.int64))
+        self.depart = (np.zeros(num_drivers, dtype=np.int64) if depart is None
+                       else np.asarray(depart, dtype=np.int64))
+        self.arrive = (np.full(num_drivers, -1, dtype=np.int64) if arrive is None
+                       else np.asarray(arrive, dtype=np.int64))
+        self.path = np.full((num_drivers, path_capacity), -1, dtype=np.int64)
+        self.path_len = np.zeros(num_drivers, dtype=np.int64)
+        self.grow_paths = grow_paths
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def code(self, state: str) -> int:
+        """
+        code returns the state code used in the state array
+
+        Params:
+        state: name of the state
+
+        Returns:
+        integer code of the state
+        """
+
+        return self.states.index(state)
+
+    def record_step(self, driver: int, node: int) -> None:
+        """
+        record_step appends a node to a driver's path buffer, dropping it
+        once the buffer is full unless grow_paths is set
+
+        Params:
+        driver: row of the driver
+        node: node the driver moved to
+
+        Returns:
+        None
+        """
+
+        pos = self.path_len[driver]
+        if pos == self.path.shape[1] and self.grow_paths:
+            grown = np.full((len(self), max(16, 2 * pos)), -1, dtype=np.int64)
+            grown[:, :pos] = self.path
+            self.path = grown
+        if pos < self.path.shape[1]:
+            self.path[driver, pos] = node
+            self.path_len[driver] = pos + 1
+
+    def reset(self) -> None:
+        """
+        reset clears what a run writes per driver, the iterations, path
+        buffer and arrival ticks, so one population can be run again
+        without counts adding up across runs. The models call it at the
+        start of every run and leave that run's values behind
+
+        Params:
+        None
+
+        Returns:
+        None
+        """
+
+        self.iterations[:] = 0
+        self.path[:] = -1
+        self.path_len[:] = 0
+        self.arrive[:] = -1
+
+    def paths(self, driver: int) -> list:
+        """
+        paths returns the recorded path of one driver
+
+        Params:
+        driver: row of the driver
+
+        Returns:
+        list of the nodes the driver moved to
+        """
+
+        return self.path[driver, :self.path_len[driver]].tolist()
+
+    def write_back(self, drivers: list) -> None:
+        """
+        write_back copies iterations and recorded paths into the list of
+        dicts the drivers were made from, the way the models updated those
+        dicts before they ran on arrays
+
+        Params:
+        drivers: list of drivers given to as_driver_arrays
+
+        Returns:
+        None
+        """
+
+        for i, driver in enumerate(drivers):
+            value = driver[list(driver.keys())[0]]
+            if isinstance(value, dict):
+                value['Iterations'] = int(self.iterations[i])
+            if 'Path' in driver:
+                driver['Path'] = self.paths(i)
+
+    def to_list(self) -> list:
+        """
+        to_list converts the drivers back to the list of dicts made by
+        complex_model.generate_drivers, with a 'Path' list per driver when
+        paths are recorded
+
+        Params:
+        None
+
+        Returns:
+        list of drivers and their state
+        """
+
+        drivers = [{key: {'State': self.states[code], 'Iterations': int(its)}}
+                   for key, code, its in zip(self.ids, self.state, self.iterations)]
+        if self.path.shape[1] or self.grow_paths:
+            for i, driver in enumerate(drivers):
+                driver['Path'] = self.paths(i)
+        return drivers
+
+
+def gen_driver_arrays(num_drivers: int, bad_driver_prop: float, states: list = ["good", "bad"],
+                      seed=None, path_capacity: int = 0) -> DriverArrays:
+    """
+    gen_driver_arrays draws every driver's state in one vectorized call
+
+    Params:
+    num_drivers: total number of drivers
+    bad_driver_prop: proportion of bad drivers on the network
+    states: state of drivers, the second one is drawn with bad_driver_prop
+    seed: seed or numpy.random.Generator used to draw the states
+    path_capacity: number of visited nodes to record per driver
+
+    Returns:
+    DriverArrays of the drivers
+    """
+
+    rng = np.random.default_rng(seed)
+    state = (rng.random(num_drivers) < bad_driver_prop).astype(np.int8)
+    return DriverArrays(ids=np.arange(1, num_drivers + 1), state=state, states=states,
+                        path_capacity=path_capacity)
+
+
+def as_driver_arrays(drivers, states: list = ["good", "bad"]) -> DriverArrays:
+    """
+    as_driver_arrays accepts drivers in any of the formats used by the
+    models and returns them as DriverArrays
+
+    Params:
+    drivers: DriverArrays, or a list of {id: state} or
+    {id: {'State': state, 'Iterations': n}} dicts, dicts with a 'Path'
+    list get their paths recorded
+    states: state of drivers
+
+    Returns:
+    DriverArrays of the drivers, a list is copied so write_back is
+    needed to see the results in it
+    """
+
+    if isinstance(drivers, DriverArrays):
+        return drivers
+
+    ids = []
+    codes = []
+    iterations = []
+    paths = []
+    for driver in drivers:
+        paths.append(driver.get('Path'))
+        key = list(driver.keys())[0]
+        value = driver[key]
+        if isinstance(value, dict):
+            state = value['State']
+            iterations.append(value.get('Iterations', 0))
+        else:
+            state = value
+            iterations.append(0)
+        ids.append(key)
+        codes.append(states.index(state))
+    if all(path is None for path in paths):
+        return DriverArrays(ids=ids, state=codes, states=states, iterations=iterations)
+    arrays = DriverArrays(ids=ids, state=codes, states=states, iterations=iterations,
+                          path_capacity=max(16, max(len(path or []) for path in paths)), grow_paths=True)
+    for i, path in enumerate(paths):
+        for node in path or []:
+            arrays.record_step(i, node)
+    return arrays
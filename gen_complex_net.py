@@ -1,22 +1,176 @@
+import hashlib
+import json
+import os
 import osmnx as ox
 import networkx as nx
+import numpy as np
+import pandas as pd
 import geopandas
+from collections import deque
+from compiled_net import compile_edges
+
+GRAPHML_PATH = 'btv_20km_streets.graphml'
+EDGE_CACHE_PATH = 'btv_20km_streets.npz'
+# Bump when the layout of the edge cache changes
+EDGE_CACHE_VERSION = 2
+EDGE_CACHE_COLUMNS = ["u", "v", "key", "length", "speed_kph", "travel_time", "highway"]
+# routing.LandmarkIndex of the compiled network, next to the edge cache
+LANDMARK_PATH = 'btv_20km_streets.landmarks.npz'
+
+SPEED_LIMITS = {'motorway' : 104.67,
+                'trunk' : 64.3738,
+                'primary' : 80.4672,
+                'secondary' : 80.4672, 
+                'tertiary' : 80.4672, 
+                'unclassified' : 80.4672, 
+                'residential' : 40.2336, 
+                'service' : 40.2336, 
+                'motorway_link' : 80.4672, 
+                'trunk_link' : 64.3738, 
+                'primary_link' : 104.67, 
+                'secondary_link' : 104.67, 
+                'motorway_junction' : 104.67}
+
+
+def edge_cache_settings() -> str:
+    """
+    edge_cache_settings hashes what the edge cache depends on besides the
+    graphml file
+
+    Params:
+    None
+
+    Returns:
+    hex digest of the cache version and the speed limit table
+    """
+
+    digest = hashlib.sha256()
+    digest.update(str(EDGE_CACHE_VERSION).encode())
+    digest.update(json.dumps(SPEED_LIMITS, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def edge_cache_key(graphml_path: str) -> str:
+    """
+    edge_cache_key hashes everything the edge cache depends on
+
+    Params:
+    graphml_path: path of the source graphml file
+
+    Returns:
+    hex digest of the cache version, the speed limit table and the
+    graphml file
+    """
+
+    digest = hashlib.sha256()
+    digest.update(edge_cache_settings().encode())
+    with open(graphml_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_stamp(graphml_path: str) -> np.ndarray:
+    """
+    source_stamp reads the size and modification time of the graphml
+    file, which tell whether it changed without reading it
+
+    Params:
+    graphml_path: path of the source graphml file
+
+    Returns:
+    int64 array of the size in bytes and the mtime in nanoseconds
+    """
+
+    stat = os.stat(graphml_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load_edge_cache(cache_path: str, graphml_path: str) -> pd.DataFrame:
+    """
+    load_edge_cache reads the binary edge cache if it matches the graphml
+    file. A cache stamped with the file's current size and mtime is used
+    as it is; otherwise the file is hashed, and a cache whose content
+    still matches is stamped again so the next load skips the hash
+
+    Params:
+    cache_path: path of the .npz edge cache
+    graphml_path: path of the source graphml file
+
+    Returns:
+    data frame of edges, or None if the cache is missing or stale
+    """
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            stamped = (str(cache["settings"]) == edge_cache_settings()
+                       and np.array_equal(cache["source_stamp"], source_stamp(graphml_path)))
+            key = None if stamped else edge_cache_key(graphml_path)
+            if not stamped and str(cache["cache_key"]) != key:
+                return None
+            edges = pd.DataFrame({column: cache[column] for column in EDGE_CACHE_COLUMNS})
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+    if not stamped:
+        save_edge_cache(cache_path, graphml_path, edges, key=key)
+    return edges
+
+
+def save_edge_cache(cache_path: str, graphml_path: str, edges: pd.DataFrame, key: str = None) -> None:
+    """
+    save_edge_cache writes the edge columns used by the models to a
+    binary cache next to the graphml file
+
+    Params:
+    cache_path: path of the .npz edge cache
+    graphml_path: path of the source graphml file
+    edges: edge data frame from graph_to_gdfs
+    key: edge_cache_key of the graphml file, hashed when None
+
+    Returns:
+    None
+    """
+
+    if key is None:
+        key = edge_cache_key(graphml_path)
+    edges = edges.reset_index()
+    missing = pd.Series(np.nan, index=edges.index)
+    # Simplified edges can carry a list of road classes, keep the first
+    highway = [h[0] if isinstance(h, list) else str(h) for h in edges.get("highway", missing.fillna(""))]
+    np.savez(cache_path,
+             cache_key=np.array(key),
+             settings=np.array(edge_cache_settings()),
+             source_stamp=source_stamp(graphml_path),
+             u=edges["u"].to_numpy(dtype=np.int64),
+             v=edges["v"].to_numpy(dtype=np.int64),
+             key=edges["key"].to_numpy(dtype=np.int64),
+             length=edges["length"].to_numpy(dtype=np.float64),
+             speed_kph=edges.get("speed_kph", missing).to_numpy(dtype=np.float64),
+             travel_time=edges.get("travel_time", missing).to_numpy(dtype=np.float64),
+             highway=np.array(highway, dtype=str))
+
 
 def gen_data()-> geopandas.geodataframe.GeoDataFrame:
 
     """
 
-    gen_net gathers network data for Chittendan County
+    gen_net gathers network data for Chittendan County, read from the
+    binary edge cache when it matches btv_20km_streets.graphml
 
     Params: 
     None
 
     Retuns:
-    network digraph
+    data frame of edges (without geometry when read from the cache)
     """
 
+    if os.path.exists(GRAPHML_PATH):
+        edges = load_edge_cache(EDGE_CACHE_PATH, GRAPHML_PATH)
+        if edges is not None:
+            return edges
+
     try:
-        streets_graph = ox.io.load_graphml('btv_20km_streets.graphml')
+        streets_graph = ox.io.load_graphml(GRAPHML_PATH)
     except FileNotFoundError:
         streets_graph = ox.graph_from_place('Burlington, Vermont',
                                             network_type ='drive',
@@ -27,55 +181,52 @@ def gen_data()-> geopandas.geodataframe.GeoDataFrame:
                                             buffer_dist = 20000,
                                             clean_periphery = True,
                                             custom_filter = None)
-        
-        speed_limits = {'motorway' : 104.67,
-                        'trunk' : 64.3738,
-                        'primary' : 80.4672,
-                        'secondary' : 80.4672, 
-                        'tertiary' : 80.4672, 
-                        'unclassified' : 80.4672, 
-                        'residential' : 40.2336, 
-                        'service' : 40.2336, 
-                        'motorway_link' : 80.4672, 
-                        'trunk_link' : 64.3738, 
-                        'primary_link' : 104.67, 
-                        'secondary_link' : 104.67, 
-                        'motorway_junction' : 104.67}
 
         streets_graph = ox.projection.project_graph(streets_graph)
 
         streets_graph = ox.speed.add_edge_speeds(G = streets_graph,
-                                                hwy_speeds = speed_limits,
+                                                hwy_speeds = SPEED_LIMITS,
                                                 fallback = 80.4672,
                                                 precision = 4)
 
         streets_graph = ox.speed.add_edge_travel_times(G = streets_graph,
                                                         precision = 2)
         
-        ox.io.save_graphml(streets_graph, filepath = "btv_20km_streets.graphml", 
+        ox.io.save_graphml(streets_graph, filepath = GRAPHML_PATH, 
         encoding='utf-8')
     
-    return ox.utils_graph.graph_to_gdfs(streets_graph)[1]
+    edges = ox.utils_graph.graph_to_gdfs(streets_graph)[1]
+    save_edge_cache(EDGE_CACHE_PATH, GRAPHML_PATH, edges)
+    return edges
 
 
-def gen_net(data: geopandas.geodataframe.GeoDataFrame, node_vals: list) -> nx.Graph():
+def gen_net(data: geopandas.geodataframe.GeoDataFrame, node_vals: list, compiled: bool = False) -> nx.Graph():
     """
     gen_net generates the road networok from the subset of data
 
     Params:
     data: geopandas data frame of road features
     node_vals: names of nodes and their weights
+    compiled: return a CompiledNet with CSR adjacency instead of a
+    networkx graph, node_vals[2] becomes its length and the travel_time,
+    speed_kph and highway columns are kept when the data has them
 
     Returns:
-    netowrkx graph
+    netowrkx graph, or CompiledNet if compiled
     """
 
     data.reset_index(inplace=True)
+    if compiled:
+        # Simplified edges can carry a list of road classes, keep the first
+        road = {column: data[column].to_numpy() for column in ("travel_time", "speed_kph") if column in data}
+        if "highway" in data:
+            road["highway"] = np.array([h[0] if isinstance(h, list) else str(h) for h in data["highway"]])
+        return compile_edges(data[node_vals[0]].to_numpy(), data[node_vals[1]].to_numpy(),
+                             length=data[node_vals[2]].to_numpy(), **road)
     data_node_ats = data[node_vals]
     G =nx.from_pandas_edgelist(data_node_ats, source=node_vals[0], target=node_vals[1],
                                 edge_attr=node_vals[2], create_using=nx.Graph())
-    nx.set_node_attributes(G, values=[], name="Queue")
     for node in G.nodes:
-        G.nodes[node]["Queue"] = []
+        G.nodes[node]["Queue"] = deque()
 
     return G
@@ -4,8 +4,14 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import random
+import time
+from collections import deque
 from gen_complex_net import gen_net
 from gen_complex_net import gen_data
+from routing import sink_tree
+from drivers import as_driver_arrays
+from results import ArrivalCurve, ResultsSink
+from limits import PartialResult, RunLimits
 
 def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) -> list:
 	"""
@@ -22,25 +28,39 @@ def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) ->
 										 'Path' : list()} for key in np.arange(1,num_drivers+1, 1)]
 	return drivers
 
-def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int, prob_wrong_turn: float):
+def run_model(drivers, network: nx.Graph, origin_node: int, end_node: int, prob_wrong_turn: float, results: ResultsSink = None, limits: RunLimits = None):
 	"""
 	run_model runs a model with the given generated drivers
 	Params:
-	drivers: array of drivers of given attributes
+	drivers: DriverArrays or list of drivers from generate_drivers, a
+	DriverArrays is reset and left with this run's iterations and
+	nodes, a list gets them and the 'Path' of every bad driver written
+	back
 	network: networkx graph object
 	origin_node: node point of origin
 	end_node: node point of sink
 	prob_wrong_turn: probablity that bad driver makes a random turn
 	at a given node
+	results: results.ResultsSink the arrival curves and driver iterations
+	are streamed to while running, none when None
+	limits: limits.RunLimits of the run, ticks are passes over the active
+	nodes; stall_ticks catches good drivers stranded off their path. It
+	runs until every driver arrived when None
 	Returns:
 	number of iterations required for all drivers to get to final
-	destination
+	destination, or a limits.PartialResult holding them for the drivers
+	that arrived when a limit stopped the run
 	"""
-	nx.set_node_attributes(network,
-												 [],
-												 "Queue")
+	started = time.perf_counter()
+	# Every node gets its own queue, set_node_attributes would share one
+	for node in network.nodes:
+		network.nodes[node]["Queue"] = deque()
 
-	network.nodes[origin_node]["Queue"] = drivers
+	driver_list = drivers
+	drivers = as_driver_arrays(drivers)
+	drivers.reset()
+	drivers.node[:] = origin_node
+	network.nodes[origin_node]["Queue"].extend(range(len(drivers)))
 
 	good_driver_path = nx.shortest_path(network,
 																			source=origin_node,
@@ -48,11 +68,15 @@ def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int,
 																			method='dijkstra',
 																			weight="length")
 
-	init_drivers = [list(driver.keys())[0] for driver in network.nodes[origin_node]["Queue"]]
+	# One reverse search from the sink replaces a dijkstra search
+	# for every on-path move of a bad driver
+	next_hop = sink_tree(network, end_node, weight="length")
 
-	driver_states = [state for state in nx.get_node_attributes(network, 'State').values()]
+	good_code = drivers.code('good')
+	bad_code = drivers.code('bad')
 
-	end_drivers = list()
+	good_complete = 0
+	bad_complete = 0
 	comp_good = dict()
 	comp_bad = dict()
 	active_nodes = dict()
@@ -61,21 +85,38 @@ def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int,
 		active_nodes[i] = 1
 
 	iteration_check = 0
-
-	while len(end_drivers) == 0 or sorted(init_drivers) != sorted(end_drivers):
-		for node in active_nodes.keys():
+	ticks = 0
+	last_arrival = 0
+	reason = None
+
+	if results is not None:
+		run_id = results.start_run(model="burlington_traffic.run_model",
+															 num_drivers=len(drivers),
+															 origin_node=origin_node,
+															 end_node=end_node,
+															 prob_wrong_turn=prob_wrong_turn,
+															 states=drivers.states)
+		curve_good = ArrivalCurve(results, run_id, good_code)
+		curve_bad = ArrivalCurve(results, run_id, bad_code)
+
+	while good_complete + bad_complete < len(drivers):
+		if limits is not None:
+			reason = limits.exceeded(ticks, last_arrival, started)
+			if reason is not None:
+				break
+		ticks += 1
+		num_complete = good_complete + bad_complete
+		# Nodes reached by wrong turns join active_nodes while looping
+		for node in list(active_nodes):
 			if node != end_node:
 
 				try:
-					drivers = network.nodes[node]["Queue"]
-					first_out = drivers.pop(0)
-					driver_id = list(first_out.keys())[0]
-					state = first_out[driver_id]['State']
-					iterations = first_out[driver_id]['Iterations']
-					first_out[driver_id]['Iterations'] = iterations + 1
+					queue = network.nodes[node]["Queue"]
+					first_out = queue.popleft()
+					drivers.iterations[first_out] += 1
 					iteration_check = iteration_check + 1
 
-					if state == "good":
+					if drivers.state[first_out] == good_code:
 						current_node_ind = good_driver_path.index(node)
 						next_step = good_driver_path[current_node_ind + 1]
 						network.nodes[next_step]["Queue"].append(first_out)
@@ -88,16 +129,18 @@ def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int,
 							next_step = random.choice([n for n in network.neighbors(node)])
 
 						else:
-							bad_driver_path = nx.shortest_path(network,
-																								source = node,
-																								target = end_node,
-																								method = 'dijkstra',
-																								weight = "length")
-							current_node_ind = bad_driver_path.index(node)
-							next_step = bad_driver_path[current_node_ind + 1]
-							first_out[driver_id]['Path'].append(next_step)
+							next_step = next_hop[node]
+							drivers.record_step(first_out, next_step)
 						network.nodes[next_step]["Queue"].append(first_out)
 						active_nodes[node] = next_step
+					active_nodes[next_step] = 1
+					drivers.node[first_out] = next_step
+					# Keep running arrival counts instead of rescanning the end queue
+					if next_step == end_node:
+						if drivers.state[first_out] == good_code:
+							good_complete += 1
+						else:
+							bad_complete += 1
 				except IndexError:
 					active_nodes[node] = 0
 					continue
@@ -105,19 +148,21 @@ def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int,
 					active_nodes[node] = 0
 					continue
 
-			good_complete = [list(driver.values())[0]['State'] for driver in network.nodes[end_node]["Queue"]].count('good')
-
 			if good_complete != 0:
 				comp_good[good_complete] = iteration_check
-
-			bad_complete = [list(driver.values())[0]['State'] for driver in network.nodes[end_node]["Queue"]].count('bad')
+				if results is not None:
+					curve_good.update(good_complete, iteration_check)
 
 			if bad_complete != 0:
 				comp_bad[bad_complete] = iteration_check
+				if results is not None:
+					curve_bad.update(bad_complete, iteration_check)
 
-			end_drivers = [list(driver.keys())[0] for driver in network.nodes[end_node]["Queue"]]
+		if good_complete + bad_complete > num_complete:
+			last_arrival = ticks
 
-	iteration_list = [list(driver.values())[0]['Iterations'] for driver in network.nodes[end_node]["Queue"]]
+	end_drivers = list(network.nodes[end_node]["Queue"])
+	iteration_list = list(drivers.iterations[end_drivers])
 	final_good = pd.DataFrame.from_dict(comp_good, orient='index')
 	final_bad = pd.DataFrame.from_dict(comp_bad, orient='index')
 
@@ -136,40 +181,21 @@ def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int,
 	# 														 final_bad.iloc[:, -1]))
 	# print('Total: {}'.format(iteration_list[-1]))
 
-	"""
-	This section can be uncommented to save the results
-	as a pickle file in the current directory.
-	"""
-	from datetime import datetime
-
-	preserve_model = pd.DataFrame(end_drivers, columns=['Driver_ID'])
-
-	preserve_model = pd.concat((preserve_model, final_good),
-														 axis = 0,
-														 join = 'outer',
-														 ignore_index = False)
-
-	preserve_model = pd.concat((preserve_model, final_bad),
-														 axis = 0,
-														 join = 'outer',
-														 ignore_index = False)
-
-	drivers = network.nodes[end_node]["Queue"]
-
-	preserve_model = pd.concat((preserve_model, [driver['State'] for driver in drivers]),
-														 axis = 0,
-														 join = 'outer',
-														 ignore_index = False)
-
-	preserve_model['Total_Check_Iterations'] = iteration_list
-
-	preserve_model.to_pickle('{}_{}_{}.pkl'.format(good_drivers + bad_drivers,
-																								 bad_drivers / (good_drivers + bad_drivers),
-																								 str(datetime.timestamp(dt))[0:10]),
-													 compression = 'infer',
-													 protocol = 5,
-													 storage_options = None)
-
+	# Pass a results.ResultsSink to keep the curves and driver iterations
+	# of every run on disk, read them back with results.read_curve and
+	# results.read_table
+	if results is not None:
+		curve_good.close()
+		curve_bad.close()
+		results.drivers(run_id, drivers.ids, drivers.state, drivers.iterations)
+		results.end_run(run_id, iterations=iteration_check, stopped_by=reason)
+
+	if driver_list is not drivers:
+		drivers.write_back(driver_list)
+
+	if reason is not None:
+		return PartialResult(reason, ticks, drivers, drivers.node == end_node,
+							 result=(iteration_list, final_good, final_bad))
 	return iteration_list, final_good, final_bad
 
 def run_and_plot(num_drivers: int,
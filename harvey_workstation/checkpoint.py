@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+
+def save_state(path: str, meta: dict, **arrays) -> None:
+	"""
+	save_state writes the state of a run to one .npz file, replacing the
+	last one only once the new one is complete
+
+	Params:
+	path: file to write
+	meta: json serializable values, e.g. the tick counter and RNG state
+	arrays: numpy arrays of the state
+
+	Returns:
+	None
+	"""
+
+	with open(path + ".part", "wb") as f:
+		np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+	os.replace(path + ".part", path)
+
+
+def load_state(path: str) -> tuple:
+	"""
+	load_state reads a state written by save_state
+
+	Params:
+	path: file to read
+
+	Returns:
+	meta dict and dict of arrays, (None, None) when there is no file
+	"""
+
+	if not os.path.exists(path):
+		return None, None
+	with np.load(path) as data:
+		arrays = {name: data[name] for name in data.files if name != "meta"}
+		meta = json.loads(str(data["meta"]))
+	return meta, arrays
+
+
+def context_fingerprint(*parts) -> str:
+	"""
+	context_fingerprint hashes what the results of a sweep depend on
+	besides its jobs, e.g. the network fingerprint, engine and limits
+
+	Params:
+	parts: values with a stable repr
+
+	Returns:
+	sha256 hex digest of the parts
+	"""
+
+	return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class SweepCheckpoint:
+	"""
+	SweepCheckpoint appends every finished job of a sweep, with its result
+	and run time, to a file, so a sweep started again with the same file only runs the jobs
+	that are missing. Jobs are seeded by themselves, so the resumed sweep
+	gives the same results as an uninterrupted one. The file starts with
+	the fingerprint of the context the jobs ran in, and a file of another
+	context is refused instead of handing back its results
+
+	Params:
+	path: file of the records, created when missing
+	context_key: fingerprint of the network, engine and limits of the
+	sweep, e.g. SimContext.fingerprint
+	"""
+
+	def __init__(self, path: str, context_key: str = None):
+		self.path = path
+		self.context_key = context_key
+		self.done = dict()
+		self.seconds = dict()
+		good_size = 0
+		if os.path.exists(path):
+			with open(path, "rb") as f:
+				try:
+					header = pickle.load(f)
+				except (EOFError, pickle.UnpicklingError, ValueError, TypeError):
+					header = None
+				if header is not None:
+					if not isinstance(header, dict) or "context" not in header:
+						raise ValueError(f"Checkpoint {path} has no context fingerprint, remove it to run "
+										 f"the sweep again.")
+					if header["context"] != context_key:
+						raise ValueError(f"Checkpoint {path} was saved with another network, engine or "
+										 f"limits, remove it or pick another file.")
+					good_size = f.tell()
+					while True:
+						try:
+							record = pickle.load(f)
+						except (EOFError, pickle.UnpicklingError, ValueError, TypeError):
+							break
+						# Records without a run time have two fields
+						job, result, seconds = (*record, None)[:3]
+						self.done[job] = result
+						self.seconds[job] = seconds
+						good_size = f.tell()
+			# Drop a record cut off by an interruption
+			if os.path.getsize(path) > good_size:
+				os.truncate(path, good_size)
+		if good_size == 0:
+			with open(path, "wb") as f:
+				pickle.dump({"context": context_key}, f)
+
+	def __contains__(self, job) -> bool:
+		return job in self.done
+
+	def add(self, job, result, seconds: float = None) -> None:
+		"""
+		add saves a finished job
+
+		Params:
+		job: job of the sweep, e.g. a sweep.SweepJob
+		result: what the job returned
+		seconds: run time of the job, None when not timed
+
+		Returns:
+		None
+		"""
+
+		self.done[job] = result
+		self.seconds[job] = seconds
+		with open(self.path, "ab") as f:
+			pickle.dump((job, result, seconds), f)
@@ -0,0 +1,270 @@
+import hashlib
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
+
+class CompiledNet:
+	"""
+	CompiledNet is a read-only snapshot of a road network with nodes
+	numbered 0..n-1 and CSR adjacency, so the models can read neighbors
+	and edge weights from numpy arrays instead of networkx dicts
+
+	Params:
+	node_ids: node id (e.g. OSM id) of every node index
+	indptr: CSR offsets, the neighbors of node i are
+	indices[indptr[i]:indptr[i+1]]
+	indices: neighbor index of every adjacency entry
+	length: length of every adjacency entry
+	travel_time: travel time of every adjacency entry, or None
+	directed: whether the entries only hold the forward direction
+	speed_kph: speed of every adjacency entry, or None
+	highway: road class of every adjacency entry, or None
+	"""
+
+	def __init__(self, node_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+				 length: np.ndarray, travel_time: np.ndarray = None, directed: bool = False,
+				 speed_kph: np.ndarray = None, highway: np.ndarray = None):
+		self.node_ids = np.asarray(node_ids)
+		self.indptr = np.asarray(indptr, dtype=np.int64)
+		self.indices = np.asarray(indices, dtype=np.int64)
+		self.length = np.asarray(length, dtype=np.float64)
+		self.travel_time = None if travel_time is None else np.asarray(travel_time, dtype=np.float64)
+		self.directed = directed
+		self.speed_kph = None if speed_kph is None else np.asarray(speed_kph, dtype=np.float64)
+		self.highway = None if highway is None else np.asarray(highway, dtype=str)
+		self.index_of = {node: i for i, node in enumerate(self.node_ids.tolist())}
+		self._sorted_ids = np.argsort(self.node_ids, kind="stable")
+		self._fingerprint = None
+		for array in (self.node_ids, self.indptr, self.indices, self.length, self.travel_time,
+					  self.speed_kph, self.highway):
+			if array is not None:
+				array.flags.writeable = False
+
+	@property
+	def num_nodes(self) -> int:
+		return len(self.node_ids)
+
+	@property
+	def num_edges(self) -> int:
+		"""
+		number of edges, counting each undirected edge once
+		"""
+
+		if self.directed:
+			return len(self.indices)
+		loops = np.count_nonzero(self.indices == self.sources())
+		return (len(self.indices) + loops) // 2
+
+	@property
+	def fingerprint(self) -> str:
+		"""
+		sha256 of the node ids, adjacency and edge weights, the same for
+		every snapshot of the same graph
+		"""
+
+		if self._fingerprint is None:
+			digest = hashlib.sha256(str(self.directed).encode())
+			for array in (self.node_ids, self.indptr, self.indices, self.length, self.travel_time):
+				if array is None:
+					digest.update(b"none")
+				elif array.dtype == object:
+					digest.update(repr(array.tolist()).encode())
+				else:
+					digest.update(str(array.dtype).encode())
+					digest.update(np.ascontiguousarray(array).tobytes())
+			# Road attributes only count when present, so networks without
+			# them keep the fingerprint (and cached trees) they had before
+			for array in (self.speed_kph, self.highway):
+				if array is not None:
+					digest.update(str(array.dtype).encode())
+					digest.update(np.ascontiguousarray(array).tobytes())
+			self._fingerprint = digest.hexdigest()
+		return self._fingerprint
+
+	def neighbors(self, index: int) -> np.ndarray:
+		return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+	def degree(self) -> np.ndarray:
+		return np.diff(self.indptr)
+
+	def sources(self) -> np.ndarray:
+		"""
+		sources returns the source index of every adjacency entry
+
+		Params:
+		None
+
+		Returns:
+		array aligned with indices
+		"""
+
+		return np.repeat(np.arange(self.num_nodes, dtype=np.int64), self.degree())
+
+	def weights(self, weight: str = "length") -> np.ndarray:
+		values = getattr(self, weight, None)
+		if not isinstance(values, np.ndarray):
+			raise KeyError(f"Compiled network has no edge weight {weight!r}.")
+		return values
+
+	def to_index(self, nodes) -> np.ndarray:
+		"""
+		to_index maps node ids to node indices
+
+		Params:
+		nodes: node ids
+
+		Returns:
+		array of node indices
+		"""
+
+		nodes = np.asarray(nodes)
+		pos = np.searchsorted(self.node_ids, nodes, sorter=self._sorted_ids)
+		pos = np.minimum(pos, self.num_nodes - 1)
+		index = self._sorted_ids[pos]
+		if not np.array_equal(self.node_ids[index], nodes):
+			raise KeyError("Some nodes are not in the compiled network.")
+		return index
+
+	def to_csr_matrix(self, weight: str = "length") -> scipy.sparse.csr_matrix:
+		"""
+		to_csr_matrix returns the adjacency as a scipy sparse matrix
+
+		Params:
+		weight: edge attribute used as the matrix values
+
+		Returns:
+		scipy.sparse.csr_matrix of shape (n, n)
+		"""
+
+		return scipy.sparse.csr_matrix((self.weights(weight), self.indices, self.indptr),
+									   shape=(self.num_nodes, self.num_nodes))
+
+
+def compile_net(network: nx.Graph, weights: list = ["length", "travel_time", "speed_kph"]) -> CompiledNet:
+	"""
+	compile_net builds a CompiledNet from a networkx graph, keeping its node
+	order and neighbor order
+
+	Params:
+	network: networkx graph object
+	weights: edge attributes to copy, missing ones are skipped; the
+	highway road class is copied too when the edges have one
+
+	Returns:
+	CompiledNet of the network
+	"""
+
+	node_ids = list(network.nodes)
+	index_of = {node: i for i, node in enumerate(node_ids)}
+	indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+	indices = []
+	values = {weight: [] for weight in weights}
+	highway = []
+	for i, node in enumerate(node_ids):
+		for neighbor, attrs in network.adj[node].items():
+			indices.append(index_of[neighbor])
+			for weight in weights:
+				values[weight].append(attrs.get(weight, np.nan))
+			highway.append(attrs.get("highway", ""))
+		indptr[i + 1] = len(indices)
+
+	arrays = {weight: np.array(values[weight], dtype=np.float64) for weight in weights}
+	arrays = {weight: array for weight, array in arrays.items()
+			  if len(array) and not np.isnan(array).all()}
+	return CompiledNet(node_ids=np.array(node_ids), indptr=indptr, indices=np.array(indices, dtype=np.int64),
+					   length=arrays.get("length", np.ones(len(indices))),
+					   travel_time=arrays.get("travel_time"), directed=network.is_directed(),
+					   speed_kph=arrays.get("speed_kph"),
+					   highway=np.array(highway, dtype=str) if any(highway) else None)
+
+
+def compile_edges(u: np.ndarray, v: np.ndarray, length: np.ndarray = None,
+				  travel_time: np.ndarray = None, directed: bool = False,
+				  speed_kph: np.ndarray = None, highway: np.ndarray = None) -> CompiledNet:
+	"""
+	compile_edges builds a CompiledNet straight from edge arrays, giving the
+	same node order, neighbor order and edge weights as building the graph
+	with nx.from_pandas_edgelist and compiling it (the last duplicate edge
+	keeps its weights)
+
+	Params:
+	u: source node id of every edge
+	v: target node id of every edge
+	length: length of every edge
+	travel_time: travel time of every edge
+	speed_kph: speed of every edge
+	highway: road class of every edge
+
+	Returns:
+	CompiledNet of the edges
+	"""
+
+	u = np.asarray(u)
+	v = np.asarray(v)
+	num_rows = len(u)
+	length = np.ones(num_rows) if length is None else np.asarray(length, dtype=np.float64)
+
+	# Nodes are numbered in order of first appearance, u before v
+	interleaved = np.empty(2 * num_rows, dtype=np.result_type(u, v))
+	interleaved[0::2] = u
+	interleaved[1::2] = v
+	node_ids, first_seen, codes = np.unique(interleaved, return_index=True, return_inverse=True)
+	order = np.argsort(first_seen, kind="stable")
+	rank = np.empty(len(order), dtype=np.int64)
+	rank[order] = np.arange(len(order))
+	codes = rank[codes.reshape(-1)]
+	src = codes[0::2]
+	dst = codes[1::2]
+	node_ids = node_ids[order]
+	num_nodes = len(node_ids)
+
+	# Collapse duplicate edges, keeping the position of the first one for
+	# neighbor order and the weights of the last one
+	if directed:
+		key_a, key_b = src, dst
+	else:
+		key_a, key_b = np.minimum(src, dst), np.maximum(src, dst)
+	keys = key_a * num_nodes + key_b
+	_, first_row = np.unique(keys, return_index=True)
+	_, last_rev = np.unique(keys[::-1], return_index=True)
+	last_row = num_rows - 1 - last_rev
+
+	edge_src = src[first_row]
+	edge_dst = dst[first_row]
+	edge_length = length[last_row]
+	extra = {name: np.asarray(values)[last_row]
+			 for name, values in (("travel_time", travel_time), ("speed_kph", speed_kph), ("highway", highway))
+			 if values is not None}
+	if not directed:
+		# Both directions of every edge, self loops only once
+		back = edge_src != edge_dst
+		first_row = np.concatenate([first_row, first_row[back]])
+		edge_src, edge_dst = (np.concatenate([edge_src, edge_dst[back]]),
+							  np.concatenate([edge_dst, edge_src[back]]))
+		edge_length = np.concatenate([edge_length, edge_length[back]])
+		extra = {name: np.concatenate([values, values[back]]) for name, values in extra.items()}
+
+	entry_order = np.lexsort((first_row, edge_src))
+	indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+	np.cumsum(np.bincount(edge_src, minlength=num_nodes), out=indptr[1:])
+	return CompiledNet(node_ids=node_ids, indptr=indptr, indices=edge_dst[entry_order],
+					   length=edge_length[entry_order], directed=directed,
+					   **{name: values[entry_order] for name, values in extra.items()})
+
+
+def as_compiled(network) -> CompiledNet:
+	"""
+	as_compiled returns the network as a CompiledNet, compiling networkx
+	graphs on the fly
+
+	Params:
+	network: CompiledNet or networkx graph object
+
+	Returns:
+	CompiledNet of the network
+	"""
+
+	if isinstance(network, CompiledNet):
+		return network
+	return compile_net(network)
@@ -12,8 +12,16 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import random
+import time
+from collections import deque
+from checkpoint import context_fingerprint
+from compiled_net import compile_net
 from gen_complex_net import gen_net
 from gen_complex_net import gen_data
+from routing import sink_tree
+from drivers import as_driver_arrays
+from limits import PartialResult, RunLimits
+from sweep import make_jobs, run_sweep
 
 def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) -> list:
 	"""
@@ -29,7 +37,7 @@ def generate_drivers(num_drivers: int, bad_driver_prop: float, states: list) ->
 	"""
 	return [{key: {'State': random.choices(states, [1 - bad_driver_prop, bad_driver_prop])[0], 'Iterations': 0}} for key in np.arange(1, num_drivers + 1, 1)]
 
-def traverse_nodes(node, network, end_node, good_driver_path, prob_wrong_turn, active_nodes, iteration_check):
+def traverse_nodes(node, network, drivers, end_node, good_driver_path, next_hop, prob_wrong_turn, active_nodes, arrived, iteration_check):
 	"""
 	Search node for queue of drivers
 	If queue is not empty, pop first driver and check state
@@ -40,28 +48,30 @@ def traverse_nodes(node, network, end_node, good_driver_path, prob_wrong_turn, a
 	Params:
 	node: <int> current node id
 	network: <nx.Graph> networkx graph object
+	drivers: <DriverArrays> drivers on the network, queues hold their rows
 	end_node: <int> destination node id
 	good_driver_path: <list> shortest path from start node to end node
+	next_hop: <dict> next node toward end node, built by routing.sink_tree
 	prob_wrong_turn: <float> probability of bad driver taking wrong turn
-	active_nodes: <set> set of nodes with active drivers
-	iteration_check: <int> number of iterations
+	active_nodes: <dict> nodes with active drivers
+	arrived: <np.ndarray> drivers at the destination by state code
+	iteration_check: <int> number of driver moves
 
 	Returns:
-	end_drivers: <list> of drivers at the destination
+	arrived: <np.ndarray> drivers at the destination by state code
+	iteration_check: <int> number of driver moves
 	"""
 	if node != end_node:
 		try:
-			drivers = network.nodes[node]["Queue"]
+			queue = network.nodes[node]["Queue"]
 			try:
-				first_out = drivers.pop(0)
+				first_out = queue.popleft()
 			except IndexError:
 				active_nodes[node] = 0
-			driver_id = list(first_out.keys())[0]
-			state = first_out[driver_id]['State']
-			iterations = first_out[driver_id]['Iterations']
-			first_out[driver_id]['Iterations'] = iterations + 1
+				return arrived, iteration_check
+			drivers.iterations[first_out] += 1
 			iteration_check = iteration_check + 1
-			if state == "good":
+			if drivers.state[first_out] == drivers.code("good"):
 				current_node_ind = good_driver_path.index(node)
 				next_step = good_driver_path[current_node_ind + 1]
 				network.nodes[next_step]["Queue"].append(first_out)
@@ -70,83 +80,132 @@ def traverse_nodes(node, network, end_node, good_driver_path, prob_wrong_turn, a
 				if turn_choice == "off_path":
 					next_step = random.choice(list(network.neighbors(node)))
 				else:
-					bad_driver_path = nx.shortest_path(network, source=node, target=end_node, method='dijkstra', weight="length")
-					current_node_ind = bad_driver_path.index(node)
-					next_step = bad_driver_path[current_node_ind + 1]
+					next_step = next_hop[node]
 				network.nodes[next_step]["Queue"].append(first_out)
 				active_nodes[node] = next_step
+			active_nodes[next_step] = 1
+			drivers.node[first_out] = next_step
+			if next_step == end_node:
+				arrived[drivers.state[first_out]] += 1
 		except ValueError:
 			active_nodes[node] = 0
-	return [list(driver.keys())[0] for driver in network.nodes[end_node]["Queue"]], network
+	return arrived, iteration_check
 
-def run_model(drivers: list, network: nx.Graph, origin_node: int, end_node: int, prob_wrong_turn: float):
+def run_model(drivers, network: nx.Graph, origin_node: int, end_node: int, prob_wrong_turn: float, limits: RunLimits = None):
 	"""
 	run_model runs a model with the given generated drivers
 
 	Params:
-	drivers: array of drivers of given attributes
+	drivers: DriverArrays or list of drivers from generate_drivers, a
+	DriverArrays is reset and left with this run's iterations and nodes
 	network: networkx graph object
 	origin_node: node point of origin
 	end_node: node point of sink
 	prob_wrong_turn: probability that bad driver makes a random turn
 	at a given node
+	limits: limits.RunLimits of the run, ticks are passes over the active
+	nodes; stall_ticks catches good drivers stranded off their path. It
+	runs until every driver arrived when None
 
 	Returns:
 	number of iterations required for all drivers to get to final
-	destination
+	destination, or a limits.PartialResult holding them for the drivers
+	that arrived when a limit stopped the run
 	"""
 
-	nx.set_node_attributes(network,
-												 [],
-												 "Queue")
-	network.nodes[origin_node]["Queue"] = drivers
-	# network.nodes["Queue"] += drivers
+	started = time.perf_counter()
+	# Every node gets its own queue, set_node_attributes would share one
+	for node in network.nodes:
+		network.nodes[node]["Queue"] = deque()
+	drivers = as_driver_arrays(drivers)
+	drivers.reset()
+	drivers.node[:] = origin_node
+	network.nodes[origin_node]["Queue"].extend(range(len(drivers)))
 	good_driver_path = nx.shortest_path(network,
 																			source=origin_node,
 																			target=end_node,
 																			method='dijkstra',
 																			weight="length")
-	init_drivers = [list(driver.keys())[0] for driver in network.nodes[origin_node]["Queue"]]
+	next_hop = sink_tree(network, end_node, weight="length")
 
-	driver_states = list(nx.get_node_attributes(network, 'State').values())
+	good_code = drivers.code('good')
+	bad_code = drivers.code('bad')
+	good_drivers = np.count_nonzero(drivers.state == good_code)
+	bad_drivers = np.count_nonzero(drivers.state == bad_code)
 
-	good_drivers = driver_states.count('good')
-	bad_drivers = driver_states.count('bad')
-
-	end_drivers = []
+	arrived = np.zeros(len(drivers.states), dtype=np.int64)
 	comp_good = {}
 	comp_bad = {}
 	active_nodes = {i: 1 for i in good_driver_path}
 	iteration_check = 0
+	ticks = 0
+	last_arrival = 0
+	reason = None
+
+	while arrived.sum() < len(drivers):
+		if limits is not None:
+			reason = limits.exceeded(ticks, last_arrival, started)
+			if reason is not None:
+				break
+		ticks += 1
+		num_arrived = arrived.sum()
+		# Nodes reached by wrong turns join active_nodes while looping
+		for node in list(active_nodes):
+			arrived, iteration_check = traverse_nodes(node, network, drivers, end_node, good_driver_path, next_hop, prob_wrong_turn, active_nodes, arrived, iteration_check)
+			if arrived[good_code] != 0:
+				comp_good[arrived[good_code]] = iteration_check
+			if arrived[bad_code] != 0:
+				comp_bad[arrived[bad_code]] = iteration_check
+		if arrived.sum() > num_arrived:
+			last_arrival = ticks
 
-	while not end_drivers or sorted(init_drivers) != sorted(end_drivers):
-		for node in active_nodes:
-			end_drivers, network = traverse_nodes(end_drivers, node, network, end_node, good_driver_path, prob_wrong_turn, active_nodes, iteration_check)
-			good_complete = [list(driver.values())[0]['State'] for driver in network.nodes[end_node]["Queue"]].count('good')
-			bad_complete = [list(driver.values())[0]['State'] for driver in network.nodes[end_node]["Queue"]].count('bad')
-			if good_complete != 0:
-				comp_good[good_complete] = iteration_check
-			if bad_complete != 0:
-				comp_bad[bad_complete] = iteration_check
-
-	iteration_list = [list(driver.values())[0]['Iterations'] for driver in network.nodes[end_node]["Queue"]]
+	iteration_list = list(drivers.iterations[list(network.nodes[end_node]["Queue"])])
 	final_good = pd.DataFrame.from_dict(comp_good, orient='index')
 	final_bad = pd.DataFrame.from_dict(comp_bad, orient='index')
 	if final_good.empty:
 		final_good = pd.DataFrame([0], columns=['Iterations'])
 	if final_bad.empty:
 		final_bad = pd.DataFrame([0], columns=['Iterations'])
+	if reason is not None:
+		return PartialResult(reason, ticks, drivers, drivers.node == end_node,
+							 result=(iteration_list, final_good, final_bad))
 	return iteration_list, final_good, final_bad
 
-def run_and_plot(num_drivers: int, scale: int, bad_prop: list, iteration_list: list, good_df: pd.DataFrame, bad_df: pd.DataFrame):
-	prop_bad = scale * 0.1
-	driver_list = generate_drivers(num_drivers, prop_bad, states = ["good","bad"])
-	net = gen_net(edges=gen_data(), node_vals=["u", "v", "length"])
-	total, good, bad = run_model(drivers=driver_list,
-															network=net,
-															origin_node=204449959,
-															end_node=204350837,
-															prob_wrong_turn=0.01)
+class ModelContext:
+	"""
+	Network and end points shared by every run of a sweep, sent once
+	to each worker process by sweep.run_sweep
+
+	Params:
+	network: <nx.Graph> networkx graph object
+	origin_node: <int> node point of origin
+	end_node: <int> node point of sink
+	limits: <RunLimits> limits of every run, none when None
+	"""
+	def __init__(self, network: nx.Graph, origin_node: int, end_node: int, limits: RunLimits = None):
+		self.network = network
+		self.origin_node = origin_node
+		self.end_node = end_node
+		self.limits = limits
+
+	@property
+	def fingerprint(self) -> str:
+		"""
+		Fingerprint of the network, end points and limits, checked by
+		sweep.run_sweep against its checkpoint
+		"""
+		return context_fingerprint("ModelContext", compile_net(self.network).fingerprint, self.origin_node,
+								   self.end_node, None if self.limits is None else self.limits.key)
+
+	def run(self, drivers, prob_wrong_turn: float):
+		return run_model(drivers=drivers,
+										 network=self.network,
+										 origin_node=self.origin_node,
+										 end_node=self.end_node,
+										 prob_wrong_turn=prob_wrong_turn,
+										 limits=self.limits)
+
+def plot_result(num_drivers: int, prop_bad: float, total: list, good: pd.DataFrame, bad: pd.DataFrame, bad_prop: list, iteration_list: list, good_df: pd.DataFrame, bad_df: pd.DataFrame):
 	bad_prop.append(prop_bad)
 	iteration_list.append(total)
 	good_df = pd.concat((good_df, good))
@@ -165,18 +224,38 @@ def run_and_plot(num_drivers: int, scale: int, bad_prop: list, iteration_list: l
 	plt.savefig(f'{num_drivers}_10eneg2.png')
 	return plt.gca(), bad_prop, iteration_list, good_df, bad_df
 
+def run_and_plot(num_drivers: int, scale: int, bad_prop: list, iteration_list: list, good_df: pd.DataFrame, bad_df: pd.DataFrame):
+	prop_bad = scale * 0.1
+	driver_list = generate_drivers(num_drivers, prop_bad, states = ["good","bad"])
+	net = gen_net(edges=gen_data(), node_vals=["u", "v", "length"])
+	total, good, bad = run_model(drivers=driver_list,
+															network=net,
+															origin_node=204449959,
+															end_node=204350837,
+															prob_wrong_turn=0.01)
+	return plot_result(num_drivers, prop_bad, total, good, bad, bad_prop, iteration_list, good_df, bad_df)
+
 
-# Initialize lists and dataframes
-bad_prop = []
-iteration_list = []
-good_df = pd.DataFrame()
-bad_df = pd.DataFrame()
-# Set parameters
-num_drivers = 1000
-sig_digits = 10
-# Initialize plot
-fig, ax = plt.subplots(1,1, figsize = (5.5, 5.5))
-# Iterate through different proportions of bad drivers, and update plot
-for i in range(sig_digits):
-	ax, bad_prop, iteration_list, good_df, bad_df = run_and_plot(num_drivers, i, bad_prop, iteration_list, good_df, bad_df)
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+	# Initialize lists and dataframes
+	bad_prop = []
+	iteration_list = []
+	good_df = pd.DataFrame()
+	bad_df = pd.DataFrame()
+	# Set parameters
+	num_drivers = 1000
+	sig_digits = 10
+	# Initialize plot
+	fig, ax = plt.subplots(1,1, figsize = (5.5, 5.5))
+	# Run every proportion of bad drivers on its own core, then update the plot in order
+	context = ModelContext(gen_net(edges=gen_data(), node_vals=["u", "v", "length"]),
+												 origin_node=204449959,
+												 end_node=204350837)
+	jobs = make_jobs([i * 0.1 for i in range(sig_digits)], [0.01] * sig_digits, num_drivers=num_drivers, num_iters=1)
+	results = dict()
+	for job, result in run_sweep(context, jobs, checkpoint='complex_model_sweep.ckpt'):
+		print(f'Finished Proportion Bad: {job.bad_prop}')
+		results[job] = result
+	for job in jobs:
+		ax, bad_prop, iteration_list, good_df, bad_df = plot_result(num_drivers, job.bad_prop, *results[job], bad_prop, iteration_list, good_df, bad_df)
+	plt.show()
@@ -6,25 +6,175 @@
 # driver attributes are plotted and saved to the current working directory.                             #
 #########################################################################################################
 
+import hashlib
+import json
+import os
 import osmnx as ox
 import networkx as nx
+import numpy as np
+import pandas as pd
 import geopandas
+from collections import deque
+
+GRAPHML_PATH = 'btv_20km_streets.graphml'
+EDGE_CACHE_PATH = 'btv_20km_streets.npz'
+# Bump when the layout of the edge cache changes
+EDGE_CACHE_VERSION = 2
+EDGE_CACHE_COLUMNS = ["u", "v", "key", "length", "speed_kph", "travel_time", "highway"]
+
+SPEED_LIMITS = {'motorway' : 104.67,
+				'trunk' : 64.3738,
+				'primary' : 80.4672,
+				'secondary' : 80.4672, 
+				'tertiary' : 80.4672, 
+				'unclassified' : 80.4672, 
+				'residential' : 40.2336, 
+				'service' : 40.2336, 
+				'motorway_link' : 80.4672, 
+				'trunk_link' : 64.3738, 
+				'primary_link' : 104.67, 
+				'secondary_link' : 104.67, 
+				'motorway_junction' : 104.67}
+
+def edge_cache_settings() -> str:
+	"""
+	edge_cache_settings hashes what the edge cache depends on besides the
+	graphml file
+
+	Params:
+	None
+
+	Returns:
+	hex digest of the cache version and the speed limit table
+	"""
+
+	digest = hashlib.sha256()
+	digest.update(str(EDGE_CACHE_VERSION).encode())
+	digest.update(json.dumps(SPEED_LIMITS, sort_keys=True).encode())
+	return digest.hexdigest()
+
+
+def edge_cache_key(graphml_path: str) -> str:
+	"""
+	edge_cache_key hashes everything the edge cache depends on
+
+	Params:
+	graphml_path: path of the source graphml file
+
+	Returns:
+	hex digest of the cache version, the speed limit table and the
+	graphml file
+	"""
+
+	digest = hashlib.sha256()
+	digest.update(edge_cache_settings().encode())
+	with open(graphml_path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def source_stamp(graphml_path: str) -> np.ndarray:
+	"""
+	source_stamp reads the size and modification time of the graphml
+	file, which tell whether it changed without reading it
+
+	Params:
+	graphml_path: path of the source graphml file
+
+	Returns:
+	int64 array of the size in bytes and the mtime in nanoseconds
+	"""
+
+	stat = os.stat(graphml_path)
+	return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load_edge_cache(cache_path: str, graphml_path: str) -> pd.DataFrame:
+	"""
+	load_edge_cache reads the binary edge cache if it matches the graphml
+	file. A cache stamped with the file's current size and mtime is used
+	as it is; otherwise the file is hashed, and a cache whose content
+	still matches is stamped again so the next load skips the hash
+
+	Params:
+	cache_path: path of the .npz edge cache
+	graphml_path: path of the source graphml file
+
+	Returns:
+	data frame of edges, or None if the cache is missing or stale
+	"""
+
+	try:
+		with np.load(cache_path, allow_pickle=False) as cache:
+			stamped = (str(cache["settings"]) == edge_cache_settings()
+					   and np.array_equal(cache["source_stamp"], source_stamp(graphml_path)))
+			key = None if stamped else edge_cache_key(graphml_path)
+			if not stamped and str(cache["cache_key"]) != key:
+				return None
+			edges = pd.DataFrame({column: cache[column] for column in EDGE_CACHE_COLUMNS})
+	except (FileNotFoundError, KeyError, ValueError):
+		return None
+	if not stamped:
+		save_edge_cache(cache_path, graphml_path, edges, key=key)
+	return edges
+
+
+def save_edge_cache(cache_path: str, graphml_path: str, edges: pd.DataFrame, key: str = None) -> None:
+	"""
+	save_edge_cache writes the edge columns used by the models to a
+	binary cache next to the graphml file
+
+	Params:
+	cache_path: path of the .npz edge cache
+	graphml_path: path of the source graphml file
+	edges: edge data frame from graph_to_gdfs
+	key: edge_cache_key of the graphml file, hashed when None
+
+	Returns:
+	None
+	"""
+
+	if key is None:
+		key = edge_cache_key(graphml_path)
+	edges = edges.reset_index()
+	missing = pd.Series(np.nan, index=edges.index)
+	# Simplified edges can carry a list of road classes, keep the first
+	highway = [h[0] if isinstance(h, list) else str(h) for h in edges.get("highway", missing.fillna(""))]
+	np.savez(cache_path,
+			 cache_key=np.array(key),
+			 settings=np.array(edge_cache_settings()),
+			 source_stamp=source_stamp(graphml_path),
+			 u=edges["u"].to_numpy(dtype=np.int64),
+			 v=edges["v"].to_numpy(dtype=np.int64),
+			 key=edges["key"].to_numpy(dtype=np.int64),
+			 length=edges["length"].to_numpy(dtype=np.float64),
+			 speed_kph=edges.get("speed_kph", missing).to_numpy(dtype=np.float64),
+			 travel_time=edges.get("travel_time", missing).to_numpy(dtype=np.float64),
+			 highway=np.array(highway, dtype=str))
+
 
 def gen_data():
 	"""
 	Description:
 	Retrieve Road Network Data within 20km of Burlington
 	(Most of the Chittenden County road network)
+	Read from the binary edge cache when it matches the graphml file.
 
 	Params: 
 	None
 
 	Returns:
 	edges: geopandas.GeoDataFrame
-	Numeric representation of road network.
+	Numeric representation of road network (a pandas.DataFrame
+	without geometry when read from the cache).
 	"""
+	if os.path.exists(GRAPHML_PATH):
+		edges = load_edge_cache(EDGE_CACHE_PATH, GRAPHML_PATH)
+		if edges is not None:
+			return edges
 	try:
-		streets_graph = ox.load_graphml('btv_20km_streets.graphml')
+		streets_graph = ox.load_graphml(GRAPHML_PATH)
 	except FileNotFoundError:
 		streets_graph = ox.graph_from_place('Burlington, Vermont',
 																				network_type ='drive',
@@ -35,30 +185,19 @@ def gen_data():
 																				buffer_dist = 20000,
 																				clean_periphery = True,
 																				custom_filter = None)
-		speed_limits = {'motorway' : 104.67,
-										'trunk' : 64.3738,
-										'primary' : 80.4672,
-										'secondary' : 80.4672, 
-										'tertiary' : 80.4672, 
-										'unclassified' : 80.4672, 
-										'residential' : 40.2336, 
-										'service' : 40.2336, 
-										'motorway_link' : 80.4672, 
-										'trunk_link' : 64.3738, 
-										'primary_link' : 104.67, 
-										'secondary_link' : 104.67, 
-										'motorway_junction' : 104.67}
 		# streets_graph = ox.project_graph(streets_graph)
 		streets_graph = ox.add_edge_speeds(G = streets_graph,
-																			 hwy_speeds = speed_limits,
+																			 hwy_speeds = SPEED_LIMITS,
 																			 fallback = 80.4672,
 																			 precision = 4)
 		streets_graph = ox.add_edge_travel_times(G = streets_graph,
 																						 precision = 2)
 		ox.save_graphml(streets_graph,
-										filepath = "btv_20km_streets.graphml",
+										filepath = GRAPHML_PATH,
 										encoding='utf-8')
-	return ox.graph_to_gdfs(streets_graph)[1]
+	edges = ox.graph_to_gdfs(streets_graph)[1]
+	save_edge_cache(EDGE_CACHE_PATH, GRAPHML_PATH, edges)
+	return edges
 
 def gen_net(edges, node_vals: list) -> nx.Graph:
 	"""
@@ -74,12 +213,11 @@ def gen_net(edges, node_vals: list) -> nx.Graph:
 	Returns:
 	G: networkx.Graph
 		NetworkX Graph object of road network.
-		Includes node attribute for Traffic as "Queue".
+		Includes node attribute for Traffic as "Queue" (a deque).
 	"""
 	edges.reset_index(inplace=True)
 	data_node_ats = edges[node_vals]
 	G = nx.from_pandas_edgelist(data_node_ats, source=node_vals[0], target=node_vals[1], edge_attr=node_vals[2], create_using=nx.Graph())
-	nx.set_node_attributes(G, values=[], name="Queue")
 	for node in G.nodes:
-		G.nodes[node]["Queue"] = []
+		G.nodes[node]["Queue"] = deque()
 	return G
\ No newline at end of file
@@ -1,56 +1,175 @@
-import geopandas
-import pandas as pd
-import matplotlib.pyplot as plt
-import collections
 import networkx as nx
+import numpy as np
 import os
-import seaborn as sns
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components, dijkstra
+from compiled_net import as_compiled, compile_edges
 
-def gen_net(file_name: str, node_vals: list, out_file_name: str) -> nx.Graph:
+def stream_edges(file_name: str, node_vals: list, chunk_size: int = 100000):
+    """
+    stream_edges reads the node ids of every road feature in chunks,
+    skipping geometry and every other property, so memory use is bounded
+    by the chunk size rather than the file size
+
+    Params:
+    file_name: name of geodata file
+    node_vals: list of feature names that contain node info
+    chunk_size: number of features per chunk
+
+    Returns:
+    generator of (m, 2) int64 arrays of source and target node ids
+    """
+
+    # Imported here so network_stats works without the GIS and plotting
+    # stack
+    import fiona
+
+    with fiona.open(file_name) as roads:
+        ignore = [name for name in roads.schema["properties"] if name not in node_vals]
+    with fiona.open(file_name, ignore_fields=ignore, ignore_geometry=True) as roads:
+        chunk = np.empty((chunk_size, 2), dtype=np.int64)
+        count = 0
+        for feature in roads:
+            props = feature["properties"]
+            source, target = props[node_vals[0]], props[node_vals[1]]
+            if source is None or target is None:
+                continue
+            chunk[count] = (source, target)
+            count += 1
+            if count == chunk_size:
+                yield chunk.copy()
+                count = 0
+        if count:
+            yield chunk[:count].copy()
+
+
+def read_edges(out_file_name: str) -> np.ndarray:
+    """
+    read_edges memory maps a binary edge list written by gen_net
+
+    Params:
+    out_file_name: name of the binary edge list
+
+    Returns:
+    (m, 2) int64 array of source and target node ids
+    """
+
+    if os.path.getsize(out_file_name) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.memmap(out_file_name, dtype=np.int64, mode="r").reshape(-1, 2)
+
+
+def gen_net(file_name: str, node_vals: list, out_file_name: str, compiled: bool = False) -> nx.Graph:
     """
     gen_net takes in a file and returns a network x network
     
     Params:
     file_name: name of geodata file
     node_vals: list of feature names that contain node info
-    out_file_name: name of subset file 
+    out_file_name: name of the binary edge list (int64 source, target
+    pairs) cached from the geodata file
+    compiled: return a CompiledNet instead of a networkx graph
 
     Returns: 
     graph of given data
     """
 
-    list_dir = os.listdir()
-    list_diff = list(set([out_file_name])-set(list_dir))
-    
-    if list_diff == [out_file_name]: 
-        roads = geopandas.read_file(file_name)
-        roads = roads[node_vals]
-        roads.rename(columns={node_vals[0]: "Source", 
-                        node_vals[1]: "Target"}, inplace=True)
-        roads.to_csv(out_file_name, index=False)
-        
-    roads = pd.read_csv(out_file_name)
-    G = nx.from_pandas_edgelist(roads, source="Source", target="Target", 
-                                create_using=nx.Graph())
+    if not os.path.exists(out_file_name):
+        # Write to a temporary file so an interrupted run leaves no
+        # partial edge list behind
+        tmp_file_name = out_file_name + ".part"
+        with open(tmp_file_name, "wb") as out:
+            for chunk in stream_edges(file_name, node_vals):
+                chunk.tofile(out)
+        os.replace(tmp_file_name, out_file_name)
+
+    edges = read_edges(out_file_name)
+    if compiled:
+        return compile_edges(edges[:, 0], edges[:, 1])
+    G = nx.Graph()
+    G.add_edges_from(edges.tolist())
     return G
 
-def stats(network: nx.Graph) -> None:
+def network_stats(network, num_samples: int = 32, seed: int = 0) -> dict:
+    """
+    network_stats computes basic stats of an undirected network straight
+    from its CSR arrays, matching networkx on small graphs
+
+    Params:
+    network: CompiledNet or networkx graph object
+    num_samples: number of source nodes used to estimate the average
+    shortest path length of the largest component, all of its nodes
+    when it has fewer
+    seed: seed used to pick the sample
+
+    Returns:
+    dict of num_nodes, num_edges, degree (per node), density,
+    assortativity, component_sizes (largest first) and avg_path_length
+    """
+
+    net = as_compiled(network)
+    num_nodes = net.num_nodes
+    sources = net.sources()
+    # networkx counts a self loop twice in the degree
+    loops = np.bincount(sources[sources == net.indices], minlength=num_nodes)
+    degree = net.degree() + loops
+    num_edges = net.num_edges
+    density = 0.0 if num_nodes <= 1 else 2 * num_edges / (num_nodes * (num_nodes - 1))
+
+    # Pearson correlation of the degrees at both ends of every edge,
+    # taken in both directions like nx.degree_assortativity_coefficient
+    x = degree[sources].astype(np.float64)
+    y = degree[net.indices].astype(np.float64)
+    x -= x.mean()
+    y -= y.mean()
+    assortativity = (x * y).sum() / np.sqrt((x * x).sum() * (y * y).sum())
+
+    adjacency = scipy.sparse.csr_matrix((np.ones(len(net.indices)), net.indices, net.indptr),
+                                        shape=(num_nodes, num_nodes))
+    _, labels = connected_components(adjacency, directed=False)
+    component_sizes = np.sort(np.bincount(labels))[::-1]
+
+    # Hop count average over sampled sources of the largest component
+    largest = np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+    rng = np.random.default_rng(seed)
+    if len(largest) > num_samples:
+        sample = rng.choice(largest, size=num_samples, replace=False)
+    else:
+        sample = largest
+    if len(largest) > 1:
+        # The adjacency already holds both directions of every edge
+        dist = dijkstra(adjacency, directed=True, unweighted=True, indices=sample)
+        avg_path_length = dist[:, largest].sum() / (len(sample) * (len(largest) - 1))
+    else:
+        avg_path_length = 0.0
+
+    return {"num_nodes": num_nodes,
+            "num_edges": num_edges,
+            "degree": degree,
+            "density": density,
+            "assortativity": assortativity,
+            "component_sizes": component_sizes,
+            "avg_path_length": avg_path_length}
+
+
+def stats(network) -> None:
     """
     stats takes in a network file and gathers basic network
     stats to inform our models
     
     Params:
-    network: given network object
+    network: given network object (CompiledNet or networkx graph)
 
     Returns:
     None
     """
     
-    print(network)
-    degree_sequence = sorted([d for n, d in network.degree()], 
-                            reverse=True)
-    degcounts = collections.Counter(degree_sequence)
-    deg, cnt = zip(*degcounts.items())
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    net_stats = network_stats(network)
+    print(f"Graph with {net_stats['num_nodes']} nodes and {net_stats['num_edges']} edges")
+    deg, cnt = np.unique(net_stats["degree"], return_counts=True)
     plt.bar(deg, cnt, color='green')
     plt.xlabel("Degree")
     plt.ylabel("Log Counts")
@@ -59,12 +178,16 @@ def stats(network: nx.Graph) -> None:
     plt.yscale("log")
     plt.savefig("degree_hist")
     
-    density = nx.density(network)
-    print("Network density:", density)
+    print("Network density:", net_stats["density"])
+
+    print("Avg Pearosn Corr Coeff", net_stats["assortativity"])
+
+    print("Components:", len(net_stats["component_sizes"]), 
+          "Largest:", net_stats["component_sizes"][0])
 
-    pears_corr = nx.degree_assortativity_coefficient(network)
-    print("Avg Pearosn Corr Coeff", pears_corr)
+    print("Sampled avg shortest path length:", net_stats["avg_path_length"])
 
-net = gen_net("VT_Road_Centerline.geojson",  ["StartNodeID", "EndNodeID"], 
-                "edge_simple_list.csv")
-stats(net)
+if __name__ == "__main__":
+    net = gen_net("VT_Road_Centerline.geojson",  ["StartNodeID", "EndNodeID"], 
+                    "edge_simple_list.bin", compiled=True)
+    stats(net)
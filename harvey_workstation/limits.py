@@ -0,0 +1,108 @@
+import time
+import numpy as np
+
+
+class RunLimits:
+	"""
+	RunLimits bounds a model run. The models take it as an optional limits
+	argument and check it once per tick (once per event for
+	run_model_events); a run that hits a limit stops and returns a
+	PartialResult instead of spinning until every driver arrived
+
+	Params:
+	max_ticks: most ticks of a run (time with a time_weight), no limit
+	when None
+	max_seconds: most wall-clock seconds of a run, no limit when None
+	stall_ticks: most ticks in a row without an arrival at the sink,
+	catches drivers stranded or circling off the tree, no limit when None
+	"""
+
+	def __init__(self, max_ticks: int = None, max_seconds: float = None, stall_ticks: int = None):
+		self.max_ticks = max_ticks
+		self.max_seconds = max_seconds
+		self.stall_ticks = stall_ticks
+
+	@property
+	def key(self) -> tuple:
+		"""
+		the limits as a tuple, e.g. for a context fingerprint
+		"""
+
+		return self.max_ticks, self.max_seconds, self.stall_ticks
+
+	def exceeded(self, ticks: float, last_arrival: float, started: float) -> str:
+		"""
+		exceeded checks every limit
+
+		Params:
+		ticks: ticks (or time) the run has reached
+		last_arrival: tick of the last arrival at the sink, 0 before the
+		first one
+		started: time.perf_counter() at the start of the run
+
+		Returns:
+		"max_ticks", "stall" or "max_seconds" for the first limit hit, None
+		while the run is within all of them
+		"""
+
+		if self.max_ticks is not None and ticks >= self.max_ticks:
+			return "max_ticks"
+		if self.stall_ticks is not None and ticks - last_arrival >= self.stall_ticks:
+			return "stall"
+		if self.max_seconds is not None and time.perf_counter() - started >= self.max_seconds:
+			return "max_seconds"
+		return None
+
+
+class PartialResult:
+	"""
+	PartialResult is what a model returns when a run hits one of its
+	RunLimits
+
+	Params:
+	reason: limit that stopped the run, "max_ticks", "stall" or
+	"max_seconds"
+	ticks: ticks (or time) the run had reached
+	drivers: DriverArrays of the run, with node set to where each driver
+	stopped
+	finished: bool array, True for the drivers at the sink
+	result: what the model returns for the drivers that finished, None
+	when it has no such value
+
+	Attributes:
+	arrived: dict of state name to number of drivers at the sink
+	unfinished: rows of the drivers not at the sink
+	unfinished_nodes: node ids where those drivers stopped, for drivers
+	between two nodes in run_model_events the node they are moving to
+	"""
+
+	def __init__(self, reason: str, ticks: float, drivers, finished: np.ndarray, result=None):
+		self.reason = reason
+		self.ticks = ticks
+		self.num_drivers = len(drivers)
+		self.arrived = {state: int(np.count_nonzero(finished & (drivers.state == code)))
+						for code, state in enumerate(drivers.states)}
+		self.unfinished = np.flatnonzero(~finished)
+		self.unfinished_nodes = drivers.node[self.unfinished]
+		self.result = result
+
+	def __repr__(self) -> str:
+		return (f"PartialResult(reason={self.reason!r}, ticks={self.ticks}, arrived={self.arrived}, "
+				f"unfinished={len(self.unfinished)} of {self.num_drivers})")
+
+
+def result_ticks(result) -> float:
+	"""
+	result_ticks reads the ticks of a model result, for partial runs the
+	ticks they reached, a lower bound of the ticks they would have needed
+
+	Params:
+	result: return value of a model, or a PartialResult
+
+	Returns:
+	ticks (or time) of the run
+	"""
+
+	if isinstance(result, PartialResult):
+		return result.ticks
+	return result
@@ -0,0 +1,272 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Columns of every table, each column is its own append-only binary file
+TABLES = {"curves": [("run_id", np.int64), ("state", np.int8), ("count", np.int64), ("tick", np.int64)],
+		  "drivers": [("run_id", np.int64), ("driver", np.int64), ("state", np.int8), ("iterations", np.int64)]}
+RUNS_FILE = "runs.jsonl"
+
+
+def _column_file(directory: str, table: str, column: str) -> str:
+	return os.path.join(directory, f"{table}.{column}.bin")
+
+
+class ResultsSink:
+	"""
+	ResultsSink streams the results of model runs to a directory of
+	append-only column files: arrival curves (how many drivers of a state
+	had arrived at a tick), per driver iteration counts and one json line
+	of metadata per run start and end. Rows are buffered up to flush_rows
+	and then appended, so memory stays bounded, and an interrupted run
+	keeps everything flushed before it stopped. read_table memory-maps the
+	columns back
+
+	Params:
+	directory: directory of the files, created when missing
+	flush_rows: number of buffered rows of a table that triggers a flush
+	"""
+
+	def __init__(self, directory: str, flush_rows: int = 65536):
+		self.directory = directory
+		self.flush_rows = flush_rows
+		os.makedirs(directory, exist_ok=True)
+		self._repair()
+		self._buffers = {table: {column: [] for column, _ in columns} for table, columns in TABLES.items()}
+		self._next_run_id = sum(1 for run in _read_run_lines(directory) if run["status"] == "started")
+
+	def _repair(self) -> None:
+		# An interruption between the columns of one flush leaves some
+		# columns longer, cut them back so appends stay aligned
+		for table, columns in TABLES.items():
+			num_rows = len(read_table(self.directory, table)["run_id"])
+			for column, dtype in columns:
+				path = _column_file(self.directory, table, column)
+				if os.path.exists(path) and os.path.getsize(path) > num_rows * np.dtype(dtype).itemsize:
+					os.truncate(path, num_rows * np.dtype(dtype).itemsize)
+		# End a json line cut off by an interruption so the next one is kept
+		path = os.path.join(self.directory, RUNS_FILE)
+		if os.path.exists(path) and os.path.getsize(path):
+			with open(path, "rb+") as f:
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != b"\n":
+					f.write(b"\n")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc) -> None:
+		self.close()
+
+	def _write_run_line(self, record: dict) -> None:
+		with open(os.path.join(self.directory, RUNS_FILE), "a") as f:
+			f.write(json.dumps(record, default=str) + "\n")
+
+	def start_run(self, **metadata) -> int:
+		"""
+		start_run records the start of a run
+
+		Params:
+		metadata: json serializable parameters of the run, e.g.
+		num_drivers, prob_wrong_turn and states (the names of the state
+		codes)
+
+		Returns:
+		run id to pass to the other methods
+		"""
+
+		run_id = self._next_run_id
+		self._next_run_id += 1
+		self._write_run_line({"run_id": run_id, "status": "started", "time": time.time(), **metadata})
+		return run_id
+
+	def _append(self, table: str, **values) -> None:
+		buffers = self._buffers[table]
+		for column, value in values.items():
+			if np.ndim(value):
+				buffers[column].extend(np.asarray(value).tolist())
+			else:
+				buffers[column].append(value)
+		if len(buffers["run_id"]) >= self.flush_rows:
+			self._flush_table(table)
+
+	def arrival(self, run_id: int, state: int, count: int, tick: int) -> None:
+		"""
+		arrival records that count drivers of a state had arrived at a tick
+
+		Params:
+		run_id: id from start_run
+		state: state code of the drivers
+		count: number of drivers of that state that had arrived
+		tick: tick (or number of moves) of the model
+
+		Returns:
+		None
+		"""
+
+		self._append("curves", run_id=run_id, state=state, count=count, tick=tick)
+
+	def drivers(self, run_id: int, ids, states, iterations) -> None:
+		"""
+		drivers records the iteration count of several drivers
+
+		Params:
+		run_id: id from start_run
+		ids: driver ids
+		states: state codes of the drivers
+		iterations: iteration counts of the drivers
+
+		Returns:
+		None
+		"""
+
+		ids = np.asarray(ids)
+		self._append("drivers", run_id=np.full(len(ids), run_id), driver=ids,
+					 state=np.asarray(states), iterations=np.asarray(iterations))
+
+	def end_run(self, run_id: int, **metadata) -> None:
+		"""
+		end_run flushes every buffered row and records the end of a run,
+		runs without an end record were interrupted
+
+		Params:
+		run_id: id from start_run
+		metadata: json serializable results of the run
+
+		Returns:
+		None
+		"""
+
+		self.flush()
+		self._write_run_line({"run_id": run_id, "status": "complete", "time": time.time(), **metadata})
+
+	def _flush_table(self, table: str) -> None:
+		buffers = self._buffers[table]
+		if not buffers["run_id"]:
+			return
+		for column, dtype in TABLES[table]:
+			with open(_column_file(self.directory, table, column), "ab") as f:
+				np.array(buffers[column], dtype=dtype).tofile(f)
+			buffers[column].clear()
+
+	def flush(self) -> None:
+		for table in TABLES:
+			self._flush_table(table)
+
+	def close(self) -> None:
+		self.flush()
+
+
+class ArrivalCurve:
+	"""
+	ArrivalCurve streams an arrival curve the models keep as a dict
+	{count: tick} that is overwritten every tick: a count is written to
+	the sink with its last tick once the count changes, so the sink holds
+	the same values as the dict
+
+	Params:
+	sink: ResultsSink to write to
+	run_id: id from ResultsSink.start_run
+	state: state code of the drivers
+	"""
+
+	def __init__(self, sink: ResultsSink, run_id: int, state: int):
+		self.sink = sink
+		self.run_id = run_id
+		self.state = state
+		self.count = None
+		self.tick = None
+
+	def update(self, count: int, tick: int) -> None:
+		if self.count is not None and count != self.count:
+			self.sink.arrival(self.run_id, self.state, self.count, self.tick)
+		self.count = count
+		self.tick = tick
+
+	def close(self) -> None:
+		if self.count is not None:
+			self.sink.arrival(self.run_id, self.state, self.count, self.tick)
+			self.count = None
+
+
+def _read_run_lines(directory: str) -> list:
+	path = os.path.join(directory, RUNS_FILE)
+	if not os.path.exists(path):
+		return []
+	with open(path) as f:
+		# A line cut off by an interruption is skipped
+		runs = []
+		for line in f:
+			try:
+				runs.append(json.loads(line))
+			except json.JSONDecodeError:
+				pass
+		return runs
+
+
+def read_runs(directory: str) -> list:
+	"""
+	read_runs reads the metadata of every run of a ResultsSink directory
+
+	Params:
+	directory: directory of the ResultsSink
+
+	Returns:
+	list of dicts, one per run, with the start metadata updated by the
+	end metadata; status is "started" for runs that were interrupted
+	"""
+
+	runs = dict()
+	for record in _read_run_lines(directory):
+		runs.setdefault(record["run_id"], dict()).update(record)
+	return [runs[run_id] for run_id in sorted(runs)]
+
+
+def read_table(directory: str, table: str) -> dict:
+	"""
+	read_table memory-maps the columns of one table
+
+	Params:
+	directory: directory of the ResultsSink
+	table: "curves" or "drivers"
+
+	Returns:
+	dict of column name to read-only memmap, cut to the rows every
+	column has
+	"""
+
+	sizes = []
+	for column, dtype in TABLES[table]:
+		path = _column_file(directory, table, column)
+		sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+	num_rows = min(sizes)
+	columns = dict()
+	for column, dtype in TABLES[table]:
+		if num_rows == 0:
+			columns[column] = np.zeros(0, dtype=dtype)
+		else:
+			columns[column] = np.memmap(_column_file(directory, table, column), dtype=dtype,
+										mode="r", shape=(num_rows,))
+	return columns
+
+
+def read_curve(directory: str, run_id: int, state: int) -> pd.DataFrame:
+	"""
+	read_curve reads the arrival curve of one state of one run in the
+	shape the models return it: index is the number of arrived drivers,
+	the only column the tick
+
+	Params:
+	directory: directory of the ResultsSink
+	run_id: id of the run
+	state: state code of the drivers
+
+	Returns:
+	pd.DataFrame of the curve
+	"""
+
+	curves = read_table(directory, "curves")
+	rows = (curves["run_id"] == run_id) & (curves["state"] == state)
+	return pd.DataFrame({0: np.asarray(curves["tick"][rows])}, index=np.asarray(curves["count"][rows]))
@@ -0,0 +1,54 @@
+import networkx as nx
+
+
+def sink_tree(network: nx.Graph, end_node: int, weight: str = "length") -> dict:
+	"""
+	sink_tree runs one reverse dijkstra search from the sink and keeps the
+	next step toward it for every node, so drivers can be routed without
+	a shortest path search per step
+
+	Params:
+	network: networkx graph object
+	end_node: node point of sink
+	weight: edge attribute used as the distance
+
+	Returns:
+	dict mapping every node that can reach the sink to the next node on
+	its shortest path toward the sink (the sink maps to itself)
+	"""
+
+	if network.is_directed():
+		network = network.reverse(copy=False)
+	pred, dist = nx.dijkstra_predecessor_and_distance(network, end_node, weight=weight)
+	# Of the neighbors on a shortest path, take the first in node order.
+	# Tied paths do not always match nx.shortest_path from the source,
+	# which breaks ties by search order; lengths do
+	rank = {node: i for i, node in enumerate(network)}
+	next_hop = dict()
+	for node, preds in pred.items():
+		if preds:
+			closer = [p for p in preds if dist[p] < dist[node]]
+			next_hop[node] = min(closer, key=rank.get) if closer else preds[0]
+	next_hop[end_node] = end_node
+	return next_hop
+
+
+def tree_path(next_hop: dict, source: int, end_node: int) -> list:
+	"""
+	tree_path follows a sink tree from a source node to the sink
+
+	Params:
+	next_hop: sink tree built by sink_tree
+	source: node point of origin
+	end_node: node point of sink
+
+	Returns:
+	list of nodes from source to end_node
+	"""
+
+	if source not in next_hop:
+		raise nx.NetworkXNoPath(f"No path between {source} and {end_node}.")
+	path = [source]
+	while path[-1] != end_node:
+		path.append(next_hop[path[-1]])
+	return path
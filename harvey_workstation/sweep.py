@@ -0,0 +1,160 @@
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from drivers import gen_driver_arrays
+from checkpoint import SweepCheckpoint
+
+# cell is the position of the parameter pair the job belongs to
+SweepJob = namedtuple("SweepJob", ["cell", "bad_prop", "prob_wrong_turn", "num_drivers", "seed"])
+
+# Set once per worker process by _init_worker
+_worker_context = None
+
+
+def make_jobs(bad_p: list, wrong_p: list, num_drivers: int, num_iters: int, seed: int = 0) -> list:
+	"""
+	make_jobs lists one job per replicate of every parameter pair, each
+	with its own seed derived from the sweep seed
+
+	Params:
+	bad_p: proportion of bad drivers of every cell
+	wrong_p: probability of taking a wrong turn of every cell
+	num_drivers: total number of drivers per run
+	num_iters: number of runs per cell
+	seed: seed of the whole sweep
+
+	Returns:
+	list of SweepJob
+	"""
+
+	cells = list(zip(bad_p, wrong_p))
+	children = np.random.SeedSequence(seed).spawn(len(cells) * num_iters)
+	jobs = []
+	for cell, (bad, wrong) in enumerate(cells):
+		for i in range(num_iters):
+			job_seed = int(children[cell * num_iters + i].generate_state(1)[0])
+			jobs.append(SweepJob(cell, float(bad), float(wrong), num_drivers, job_seed))
+	return jobs
+
+
+def replicate_jobs(cell: int, bad_prop: float, prob_wrong_turn: float, num_drivers: int,
+				   start: int, count: int, seed: int = 0) -> list:
+	"""
+	replicate_jobs lists replicates start to start + count - 1 of one
+	cell. Each replicate has its own seed from the sweep seed, the cell
+	and the replicate number, so replicates can be added in batches and
+	come out the same however the batches are cut
+
+	Params:
+	cell: position of the parameter pair
+	bad_prop: proportion of bad drivers
+	prob_wrong_turn: probability of taking a wrong turn
+	num_drivers: total number of drivers per run
+	start: number of the first replicate
+	count: number of replicates
+	seed: seed of the whole sweep
+
+	Returns:
+	list of SweepJob
+	"""
+
+	jobs = []
+	for i in range(start, start + count):
+		job_seed = int(np.random.SeedSequence(seed, spawn_key=(cell, i)).generate_state(1)[0])
+		jobs.append(SweepJob(cell, float(bad_prop), float(prob_wrong_turn), num_drivers, job_seed))
+	return jobs
+
+
+def run_job(context, job: SweepJob):
+	"""
+	run_job runs one replicate, seeding both the driver states and the
+	turns of the model from the job seed
+
+	Params:
+	context: object with a run(drivers, prob_wrong_turn) method, like
+	sim_context.SimContext
+	job: SweepJob to run
+
+	Returns:
+	result of context.run
+	"""
+
+	random.seed(job.seed)
+	drivers = gen_driver_arrays(job.num_drivers, job.bad_prop, seed=job.seed)
+	return context.run(drivers, job.prob_wrong_turn)
+
+
+def _init_worker(context) -> None:
+	global _worker_context
+	_worker_context = context
+
+
+def _run_timed_job(context, job: SweepJob) -> tuple:
+	start = time.perf_counter()
+	result = run_job(context, job)
+	return job, result, time.perf_counter() - start
+
+
+def _run_worker_job(job: SweepJob):
+	return _run_timed_job(_worker_context, job)
+
+
+def run_sweep(context, jobs: list, max_workers: int = None, checkpoint: str = None,
+			  durations: dict = None):
+	"""
+	run_sweep runs the jobs on a process pool and yields each result as
+	soon as it finishes. The context is sent to each worker once, and
+	every job is seeded by itself, so results do not depend on the number
+	of workers
+
+	Params:
+	context: object with a run(drivers, prob_wrong_turn) method, like
+	sim_context.SimContext
+	jobs: list of SweepJob
+	max_workers: number of worker processes, all cores when None and no
+	pool at all when 1
+	checkpoint: file every finished job is saved to, jobs already in it
+	are not run again, none when None. It only resumes a sweep whose
+	context has the same fingerprint attribute
+	durations: dict the run time in seconds of every job is stored in,
+	for jobs from the checkpoint the time they took when they ran
+
+	Returns:
+	generator of (job, result) pairs in order of completion, jobs from
+	the checkpoint first
+	"""
+
+	done = None if checkpoint is None else SweepCheckpoint(checkpoint, getattr(context, "fingerprint", None))
+	if done is not None:
+		for job in jobs:
+			if job in done:
+				if durations is not None and done.seconds[job] is not None:
+					durations[job] = done.seconds[job]
+				yield job, done.done[job]
+		jobs = [job for job in jobs if job not in done]
+
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+	if max_workers == 1:
+		for job in jobs:
+			job, result, seconds = _run_timed_job(context, job)
+			if durations is not None:
+				durations[job] = seconds
+			if done is not None:
+				done.add(job, result, seconds)
+			yield job, result
+		return
+
+	with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+							 initargs=(context,)) as pool:
+		futures = [pool.submit(_run_worker_job, job) for job in jobs]
+		for future in as_completed(futures):
+			job, result, seconds = future.result()
+			if durations is not None:
+				durations[job] = seconds
+			if done is not None:
+				done.add(job, result, seconds)
+			yield job, result
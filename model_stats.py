@@ -1,37 +1,242 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from complex_model import generate_drivers
-from complex_model import run_model
+from scipy import stats
 from gen_complex_net import gen_net
 from gen_complex_net import gen_data
+from limits import PartialResult, RunLimits, result_ticks
+from routing import TreeCache, set_tree_cache
+from sim_context import SimContext
+from sweep import make_jobs, replicate_jobs, run_sweep
 
 
-def gen_means(bad_p: list, wrong_p: list, num_iters: int) -> list:
+def load_context(origin_node: int = 204449959, end_node: int = 204350837,
+                 engine: str = "tick", time_weight: str = None, tree_cache_dir: str = None,
+                 limits: RunLimits = None) -> SimContext:
+    """
+    Params:
+    origin_node = node point of origin
+    end_node = node point of sink
+    engine = "tick", "event", "batch" or "congestion", see SimContext
+    time_weight = edge attribute used as the time of a move by the event
+    engine, e.g. "travel_time"
+    tree_cache_dir = directory where sink trees are saved and loaded from
+    in later sessions, trees are only kept in memory when None
+    limits = limits.RunLimits of every run, runs go on until every driver
+    arrived when None
+
+    Returns:
+    SimContext with the Burlington network loaded and routed once
+    """
+    if tree_cache_dir is not None:
+        set_tree_cache(TreeCache(cache_dir=tree_cache_dir))
+    net = gen_net(data=gen_data(), node_vals=["u", "v", "length"], compiled=True)
+    return SimContext(net, origin_node=origin_node, end_node=end_node,
+                      engine=engine, time_weight=time_weight, limits=limits)
+
+
+def ci_width(values: list, confidence: float = 0.95) -> float:
+    """
+    Params:
+    values = outcomes of the runs of one cell
+    confidence = confidence level of the interval
+
+    Returns:
+    full width of the t confidence interval on the mean, inf with fewer
+    than two values
+    """
+    if len(values) < 2:
+        return float("inf")
+    t = stats.t.ppf((1 + confidence) / 2, len(values) - 1)
+    return 2 * t * np.std(values, ddof=1) / np.sqrt(len(values))
+
+
+def gen_cell_stats(bad_p: list, wrong_p: list, target_width: float, context: SimContext = None,
+                   num_drivers: int = 100, seed: int = 0, max_workers: int = None,
+                   checkpoint: str = None, batch_size: int = 5, max_iters: int = 100,
+                   confidence: float = 0.95, cell_budget: float = None, cell_ids: list = None) -> list:
     """
     Params:
     bad_p = proportion of bad drivers
     wrong_p = probability of taking a wrong turn
-    num_iters = number of runs
+    target_width = width of the confidence interval on mean iterations
+    a cell stops at
+    context = network and sink tree shared by every run, loaded once
+    when not given
+    num_drivers = number of drivers per run
+    seed = seed of the whole sweep, every run gets its own seed from it
+    max_workers = number of worker processes, all cores when None
+    checkpoint = file finished runs are saved to
+    batch_size = runs added to every open cell per round
+    max_iters = most runs of one cell
+    confidence = confidence level of the interval
+    cell_budget = seconds of run time after which a cell gets no more
+    runs, no budget when None; runs restored from the checkpoint count
+    with the time they took when they ran
+    cell_ids = id of every cell used to seed its runs, unique within the
+    sweep, the position of the cell when None
+
+    Returns:
+    list of dicts of mean, ci_width (the width reached), num_iters,
+    seconds (run time) and partial (runs stopped by the limits of the
+    context, they count with the ticks they reached) for each proportion,
+    in the order given
+    """
+    if context is None:
+        context = load_context()
+    cells = list(zip(bad_p, wrong_p))
+    if cell_ids is None:
+        cell_ids = list(range(len(cells)))
+    position = {cell_id: i for i, cell_id in enumerate(cell_ids)}
+    outcomes = [[] for _ in cells]
+    seconds = [0.0] * len(cells)
+    partial = [0] * len(cells)
+    open_cells = list(range(len(cells)))
+    # Every round runs one batch of every open cell on the pool, in the
+    # order given, then closes the cells whose interval is narrow enough
+    while open_cells:
+        jobs = []
+        for cell in open_cells:
+            count = min(batch_size, max_iters - len(outcomes[cell]))
+            jobs += replicate_jobs(cell_ids[cell], *cells[cell], num_drivers=num_drivers,
+                                   start=len(outcomes[cell]), count=count, seed=seed)
+        durations = dict()
+        for job, mod in run_sweep(context, jobs, max_workers=max_workers, checkpoint=checkpoint,
+                                  durations=durations):
+            outcomes[position[job.cell]].append(result_ticks(mod))
+            seconds[position[job.cell]] += durations.get(job, 0.0)
+            partial[position[job.cell]] += isinstance(mod, PartialResult)
+        still_open = []
+        for cell in open_cells:
+            width = ci_width(outcomes[cell], confidence)
+            over_budget = cell_budget is not None and seconds[cell] >= cell_budget
+            if width > target_width and len(outcomes[cell]) < max_iters and not over_budget:
+                still_open.append(cell)
+            else:
+                print(*cells[cell], np.mean(outcomes[cell]), "+/-", width / 2, f"({len(outcomes[cell])} runs)")
+        open_cells = still_open
+    return [{"mean": np.mean(cell), "ci_width": ci_width(cell, confidence), "num_iters": len(cell),
+             "seconds": cell_seconds, "partial": cell_partial}
+            for cell, cell_seconds, cell_partial in zip(outcomes, seconds, partial)]
+
+
+def gen_means(bad_p: list, wrong_p: list, num_iters: int, context: SimContext = None,
+              num_drivers: int = 100, seed: int = 0, max_workers: int = None,
+              checkpoint: str = None, target_width: float = None, max_iters: int = 100) -> list:
+    """
+    Params:
+    bad_p = proportion of bad drivers
+    wrong_p = probability of taking a wrong turn
+    num_iters = number of runs, or runs per batch with a target_width
+    context = network and sink tree shared by every run, loaded once
+    when not given
+    num_drivers = number of drivers per run
+    seed = seed of the whole sweep, every run gets its own seed from it
+    max_workers = number of worker processes, all cores when None
+    checkpoint = file finished runs are saved to, so an interrupted sweep
+    started again with the same arguments only runs what is missing
+    target_width = run batches of num_iters runs per cell until the 95%
+    confidence interval on the mean is this narrow, see gen_cell_stats
+    max_iters = most runs of one cell with a target_width
 
     Retruns:
     list of mean values calculated for each proportion
     """
-    mean_list = []
-    for bad, wrong in zip(bad_p, wrong_p):
-        outcomes = []
-        for i in range(num_iters):
-                driver_list = generate_drivers(num_drivers=100, bad_driver_prop=bad, states=["good", "bad"])
-                net = gen_net(data=gen_data(), node_vals=["u", "v", "length"])
-                mod = run_model(drivers=driver_list, network=net, origin_node=204449959, 
-                        end_node=204350837, prob_wrong_turn=wrong)
-                outcomes.append(mod)
-        print(bad, wrong, np.mean(outcomes))
-        mean_list.append(np.mean(outcomes))
+    if target_width is not None:
+        cell_stats = gen_cell_stats(bad_p, wrong_p, target_width, context=context,
+                                    num_drivers=num_drivers, seed=seed, max_workers=max_workers,
+                                    checkpoint=checkpoint, batch_size=num_iters, max_iters=max_iters)
+        mean_list = [cell["mean"] for cell in cell_stats]
+        print(mean_list)
+        return mean_list
+    if context is None:
+        context = load_context()
+    jobs = make_jobs(bad_p, wrong_p, num_drivers=num_drivers, num_iters=num_iters, seed=seed)
+    outcomes = [[] for _ in range(len(jobs) // num_iters)]
+    for job, mod in run_sweep(context, jobs, max_workers=max_workers, checkpoint=checkpoint):
+        outcomes[job.cell].append(result_ticks(mod))
+        if len(outcomes[job.cell]) == num_iters:
+            print(job.bad_prop, job.prob_wrong_turn, np.mean(outcomes[job.cell]))
+    mean_list = [np.mean(cell) for cell in outcomes]
     print(mean_list)
     return mean_list
 
 
+def gen_refined_means(context: SimContext = None, num_drivers: int = 100, coarse: int = 6, levels: int = 3,
+                      diff_threshold: float = 0.1, noise_threshold: float = 0.1, target_width: float = 10,
+                      batch_size: int = 5, max_iters: int = 20, cell_budget: float = None, seed: int = 0,
+                      max_workers: int = None, checkpoint: str = None) -> tuple:
+    """
+    gen_refined_means runs a coarse grid of proportions over [0, 1] x [0, 1]
+    and then halves the spacing only inside the squares whose corners
+    differ sharply or are noisy, so the map of gen_plot gets its detail
+    where the surface changes. New cells run cheapest first, judged by the
+    mean of the corners around them
+
+    Params:
+    context = SimContext shared by every run, loaded when None
+    num_drivers = number of drivers of every run
+    coarse = number of proportions per axis of the first grid
+    levels = number of times the spacing is halved
+    diff_threshold = share of the range of all means the corners of a
+    square have to differ by to refine it
+    noise_threshold = share of the range of all means a corner's interval
+    has to be wide to refine its square
+    target_width, batch_size, max_iters, cell_budget = stopping rules of
+    every cell, see gen_cell_stats
+    seed = seed of the sweep
+    max_workers = number of worker processes, one per core when None
+    checkpoint = file finished runs are saved to, a rerun with it skips them
+
+    Returns:
+    lists of bad driver proportions, wrong turn probabilities and means of
+    every cell run, and the list of its gen_cell_stats dicts
+    """
+    if context is None:
+        context = load_context()
+    # Cells sit on the integer lattice of the finest level, so midpoints
+    # are exact and a cell keeps its id (and seeds) on every level
+    scale = (coarse - 1) * 2 ** levels
+    cells = dict()
+
+    def run_cells(points: list) -> None:
+        points = [point for point in dict.fromkeys(points) if point not in cells]
+        results = gen_cell_stats([i / scale for i, _ in points], [j / scale for _, j in points],
+                                 target_width=target_width, context=context, num_drivers=num_drivers,
+                                 seed=seed, max_workers=max_workers, checkpoint=checkpoint,
+                                 batch_size=batch_size, max_iters=max_iters, cell_budget=cell_budget,
+                                 cell_ids=[i * (scale + 1) + j for i, j in points])
+        cells.update(zip(points, results))
+
+    step = 2 ** levels
+    run_cells([(i, j) for i in range(0, scale + 1, step) for j in range(0, scale + 1, step)])
+    squares = [(i, j) for i in range(0, scale, step) for j in range(0, scale, step)]
+    for _ in range(levels):
+        means = [cell["mean"] for cell in cells.values()]
+        spread = max(max(means) - min(means), 1e-9)
+        half = step // 2
+        refined = []
+        for i, j in squares:
+            corners = [cells[point] for point in ((i, j), (i + step, j), (i, j + step), (i + step, j + step))]
+            corner_means = [cell["mean"] for cell in corners]
+            sharp = max(corner_means) - min(corner_means) > diff_threshold * spread
+            noisy = max(cell["ci_width"] for cell in corners) > noise_threshold * spread
+            if sharp or noisy:
+                refined.append(((i, j), np.mean(corner_means)))
+        # Squares with the lowest means have the shortest runs, run them first
+        refined.sort(key=lambda square: square[1])
+        points = []
+        for (i, j), _ in refined:
+            points += [(i + half, j), (i, j + half), (i + half, j + half), (i + step, j + half), (i + half, j + step)]
+        run_cells(points)
+        squares = [(i + di, j + dj) for (i, j), _ in refined for di in (0, half) for dj in (0, half)]
+        step = half
+
+    points = sorted(cells)
+    return ([i / scale for i, _ in points], [j / scale for _, j in points],
+            [cells[point]["mean"] for point in points], [cells[point] for point in points])
+
+
 def gen_plot(bad_p: list, wrong_p: list, means_list: list) -> None: 
     """
     Params:
@@ -51,8 +256,8 @@ def gen_plot(bad_p: list, wrong_p: list, means_list: list) -> None:
     plt.colorbar().set_label("Avg Iterations", rotation=270)
     plt.savefig("runs_colormap")
 
-bad_props = np.arange(0, 1.01, 0.01)
-wrong_turns_props = np.arange(0, 1.01, 0.01)
 
-means = gen_means(bad_p=bad_props, wrong_p=wrong_turns_props, num_iters=20) 
-gen_plot(bad_p=bad_props, wrong_p=wrong_turns_props, means_list=means)
+if __name__ == "__main__":
+    bad_props, wrong_turns_props, means, _ = gen_refined_means(checkpoint="model_stats_sweep.ckpt")
+    gen_plot(bad_p=bad_props, wrong_p=wrong_turns_props, means_list=means)
+
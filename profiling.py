@@ -0,0 +1,130 @@
+import json
+import time
+from collections import Counter, defaultdict
+
+
+class RunProfile:
+    """
+    RunProfile collects counters and timings of one model run. The models
+    take it as an optional profile argument and skip every call when it is
+    None, so runs without a profile pay one branch per hot spot
+
+    Params:
+    trace_path: file a json line per tick (time, moves, active nodes,
+    arrivals) is written to, none when None
+    labels: scenario parameters kept in the summary, e.g.
+    bad_prop=0.3, prob_wrong_turn=0.1
+    """
+
+    def __init__(self, trace_path: str = None, **labels):
+        self.labels = labels
+        self.counts = Counter()
+        self.times = defaultdict(float)
+        self.peak_queue = dict()
+        self.ticks = 0
+        self.moves = 0
+        self.trace_path = trace_path
+        self._trace = None if trace_path is None else open(trace_path, "w")
+        self._started = dict()
+        self._start = time.perf_counter()
+        self._end = None
+
+    def start(self, name: str) -> None:
+        self._started[name] = time.perf_counter()
+
+    def stop(self, name: str) -> None:
+        self.times[name] += time.perf_counter() - self._started.pop(name)
+        self.counts[name] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counts[name] += n
+
+    def queue_length(self, node: int, length: int) -> None:
+        if length > self.peak_queue.get(node, 0):
+            self.peak_queue[node] = length
+
+    def queue_lengths(self, nodes, lengths) -> None:
+        """
+        queue_lengths is queue_length for arrays of nodes and lengths
+        """
+
+        for node, length in zip(nodes.tolist(), lengths.tolist()):
+            if length > self.peak_queue.get(node, 0):
+                self.peak_queue[node] = length
+
+    def tick(self, moves: int, active: int, arrived: int) -> None:
+        """
+        tick records the end of one tick of a model
+
+        Params:
+        moves: number of drivers moved in the tick
+        active: number of active nodes at the start of the tick
+        arrived: number of drivers at the destination after the tick
+
+        Returns:
+        None
+        """
+
+        self.ticks += 1
+        self.moves += moves
+        if self._trace is not None:
+            self._trace.write(json.dumps({"tick": self.ticks, "time": time.perf_counter() - self._start,
+                                          "moves": int(moves), "active": int(active),
+                                          "arrived": int(arrived)}) + "\n")
+
+    def finish(self, node_ids=None) -> None:
+        """
+        finish stops the clock and closes the trace file
+
+        Params:
+        node_ids: node id of every node index, maps the peak queue keys
+        from node indices to node ids when given
+
+        Returns:
+        None
+        """
+
+        self._end = time.perf_counter()
+        if node_ids is not None:
+            self.peak_queue = {node_ids[node].item(): length for node, length in self.peak_queue.items()}
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def summary(self, top: int = 5) -> dict:
+        """
+        summary gathers the results of the run
+
+        Params:
+        top: number of nodes with the longest queues to list
+
+        Returns:
+        dict of labels, seconds, ticks, moves, ticks_per_second,
+        moves_per_second, counts, times (seconds per timed section) and
+        longest_queues ((node, peak length) pairs, longest first)
+        """
+
+        end = time.perf_counter() if self._end is None else self._end
+        seconds = end - self._start
+        longest = sorted(self.peak_queue.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {"labels": self.labels,
+                "seconds": seconds,
+                "ticks": self.ticks,
+                "moves": self.moves,
+                "ticks_per_second": self.ticks / seconds if seconds else 0.0,
+                "moves_per_second": self.moves / seconds if seconds else 0.0,
+                "counts": dict(self.counts),
+                "times": dict(self.times),
+                "longest_queues": longest}
+
+    def report(self) -> None:
+        summary = self.summary()
+        print(f"Profile {summary['labels']}")
+        print(f"{summary['seconds']:.3f} s, {summary['ticks']} ticks ({summary['ticks_per_second']:.0f}/s), "
+              f"{summary['moves']} moves ({summary['moves_per_second']:.0f}/s)")
+        for name, seconds in summary["times"].items():
+            print(f"{name}: {seconds:.3f} s over {summary['counts'][name]} calls")
+        for name, count in summary["counts"].items():
+            if name not in summary["times"]:
+                print(f"{name}: {count}")
+        print("Longest queues:", summary["longest_queues"])
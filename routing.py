@@ -0,0 +1,607 @@
+import heapq
+import os
+from collections import OrderedDict
+import networkx as nx
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components, dijkstra
+from checkpoint import load_state, save_state
+
+
+def sink_tree(network: nx.Graph, end_node: int, weight: str = "length") -> dict:
+    """
+    sink_tree runs one reverse dijkstra search from the sink and keeps the
+    next step toward it for every node, so drivers can be routed without
+    a shortest path search per step
+
+    Params:
+    network: networkx graph object
+    end_node: node point of sink
+    weight: edge attribute used as the distance
+
+    Returns:
+    dict mapping every node that can reach the sink to the next node on
+    its shortest path toward the sink (the sink maps to itself)
+    """
+
+    if network.is_directed():
+        network = network.reverse(copy=False)
+    pred, dist = nx.dijkstra_predecessor_and_distance(network, end_node, weight=weight)
+    # Of the neighbors on a shortest path, take the first in node order,
+    # like _break_ties does for the compiled trees. Tied paths do not
+    # always match nx.shortest_path from the source, which breaks ties by
+    # search order; lengths do
+    rank = {node: i for i, node in enumerate(network)}
+    next_hop = dict()
+    for node, preds in pred.items():
+        if preds:
+            closer = [p for p in preds if dist[p] < dist[node]]
+            next_hop[node] = min(closer, key=rank.get) if closer else preds[0]
+    next_hop[end_node] = end_node
+    return next_hop
+
+
+def tree_path(next_hop: dict, source: int, end_node: int) -> list:
+    """
+    tree_path follows a sink tree from a source node to the sink
+
+    Params:
+    next_hop: sink tree built by sink_tree
+    source: node point of origin
+    end_node: node point of sink
+
+    Returns:
+    list of nodes from source to end_node
+    """
+
+    if source not in next_hop:
+        raise nx.NetworkXNoPath(f"No path between {source} and {end_node}.")
+    path = [source]
+    while path[-1] != end_node:
+        path.append(next_hop[path[-1]])
+    return path
+
+
+def sink_tree_array(net, end_index: int, weight: str = "length") -> np.ndarray:
+    """
+    sink_tree_array builds the sink tree of a CompiledNet as a next hop
+    array in node index space
+
+    Params:
+    net: CompiledNet of the road network
+    end_index: node index of the sink
+    weight: edge attribute used as the distance
+
+    Returns:
+    array where entry i is the next node index from i toward the sink,
+    -1 when the sink cannot be reached (the sink points to itself)
+    """
+
+    return sink_tree_arrays(net, [end_index], weight=weight)[0]
+
+
+def _break_ties(graph: scipy.sparse.csr_matrix, dist: np.ndarray, pred: np.ndarray) -> np.ndarray:
+    """
+    _break_ties picks the next hop of every node among all its neighbors
+    on a shortest path to the sink, the one with the smallest node index,
+    so trees do not depend on the order dijkstra settles tied nodes in.
+    Across zero-cost edges only the predecessor dijkstra found counts,
+    which keeps the tree free of cycles
+
+    Params:
+    graph: forward adjacency of the search, row i holds the edges out of i
+    dist: distances to the sinks, shape (k, n)
+    pred: predecessors of the searches from the sinks, shape (k, n)
+
+    Returns:
+    next hop arrays of shape (k, n), -1 where the sink cannot be reached
+    """
+
+    graph = graph.sorted_indices()
+    rows = np.repeat(np.arange(graph.shape[0]), np.diff(graph.indptr))
+    cols = graph.indices
+    next_hop = pred.astype(np.int64)
+    next_hop[next_hop < 0] = -1
+    for k in range(len(dist)):
+        to_sink = dist[k][cols]
+        from_node = dist[k][rows]
+        tied = np.flatnonzero((to_sink < from_node) & (to_sink + graph.data == from_node))
+        # Columns are sorted within rows, the first tied entry of a row
+        # has the smallest index
+        tied_rows = rows[tied]
+        first = np.ones(len(tied), dtype=bool)
+        first[1:] = tied_rows[1:] != tied_rows[:-1]
+        next_hop[k, tied_rows[first]] = cols[tied[first]]
+    return next_hop
+
+
+def sink_tree_arrays(net, end_indices, weight: str = "length") -> np.ndarray:
+    """
+    sink_tree_arrays builds the sink trees of several sinks with one
+    scipy dijkstra call
+
+    Params:
+    net: CompiledNet of the road network
+    end_indices: node indices of the sinks
+    weight: edge attribute used as the distance
+
+    Returns:
+    array of shape (len(end_indices), n), row k is the next hop array of
+    end_indices[k] as built by sink_tree_array
+    """
+
+    end_indices = np.asarray(end_indices, dtype=np.int64)
+    graph = net.to_csr_matrix(weight)
+    reverse = graph.T.tocsr() if net.directed else graph
+    dist, pred = dijkstra(reverse, directed=True, indices=end_indices, return_predecessors=True)
+    next_hop = _break_ties(graph, dist.reshape(len(end_indices), -1), pred.reshape(len(end_indices), -1))
+    next_hop[np.arange(len(end_indices)), end_indices] = end_indices
+    return next_hop
+
+
+def sink_tree_costs(net, end_index: int, costs: np.ndarray) -> np.ndarray:
+    """
+    sink_tree_costs builds the sink tree of a CompiledNet over a cost per
+    adjacency entry, e.g. travel times with queue delays added, so the
+    two directions of an edge can cost different amounts
+
+    Params:
+    net: CompiledNet of the road network
+    end_index: node index of the sink
+    costs: positive cost of every adjacency entry, aligned with indices
+
+    Returns:
+    next hop array like sink_tree_array
+    """
+
+    # Search from the sink over reversed entries, so distances are the
+    # costs of getting to the sink
+    graph = scipy.sparse.csr_matrix((costs, net.indices, net.indptr), shape=(net.num_nodes, net.num_nodes))
+    dist, pred = dijkstra(graph.T.tocsr(), directed=True, indices=end_index, return_predecessors=True)
+    next_hop = _break_ties(graph, dist[np.newaxis], pred[np.newaxis])[0]
+    next_hop[end_index] = end_index
+    return next_hop
+
+
+def tree_path_array(next_hop: np.ndarray, source: int, end_index: int) -> np.ndarray:
+    """
+    tree_path_array follows a next hop array from a source to the sink
+
+    Params:
+    next_hop: next hop array built by sink_tree_array, or the same as a list
+    source: node index of origin
+    end_index: node index of the sink
+
+    Returns:
+    array of node indices from source to end_index
+    """
+
+    if next_hop[source] < 0:
+        raise nx.NetworkXNoPath(f"No path between node indices {source} and {end_index}.")
+    path = [source]
+    while path[-1] != end_index:
+        path.append(int(next_hop[path[-1]]))
+    return np.array(path, dtype=np.int64)
+
+
+class TreeCache:
+    """
+    TreeCache keeps sink trees in memory up to a byte budget, dropping the
+    least recently used ones first. Trees are keyed by the fingerprint of
+    the CompiledNet, the sink and the weight, so a cache can serve several
+    networks. With a cache_dir every tree is also saved there as .npy,
+    so later sweeps and sessions load trees instead of searching
+
+    Params:
+    max_bytes: memory budget of the trees held in memory
+    cache_dir: directory of the on-disk tier, none when None
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self._trees = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._trees
+
+    @staticmethod
+    def key(net, end_index: int, weight: str = "length") -> tuple:
+        return net.fingerprint, int(end_index), weight
+
+    def _file(self, key: tuple) -> str:
+        fingerprint, end_index, weight = key
+        return os.path.join(self.cache_dir, f"{fingerprint[:16]}_{weight}_{end_index}.npy")
+
+    def get(self, key: tuple) -> np.ndarray:
+        """
+        get returns a cached tree, looking on disk after memory
+
+        Params:
+        key: key from TreeCache.key
+
+        Returns:
+        read-only next hop array, or None when the tree is not cached
+        """
+
+        if key in self._trees:
+            self._trees.move_to_end(key)
+            return self._trees[key]
+        if self.cache_dir is None or not os.path.exists(self._file(key)):
+            return None
+        next_hop = np.load(self._file(key))
+        next_hop.flags.writeable = False
+        self._remember(key, next_hop)
+        return next_hop
+
+    def put(self, key: tuple, next_hop: np.ndarray) -> np.ndarray:
+        """
+        put stores a tree in memory, and on disk when there is a cache_dir
+
+        Params:
+        key: key from TreeCache.key
+        next_hop: next hop array from sink_tree_array
+
+        Returns:
+        the stored read-only int32 copy of next_hop
+        """
+
+        # int32 halves the memory of the stored trees, and the copy does
+        # not keep a whole chunk of sink_tree_arrays alive
+        next_hop = next_hop.astype(np.int32)
+        next_hop.flags.writeable = False
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            file_name = self._file(key)
+            # Write to a temporary file first so an interrupted save never
+            # leaves a partial tree behind
+            with open(file_name + ".part", "wb") as f:
+                np.save(f, next_hop)
+            os.replace(file_name + ".part", file_name)
+        self._remember(key, next_hop)
+        return next_hop
+
+    def _remember(self, key: tuple, next_hop: np.ndarray) -> None:
+        if key in self._trees:
+            self.nbytes -= self._trees.pop(key).nbytes
+        self._trees[key] = next_hop
+        self.nbytes += next_hop.nbytes
+        while self.nbytes > self.max_bytes and len(self._trees) > 1:
+            _, dropped = self._trees.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+
+    def clear(self) -> None:
+        """
+        clear empties the memory tier, files on disk are kept
+        """
+
+        self._trees.clear()
+        self.nbytes = 0
+
+    def tree(self, net, end_index: int, weight: str = "length") -> np.ndarray:
+        """
+        tree returns the sink tree of a CompiledNet, searching it only when
+        it is not cached
+
+        Params:
+        net: CompiledNet of the road network
+        end_index: node index of the sink
+        weight: edge attribute used as the distance
+
+        Returns:
+        read-only int32 next hop array, see sink_tree_array
+        """
+
+        key = self.key(net, end_index, weight)
+        next_hop = self.get(key)
+        if next_hop is None:
+            next_hop = self.put(key, sink_tree_array(net, end_index, weight=weight))
+        return next_hop
+
+
+# Shared by every model run of this process
+_tree_cache = TreeCache()
+
+
+def get_tree_cache() -> TreeCache:
+    return _tree_cache
+
+
+def set_tree_cache(cache: TreeCache) -> None:
+    """
+    set_tree_cache replaces the process-wide TreeCache, e.g. with one that
+    has a cache_dir or another budget
+
+    Params:
+    cache: TreeCache used from now on
+
+    Returns:
+    None
+    """
+
+    global _tree_cache
+    _tree_cache = cache
+
+
+class SinkTrees:
+    """
+    SinkTrees serves the sink trees of one CompiledNet from a TreeCache.
+    Drivers sharing a destination share one reverse search, missing sinks
+    are searched together in chunks, and runs given the same SinkTrees
+    reuse its trees. The trees are only held by the cache, so they count
+    against its byte budget, and a tree it has dropped is searched again
+    when asked for
+
+    Params:
+    net: CompiledNet of the road network
+    weight: edge attribute used as the distance
+    chunk_size: number of sinks searched per dijkstra call, bounding the
+    memory of one call to chunk_size * n predecessors
+    cache: TreeCache to use, the process-wide one when None
+    """
+
+    def __init__(self, net, weight: str = "length", chunk_size: int = 64, cache: TreeCache = None):
+        self.net = net
+        self.weight = weight
+        self.chunk_size = chunk_size
+        self.cache = get_tree_cache() if cache is None else cache
+
+    def __contains__(self, end_index: int) -> bool:
+        return self.cache.key(self.net, end_index, self.weight) in self.cache
+
+    def build(self, end_indices) -> None:
+        """
+        build searches every sink that is not cached
+
+        Params:
+        end_indices: node indices of the sinks
+
+        Returns:
+        None
+        """
+
+        missing = [end for end in np.unique(end_indices).tolist()
+                   if self.cache.get(self.cache.key(self.net, end, self.weight)) is None]
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            for end, next_hop in zip(chunk, sink_tree_arrays(self.net, chunk, weight=self.weight)):
+                self.cache.put(self.cache.key(self.net, end, self.weight), next_hop)
+
+    def tree(self, end_index: int) -> np.ndarray:
+        """
+        tree returns the next hop array of one sink, searching it if needed
+
+        Params:
+        end_index: node index of the sink
+
+        Returns:
+        read-only int32 next hop array, see sink_tree_array
+        """
+
+        key = self.cache.key(self.net, end_index, self.weight)
+        next_hop = self.cache.get(key)
+        if next_hop is None:
+            next_hop = self.cache.put(key, sink_tree_array(self.net, end_index, weight=self.weight))
+        return next_hop
+
+    def paths(self, sources, end_indices) -> tuple:
+        """
+        paths routes every source to its own sink, searching each distinct
+        sink once
+
+        Params:
+        sources: node index of origin of every route
+        end_indices: node index of the sink of every route
+
+        Returns:
+        offsets and nodes, route k is nodes[offsets[k]:offsets[k+1]]
+        """
+
+        sources = np.asarray(sources, dtype=np.int64)
+        end_indices = np.asarray(end_indices, dtype=np.int64)
+        self.build(end_indices)
+        routes = [None] * len(sources)
+        # One sink at a time, so only its tree has to stay in the cache
+        order = np.argsort(end_indices, kind="stable")
+        last_end = None
+        for k in order.tolist():
+            end = int(end_indices[k])
+            if end != last_end:
+                next_hop = self.tree(end)
+                last_end = end
+            routes[k] = tree_path_array(next_hop, int(sources[k]), end)
+        offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum([len(route) for route in routes], out=offsets[1:])
+        nodes = np.concatenate(routes) if routes else np.zeros(0, dtype=np.int64)
+        return offsets, nodes
+
+
+def _largest_component(net, weight: str = "length") -> np.ndarray:
+    _, labels = connected_components(net.to_csr_matrix(weight), directed=net.directed, connection="weak")
+    return np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+
+
+class LandmarkIndex:
+    """
+    LandmarkIndex answers point-to-point route queries with A* and landmark
+    (ALT) bounds: by the triangle inequality the distances from and to a
+    few far apart landmarks give a lower bound of the distance left to the
+    target, so a query searches along the shortest path instead of a whole
+    disk around the origin. The distances are built once per network,
+    save and load_or_build keep them in a file next to the graph cache
+
+    Params:
+    net: CompiledNet of the road network
+    weight: edge attribute used as the distance
+    landmarks: node indices of the landmarks
+    from_landmarks: array (landmarks, n) of distances from every landmark
+    to_landmarks: array (landmarks, n) of distances to every landmark,
+    None on undirected networks where they are the same
+    num_active: number of landmarks with the best bound at the origin used
+    by a query
+    """
+
+    def __init__(self, net, weight: str, landmarks: np.ndarray, from_landmarks: np.ndarray,
+                 to_landmarks: np.ndarray = None, num_active: int = 4):
+        self.net = net
+        self.weight = weight
+        self.landmarks = np.asarray(landmarks, dtype=np.int64)
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+        self.num_active = num_active
+        # Plain lists are much faster than numpy scalars in the search loop
+        self._indptr = net.indptr.tolist()
+        self._indices = net.indices.tolist()
+        self._weights = net.weights(weight).tolist()
+
+    @classmethod
+    def build(cls, net, num_landmarks: int = 16, weight: str = "length", seed: int = 0):
+        """
+        build picks landmarks by farthest point selection in the largest
+        component, each the node farthest from the ones before, and
+        searches their distances
+
+        Params:
+        net: CompiledNet of the road network
+        num_landmarks: number of landmarks
+        weight: edge attribute used as the distance
+        seed: seed of the node the selection starts from
+
+        Returns:
+        LandmarkIndex of the network
+        """
+
+        graph = net.to_csr_matrix(weight)
+        largest = _largest_component(net, weight)
+        start = np.random.default_rng(seed).choice(largest)
+        farthest = dijkstra(graph, directed=True, indices=start)
+        landmarks = []
+        rows = []
+        for _ in range(min(num_landmarks, len(largest))):
+            landmark = int(np.argmax(np.where(np.isfinite(farthest), farthest, -1)))
+            dist = dijkstra(graph, directed=True, indices=landmark)
+            farthest = dist if not landmarks else np.minimum(farthest, dist)
+            landmarks.append(landmark)
+            rows.append(dist)
+        to_landmarks = None
+        if net.directed:
+            to_landmarks = dijkstra(graph.T.tocsr(), directed=True, indices=landmarks)
+        return cls(net, weight, landmarks, np.array(rows), to_landmarks)
+
+    def save(self, path: str) -> None:
+        """
+        save writes the landmark distances and the fingerprint of the
+        network to an .npz file
+        """
+
+        arrays = {"landmarks": self.landmarks, "from_landmarks": self.from_landmarks}
+        if self.to_landmarks is not None:
+            arrays["to_landmarks"] = self.to_landmarks
+        save_state(path, {"fingerprint": self.net.fingerprint, "weight": self.weight}, **arrays)
+
+    @classmethod
+    def load_or_build(cls, net, path: str, num_landmarks: int = 16, weight: str = "length"):
+        """
+        load_or_build reads the index saved at path, building and saving
+        it when the file is missing or belongs to another network, weight
+        or number of landmarks
+
+        Params:
+        net: CompiledNet of the road network
+        path: .npz file of the index, e.g. gen_complex_net.LANDMARK_PATH
+        num_landmarks: number of landmarks
+        weight: edge attribute used as the distance
+
+        Returns:
+        LandmarkIndex of the network
+        """
+
+        meta, arrays = load_state(path)
+        # build never picks more landmarks than the largest component has nodes
+        if (meta is not None and meta["fingerprint"] == net.fingerprint and meta["weight"] == weight
+                and len(arrays["landmarks"]) == min(num_landmarks, len(_largest_component(net, weight)))):
+            return cls(net, weight, arrays["landmarks"], arrays["from_landmarks"], arrays.get("to_landmarks"))
+        index = cls.build(net, num_landmarks=num_landmarks, weight=weight)
+        index.save(path)
+        return index
+
+    def _bounds(self, source: int, target: int) -> memoryview:
+        # Lower bound of the distance to target from every node, using the
+        # landmarks that bound the source best. An infinite bound means the
+        # node cannot reach the target, nodes no landmark reaches get none
+        from_landmarks = self.from_landmarks
+        with np.errstate(invalid="ignore"):
+            if self.to_landmarks is None:
+                at_source = np.abs(from_landmarks[:, target] - from_landmarks[:, source])
+                active = np.argsort(-np.nan_to_num(at_source, nan=-np.inf))[:self.num_active]
+                bound = np.abs(from_landmarks[active] - from_landmarks[active, target][:, None]).max(axis=0)
+            else:
+                to_landmarks = self.to_landmarks
+                from_t = from_landmarks[:, target]
+                to_t = to_landmarks[:, target]
+                at_source = np.fmax(from_t - from_landmarks[:, source], to_landmarks[:, source] - to_t)
+                active = np.argsort(-np.nan_to_num(at_source, nan=-np.inf))[:self.num_active]
+                bound = np.fmax((from_t[active, None] - from_landmarks[active]).max(axis=0),
+                                (to_landmarks[active] - to_t[active, None]).max(axis=0))
+        bound[np.isnan(bound)] = 0.0
+        # Indexing a memoryview gives plain floats without a list of n
+        return memoryview(np.maximum(bound, 0.0))
+
+    def route(self, source: int, target: int) -> tuple:
+        """
+        route searches the shortest path between two node indices
+
+        Params:
+        source: node index of origin
+        target: node index of destination
+
+        Returns:
+        array of node indices from source to target and its distance
+        """
+
+        bound = self._bounds(source, target)
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        inf = float("inf")
+        dist = [inf] * self.net.num_nodes
+        dist[source] = 0.0
+        prev = {source: -1}
+        heap = [(bound[source], 0.0, source)]
+        while heap:
+            _, node_dist, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node_dist > dist[node]:
+                continue
+            for entry in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[entry]
+                new_dist = node_dist + weights[entry]
+                if new_dist < dist[neighbor] and bound[neighbor] < inf:
+                    dist[neighbor] = new_dist
+                    prev[neighbor] = node
+                    heapq.heappush(heap, (new_dist + bound[neighbor], new_dist, neighbor))
+        else:
+            raise nx.NetworkXNoPath(f"No path between node indices {source} and {target}.")
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        return np.array(path[::-1], dtype=np.int64), dist[target]
+
+    def shortest_path(self, source_node: int, target_node: int) -> list:
+        """
+        shortest_path is nx.shortest_path(network, source_node, target_node,
+        weight=weight) on node ids
+
+        Params:
+        source_node: node id of origin
+        target_node: node id of destination
+
+        Returns:
+        list of node ids from source_node to target_node
+        """
+
+        path, _ = self.route(self.net.index_of[source_node], self.net.index_of[target_node])
+        return self.net.node_ids[path].tolist()
@@ -0,0 +1,246 @@
+import os
+import random
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import dijkstra
+from checkpoint import context_fingerprint
+from compiled_net import as_compiled
+from complex_model import run_model_od
+from drivers import DriverArrays, gen_driver_arrays
+from limits import RunLimits
+from profiling import RunProfile
+from routing import SinkTrees
+
+# Columns of an OD matrix, one row per origin and destination pair
+OD_COLUMNS = ["origin", "destination", "trips"]
+
+
+def read_od_matrix(path: str) -> pd.DataFrame:
+    """
+    read_od_matrix reads an origin-destination demand matrix from a CSV or
+    Parquet file, picked by the extension of the path
+
+    Params:
+    path: .csv, .parquet or .pq file with columns origin, destination
+    (node ids) and trips (number of drivers)
+
+    Returns:
+    pd.DataFrame with columns origin, destination and trips
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        od = pd.read_csv(path)
+    elif ext in (".parquet", ".pq"):
+        od = pd.read_parquet(path)
+    else:
+        raise ValueError(f"Unknown OD matrix format {ext!r}, expected '.csv', '.parquet' or '.pq'.")
+    missing = [column for column in OD_COLUMNS if column not in od.columns]
+    if missing:
+        raise ValueError(f"OD matrix {path} has no column {', '.join(missing)}.")
+    od = od[OD_COLUMNS].astype(np.int64)
+    if (od["trips"] < 0).any():
+        raise ValueError(f"OD matrix {path} has negative trips.")
+    return od[od["trips"] > 0].reset_index(drop=True)
+
+
+def zone_od_matrix(zone_trips: pd.DataFrame, zone_nodes: dict, dest_nodes: dict = None,
+                   seed=None) -> pd.DataFrame:
+    """
+    zone_od_matrix maps a demand matrix between zones, like census tracts,
+    to one between nodes: every trip leaves from a node of its origin zone
+    and goes to a node of its destination zone, both drawn uniformly
+
+    Params:
+    zone_trips: pd.DataFrame with columns origin, destination (zone labels)
+    and trips
+    zone_nodes: dict of zone label to node ids trips leave from
+    dest_nodes: dict of zone label to node ids trips go to, zone_nodes
+    when None. Few destination nodes per zone mean few sink trees
+    seed: seed or numpy.random.Generator used to draw the nodes
+
+    Returns:
+    pd.DataFrame with columns origin, destination (node ids) and trips
+    """
+
+    rng = np.random.default_rng(seed)
+    if dest_nodes is None:
+        dest_nodes = zone_nodes
+    origins = []
+    destinations = []
+    for origin, destination, trips in zone_trips[OD_COLUMNS].itertuples(index=False):
+        origins.append(rng.choice(np.asarray(zone_nodes[origin]), size=trips))
+        destinations.append(rng.choice(np.asarray(dest_nodes[destination]), size=trips))
+    if not origins:
+        return pd.DataFrame({column: np.zeros(0, dtype=np.int64) for column in OD_COLUMNS})
+    pairs = pd.DataFrame({"origin": np.concatenate(origins).astype(np.int64),
+                          "destination": np.concatenate(destinations).astype(np.int64)})
+    od = pairs.groupby(["origin", "destination"], sort=True).size().rename("trips").reset_index()
+    od["trips"] = od["trips"].astype(np.int64)
+    return od[OD_COLUMNS]
+
+
+def gen_zones(network, num_zones: int, weight: str = "length", seed=None) -> tuple:
+    """
+    gen_zones splits a network into zones: num_zones random nodes are the
+    zone centers and every node joins the center it is closest to
+
+    Params:
+    network: CompiledNet or networkx graph object
+    num_zones: number of zones
+    weight: edge attribute used as the distance
+    seed: seed or numpy.random.Generator used to draw the centers
+
+    Returns:
+    dict of zone number to the node ids of the zone, node indices of the
+    centers and the distance matrix between centers (inf when one cannot
+    reach the other)
+    """
+
+    net = as_compiled(network)
+    rng = np.random.default_rng(seed)
+    centers = np.sort(rng.choice(net.num_nodes, size=num_zones, replace=False))
+    graph = net.to_csr_matrix(weight)
+    # One search from all centers at once labels every node with its closest
+    _, _, nearest = dijkstra(graph, directed=net.directed, indices=centers, min_only=True,
+                             return_predecessors=True)
+    zone_of = np.full(net.num_nodes, -1, dtype=np.int64)
+    reached = nearest >= 0
+    zone_of[reached] = np.searchsorted(centers, nearest[reached])
+    zone_nodes = {zone: net.node_ids[zone_of == zone] for zone in range(num_zones)}
+    distance = dijkstra(graph, directed=net.directed, indices=centers)[:, centers]
+    return zone_nodes, centers, distance
+
+
+def gravity_od_matrix(network, num_zones: int = 20, total_trips: int = 1000, beta: float = 1 / 2000,
+                      weight: str = "length", seed=None) -> pd.DataFrame:
+    """
+    gravity_od_matrix generates census-style demand: the network is split
+    into zones by gen_zones, zone sizes are their number of nodes and
+    trips between two zones follow a gravity model, size of origin times
+    size of destination times exp(-beta * distance). Trips leave from any
+    node of their zone and go to its center, so the matrix has at most
+    num_zones destinations and as many sink trees
+
+    Params:
+    network: CompiledNet or networkx graph object
+    num_zones: number of zones
+    total_trips: total number of trips, drawn multinomially over the pairs
+    beta: decay of the demand per unit of distance
+    weight: edge attribute used as the distance
+    seed: seed or numpy.random.Generator used for the zones and trips
+
+    Returns:
+    pd.DataFrame with columns origin, destination (node ids) and trips
+    """
+
+    net = as_compiled(network)
+    rng = np.random.default_rng(seed)
+    zone_nodes, centers, distance = gen_zones(net, num_zones, weight=weight, seed=rng)
+    size = np.array([len(zone_nodes[zone]) for zone in range(num_zones)], dtype=np.float64)
+    attraction = np.outer(size, size) * np.exp(-beta * distance)
+    attraction[~np.isfinite(distance)] = 0
+    np.fill_diagonal(attraction, 0)
+    if attraction.sum() == 0:
+        raise ValueError("No two zones of the network are connected.")
+    trips = rng.multinomial(total_trips, attraction.ravel() / attraction.sum()).reshape(num_zones, num_zones)
+    origin, destination = np.nonzero(trips)
+    zone_trips = pd.DataFrame({"origin": origin, "destination": destination,
+                               "trips": trips[origin, destination]})
+    dest_nodes = {zone: net.node_ids[[centers[zone]]] for zone in range(num_zones)}
+    return zone_od_matrix(zone_trips, zone_nodes, dest_nodes=dest_nodes, seed=rng)
+
+
+def od_drivers(od: pd.DataFrame, bad_driver_prop: float, duration: int = 0, states: list = ["good", "bad"],
+               seed=None) -> DriverArrays:
+    """
+    od_drivers makes one driver per trip of an OD matrix
+
+    Params:
+    od: pd.DataFrame with columns origin, destination and trips
+    bad_driver_prop: proportion of bad drivers on the network
+    duration: departures are drawn uniformly from ticks 0 to duration - 1,
+    all at tick 0 when 0
+    states: state of drivers, the second one is drawn with bad_driver_prop
+    seed: seed or numpy.random.Generator used for states and departures
+
+    Returns:
+    DriverArrays with node set to the origin, dest to the destination and
+    depart to the departure tick of every driver, for
+    complex_model.run_model_od
+    """
+
+    rng = np.random.default_rng(seed)
+    trips = od["trips"].to_numpy(dtype=np.int64)
+    drivers = gen_driver_arrays(int(trips.sum()), bad_driver_prop, states=states, seed=rng)
+    drivers.node[:] = np.repeat(od["origin"].to_numpy(dtype=np.int64), trips)
+    drivers.dest[:] = np.repeat(od["destination"].to_numpy(dtype=np.int64), trips)
+    if duration > 0:
+        drivers.depart[:] = rng.integers(0, duration, size=len(drivers))
+    return drivers
+
+
+class ODScenario:
+    """
+    ODScenario runs OD demand in a sweep, in place of a SimContext: it
+    holds the compiled network and the sink tree of every destination of
+    the matrix, built once. Each run gives its drivers trips drawn in
+    proportion to the matrix, so num_drivers of a sweep scales the demand
+
+    Params:
+    network: CompiledNet or networkx graph object
+    od: pd.DataFrame with columns origin, destination and trips, e.g. from
+    read_od_matrix or gravity_od_matrix
+    duration: departures are drawn uniformly from ticks 0 to duration - 1,
+    all at tick 0 when 0
+    weight: edge attribute used as the distance
+    limits: limits.RunLimits of every run, none when None
+    """
+
+    def __init__(self, network, od: pd.DataFrame, duration: int = 0, weight: str = "length",
+                 limits: RunLimits = None):
+        self.net = as_compiled(network)
+        self.od = od[OD_COLUMNS].reset_index(drop=True)
+        self.duration = duration
+        self.weight = weight
+        self.limits = limits
+        self.trees = SinkTrees(self.net, weight=weight)
+        self.trees.build(self.net.to_index(self.od["destination"].to_numpy()))
+        trips = self.od["trips"].to_numpy(dtype=np.float64)
+        self._share = trips / trips.sum()
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        fingerprint of the network, OD matrix, duration and limits, checked
+        by sweep.run_sweep against its checkpoint
+        """
+
+        od = pd.util.hash_pandas_object(self.od, index=False).to_numpy()
+        return context_fingerprint("ODScenario", self.net.fingerprint, od.tobytes(), self.duration,
+                                   self.weight, None if self.limits is None else self.limits.key)
+
+    def run(self, drivers, prob_wrong_turn: float, profile: RunProfile = None):
+        """
+        run runs one replicate of the demand on the shared network
+
+        Params:
+        drivers: DriverArrays, their trips are drawn from the random
+        module, seeded per job by sweep.run_job
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        profile: profiling.RunProfile of the run, none when None
+
+        Returns:
+        tick of the last arrival, or a limits.PartialResult when a limit
+        stopped the run
+        """
+
+        rng = np.random.default_rng(random.getrandbits(64))
+        pair = rng.choice(len(self.od), size=len(drivers), p=self._share)
+        drivers.node[:] = self.od["origin"].to_numpy()[pair]
+        drivers.dest[:] = self.od["destination"].to_numpy()[pair]
+        if self.duration > 0:
+            drivers.depart[:] = rng.integers(0, self.duration, size=len(drivers))
+        return run_model_od(drivers, self.net, prob_wrong_turn, trees=self.trees,
+                            profile=profile, limits=self.limits)
@@ -0,0 +1,131 @@
+import itertools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# One driver of a schedule: departure tick, id, state code, origin and
+# destination node ids
+Departure = namedtuple("Departure", ["tick", "id", "state", "origin", "dest"])
+
+# Share of a day's trips starting in each hour, from midnight, with the
+# morning and evening peaks of a commuter town
+RUSH_HOUR = [0.5, 0.3, 0.2, 0.2, 0.4, 1.2, 3.5, 7.0, 7.5, 5.0, 4.2, 4.5,
+             5.0, 4.8, 5.0, 6.0, 7.5, 8.0, 6.0, 4.0, 3.0, 2.4, 1.6, 1.0]
+# Ticks per day at one tick per second
+DAY_TICKS = 86400
+# Ticks drawn per numpy call, bounds the memory of a schedule
+CHUNK_TICKS = 3600
+
+
+def poisson_ticks(rate: float, duration: int, seed=None):
+    """
+    poisson_ticks draws departures at a constant rate, the number leaving
+    on each tick being Poisson distributed
+
+    Params:
+    rate: mean departures per tick
+    duration: number of ticks with departures
+    seed: seed or numpy.random.Generator
+
+    Returns:
+    generator of departure ticks in order
+    """
+
+    return profile_ticks([1.0], rate * duration, duration, seed=seed)
+
+
+def profile_ticks(profile: list, total: float, duration: int = DAY_TICKS, seed=None):
+    """
+    profile_ticks draws departures whose rate follows a profile, e.g.
+    RUSH_HOUR: the ticks are split into len(profile) equal periods, each
+    getting its share of total, and the number leaving on each tick is
+    Poisson distributed with the rate of its period
+
+    Params:
+    profile: relative departures of every period
+    total: mean number of departures over all ticks
+    duration: number of ticks with departures
+    seed: seed or numpy.random.Generator
+
+    Returns:
+    generator of departure ticks in order
+    """
+
+    rng = np.random.default_rng(seed)
+    profile = np.asarray(profile, dtype=np.float64)
+    period = np.minimum(np.arange(duration) * len(profile) // duration, len(profile) - 1)
+    # Each period's share spread over its ticks
+    rate = total * profile / profile.sum() / np.bincount(period, minlength=len(profile)).clip(1)
+    for start in range(0, duration, CHUNK_TICKS):
+        ticks = np.arange(start, min(start + CHUNK_TICKS, duration))
+        counts = rng.poisson(rate[period[ticks]])
+        yield from np.repeat(ticks, counts).tolist()
+
+
+def explicit_ticks(ticks):
+    """
+    explicit_ticks streams given departure ticks, e.g. read from a file
+
+    Params:
+    ticks: iterable of departure ticks in order
+
+    Returns:
+    generator of departure ticks
+    """
+
+    last = 0
+    for tick in ticks:
+        tick = int(tick)
+        if tick < last:
+            raise ValueError(f"Departure tick {tick} comes after tick {last}, ticks must be in order.")
+        last = tick
+        yield tick
+
+
+def scheduled_drivers(ticks, bad_driver_prop: float, origin_node: int = None, end_node: int = None,
+                      od: pd.DataFrame = None, seed=None):
+    """
+    scheduled_drivers makes a driver for every departure tick when it is
+    asked for, so only drivers about to leave are ever in memory. Drivers
+    go from origin_node to end_node, or between a pair drawn from an OD
+    matrix in proportion to its trips
+
+    Params:
+    ticks: departure ticks in order, e.g. from profile_ticks
+    bad_driver_prop: proportion of bad drivers on the network
+    origin_node: node point of origin, when there is no od
+    end_node: node point of sink, when there is no od
+    od: pd.DataFrame with columns origin, destination and trips, e.g.
+    from scenarios.read_od_matrix
+    seed: seed or numpy.random.Generator used for states and pairs
+
+    Returns:
+    generator of Departure in order of departure, for
+    complex_model.run_model_schedule
+    """
+
+    if (od is None) == (origin_node is None or end_node is None):
+        raise ValueError("Give either origin_node and end_node or an od matrix.")
+    rng = np.random.default_rng(seed)
+    if od is not None:
+        origins = od["origin"].to_numpy(dtype=np.int64)
+        dests = od["destination"].to_numpy(dtype=np.int64)
+        share = od["trips"].to_numpy(dtype=np.float64)
+        share = share / share.sum()
+    ticks = iter(ticks)
+    next_id = 1
+    while True:
+        chunk = list(itertools.islice(ticks, CHUNK_TICKS))
+        if not chunk:
+            return
+        states = (rng.random(len(chunk)) < bad_driver_prop).astype(np.int64).tolist()
+        if od is None:
+            chunk_origins = itertools.repeat(origin_node)
+            chunk_dests = itertools.repeat(end_node)
+        else:
+            pair = rng.choice(len(share), size=len(chunk), p=share)
+            chunk_origins = origins[pair].tolist()
+            chunk_dests = dests[pair].tolist()
+        for tick, state, origin, dest in zip(chunk, states, chunk_origins, chunk_dests):
+            yield Departure(tick, next_id, state, origin, dest)
+            next_id += 1
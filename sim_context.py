@@ -0,0 +1,104 @@
+import numpy as np
+from checkpoint import context_fingerprint
+from compiled_net import as_compiled
+from complex_model import run_model, run_model_batch, run_model_congestion, run_model_events
+from congestion import edge_capacities
+from limits import RunLimits
+from profiling import RunProfile
+from routing import get_tree_cache
+
+
+class SimContext:
+    """
+    SimContext holds what every replicate of a sweep shares: the compiled
+    network and the sink tree, built once. run_model keeps queues and
+    driver state per run, so a replicate only pays for its own drivers
+
+    Params:
+    network: CompiledNet or networkx graph object
+    origin_node: node point of origin
+    end_node: node point of sink
+    weight: edge attribute used as the distance
+    engine: "tick" runs complex_model.run_model, "event" runs
+    complex_model.run_model_events, "batch" runs
+    complex_model.run_model_batch and "congestion" runs
+    complex_model.run_model_congestion; only "tick" is the original
+    model, the others move drivers differently and give other ticks
+    time_weight: edge attribute used as the time of a move by the event
+    engine, None for one tick per move
+    tick_seconds: length of a tick of the congestion engine in seconds
+    reroute_every: number of ticks between two rebuilds of the sink tree
+    over queue-adjusted costs by the congestion engine, fixed when None
+    limits: limits.RunLimits of every run, so a sweep gets partial results
+    instead of runs that never end, none when None
+    """
+
+    def __init__(self, network, origin_node: int, end_node: int, weight: str = "length",
+                 engine: str = "tick", time_weight: str = None, limits: RunLimits = None,
+                 tick_seconds: float = 1.0, reroute_every: int = None):
+        if engine not in ("tick", "event", "batch", "congestion"):
+            raise ValueError(f"Unknown engine {engine!r}, expected 'tick', 'event', 'batch' or 'congestion'.")
+        if time_weight is not None and engine != "event":
+            raise ValueError("time_weight needs the event engine.")
+        if reroute_every is not None and engine != "congestion":
+            raise ValueError("reroute_every needs the congestion engine.")
+        self.net = as_compiled(network)
+        self.origin_node = origin_node
+        self.end_node = end_node
+        self.weight = weight
+        self.engine = engine
+        self.time_weight = time_weight
+        self.limits = limits
+        self.tick_seconds = tick_seconds
+        self.reroute_every = reroute_every
+        # Read-only, and shared with the process-wide tree cache
+        self.next_hop = get_tree_cache().tree(self.net, self.net.index_of[end_node], weight=weight)
+        self.capacity = edge_capacities(self.net, tick_seconds=tick_seconds) if engine == "congestion" else None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        fingerprint of the network, end points, engine and limits, the
+        results of a job depend on nothing else; sweep.run_sweep checks it
+        against its checkpoint
+        """
+
+        return context_fingerprint("SimContext", self.net.fingerprint, self.origin_node, self.end_node,
+                                   self.weight, self.engine, self.time_weight, self.tick_seconds,
+                                   self.reroute_every, None if self.limits is None else self.limits.key)
+
+    def run(self, drivers, prob_wrong_turn: float, profile: RunProfile = None):
+        """
+        run runs one replicate of the model on the shared network
+
+        Params:
+        drivers: DriverArrays or list of drivers from generate_drivers
+        prob_wrong_turn: probablity that bad driver makes a random turn
+        at a given node
+        profile: profiling.RunProfile of the run, none when None
+
+        Returns:
+        number of iterations required for all drivers to get to final
+        destination, or the time of the last arrival with a time_weight
+        (the tick of the last arrival for the congestion engine), or
+        a limits.PartialResult when a limit stopped the run
+        """
+
+        if self.engine == "event":
+            return run_model_events(drivers=drivers, network=self.net, origin_node=self.origin_node,
+                                    end_node=self.end_node, prob_wrong_turn=prob_wrong_turn,
+                                    next_hop=self.next_hop, time_weight=self.time_weight,
+                                    profile=profile, limits=self.limits)
+        if self.engine == "congestion":
+            return run_model_congestion(drivers=drivers, network=self.net, origin_node=self.origin_node,
+                                        end_node=self.end_node, prob_wrong_turn=prob_wrong_turn,
+                                        next_hop=self.next_hop if self.reroute_every is None else None,
+                                        capacity=self.capacity,
+                                        reroute_every=self.reroute_every, profile=profile, limits=self.limits)
+        if self.engine == "batch":
+            return run_model_batch(drivers=drivers, network=self.net, origin_node=self.origin_node,
+                                   end_node=self.end_node, prob_wrong_turn=prob_wrong_turn,
+                                   next_hop=self.next_hop, profile=profile, limits=self.limits)
+        return run_model(drivers=drivers, network=self.net, origin_node=self.origin_node,
+                         end_node=self.end_node, prob_wrong_turn=prob_wrong_turn,
+                         next_hop=self.next_hop, profile=profile, limits=self.limits)
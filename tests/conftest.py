@@ -0,0 +1,36 @@
+import functools
+import os
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import end_points, synthetic_edges, synthetic_net  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption("--full-sizes", action="store_true",
+                     help="benchmark every size up to 200k nodes")
+    parser.addoption("--burlington", action="store_true",
+                     help="also benchmark the Burlington network, needs osmnx and geopandas")
+
+
+@pytest.fixture(scope="session")
+def synthetic_network():
+    """
+    synthetic_network builds the synthetic road networks of the tests once
+    per session
+
+    Returns:
+    function of num_nodes and seed giving the edges, the CompiledNet and
+    the origin and sink node ids of the network
+    """
+
+    @functools.lru_cache(maxsize=None)
+    def build(num_nodes: int, seed: int = 0) -> tuple:
+        edges = synthetic_edges(num_nodes, seed=seed)
+        net = synthetic_net(edges)
+        return (edges, net) + end_points(net)
+
+    return build
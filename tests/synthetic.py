@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import connected_components
+from compiled_net import compile_edges
+
+# Speeds of the synthetic road classes, as in gen_complex_net.SPEED_LIMITS
+SYNTHETIC_SPEEDS = {"primary": 80.4672, "residential": 40.2336}
+
+
+def synthetic_edges(num_nodes: int, seed: int = 0, drop: float = 0.1) -> pd.DataFrame:
+    """
+    synthetic_edges builds a road-like grid in the shape of the gen_data
+    edge frame: jittered intersections about 100 m apart, primary roads
+    every 10th row and column, residential streets elsewhere and a share
+    of street segments missing
+
+    Params:
+    num_nodes: about the number of intersections, rounded to a square
+    seed: seed of the layout
+    drop: share of grid segments left out
+
+    Returns:
+    pd.DataFrame with columns u, v, key, length, speed_kph, travel_time
+    and highway, node ids look like OSM ids and follow the rows of the
+    grid
+    """
+
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(num_nodes)))
+    row, col = np.divmod(np.arange(side * side), side)
+    x = col * 100.0 + rng.uniform(-30, 30, side * side)
+    y = row * 100.0 + rng.uniform(-30, 30, side * side)
+    right = np.flatnonzero(col < side - 1)
+    up = np.flatnonzero(row < side - 1)
+    u = np.concatenate([right, up])
+    v = np.concatenate([right + 1, up + side])
+    keep = rng.random(len(u)) >= drop
+    u, v = u[keep], v[keep]
+
+    main_road = ((row[u] == row[v]) & (row[u] % 10 == 0)) | ((col[u] == col[v]) & (col[u] % 10 == 0))
+    highway = np.where(main_road, "primary", "residential")
+    speed_kph = np.array([SYNTHETIC_SPEEDS[road] for road in highway])
+    length = np.hypot(x[u] - x[v], y[u] - y[v])
+    node_ids = 200000000 + np.arange(side * side)
+    return pd.DataFrame({"u": node_ids[u], "v": node_ids[v], "key": 0, "length": length,
+                         "speed_kph": speed_kph, "travel_time": length / (speed_kph / 3.6),
+                         "highway": highway})
+
+
+def end_points(net) -> tuple:
+    """
+    end_points picks the origin and sink of a synthetic network: the first
+    and last node of its largest component, opposite corners of the grid
+
+    Params:
+    net: CompiledNet of synthetic_edges
+
+    Returns:
+    origin node id and sink node id
+    """
+
+    _, labels = connected_components(net.to_csr_matrix(), directed=False)
+    largest = np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+    ids = net.node_ids[largest]
+    return ids.min().item(), ids.max().item()
+
+
+def synthetic_net(edges: pd.DataFrame):
+    """
+    synthetic_net compiles the edges of synthetic_edges, as
+    gen_net(compiled=True) does for gen_data
+
+    Params:
+    edges: pd.DataFrame from synthetic_edges
+
+    Returns:
+    CompiledNet of the edges
+    """
+
+    return compile_edges(edges["u"].to_numpy(), edges["v"].to_numpy(), length=edges["length"].to_numpy(),
+                         travel_time=edges["travel_time"].to_numpy(), speed_kph=edges["speed_kph"].to_numpy(),
+                         highway=edges["highway"].to_numpy())
@@ -0,0 +1,177 @@
+import random
+import networkx as nx
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import connected_components
+import complex_model
+from drivers import gen_driver_arrays
+from gen_total_net import network_stats
+from routing import LandmarkIndex, get_tree_cache
+from scenarios import gravity_od_matrix, od_drivers
+from synthetic import synthetic_net
+
+pytest.importorskip("pytest_benchmark")
+
+# Graph sizes, driver counts and bad driver proportions of every run,
+# FULL with --full-sizes
+QUICK = {"nodes": [1000, 10000], "drivers": [100, 1000], "bad_props": [0.0, 0.5]}
+FULL = {"nodes": [1000, 10000, 50000, 200000], "drivers": [100, 1000, 10000],
+        "bad_props": [0.0, 0.1, 0.5, 1.0]}
+PROB_WRONG_TURN = 0.1
+# Point-to-point routes timed per query benchmark
+NUM_QUERIES = 20
+# Origin and sink of the Burlington runs of model_stats
+BURLINGTON_ENDS = (204449959, 204350837)
+# Runs per model benchmark, each with the same seeds
+ROUNDS = 3
+ENGINES = [complex_model.run_model, complex_model.run_model_events, complex_model.run_model_batch,
+           complex_model.run_model_congestion]
+
+
+def pytest_generate_tests(metafunc):
+    sizes = FULL if metafunc.config.getoption("full_sizes") else QUICK
+    if "network" in metafunc.fixturenames:
+        networks = [f"nodes={num_nodes}" for num_nodes in sizes["nodes"]]
+        if metafunc.config.getoption("burlington"):
+            networks.append("net=burlington")
+        metafunc.parametrize("network", networks, indirect=True)
+    if "num_nodes" in metafunc.fixturenames:
+        metafunc.parametrize("num_nodes", sizes["nodes"], ids=lambda n: f"nodes={n}")
+    if "num_drivers" in metafunc.fixturenames:
+        metafunc.parametrize("num_drivers", sizes["drivers"], ids=lambda n: f"drivers={n}")
+    if "bad_prop" in metafunc.fixturenames:
+        metafunc.parametrize("bad_prop", sizes["bad_props"], ids=lambda b: f"bad={b}")
+
+
+@pytest.fixture(scope="session")
+def burlington(request):
+    """
+    burlington builds the Burlington network of gen_complex_net once, for
+    runs with --burlington
+
+    Returns:
+    edges of gen_data, its networkx graph and CompiledNet
+    """
+
+    if not request.config.getoption("burlington"):
+        pytest.skip("needs --burlington")
+    pytest.importorskip("osmnx")
+    pytest.importorskip("geopandas")
+    from gen_complex_net import gen_data, gen_net
+
+    edges = gen_data()
+    return (edges, gen_net(data=edges.copy(), node_vals=["u", "v", "length"]),
+            gen_net(data=edges.copy(), node_vals=["u", "v", "length"], compiled=True))
+
+
+@pytest.fixture
+def network(request, synthetic_network):
+    """
+    network gives the networkx graph, CompiledNet, origin and sink of the
+    network named by the parameter, "nodes=<n>" or "net=burlington"
+    """
+
+    if request.param == "net=burlington":
+        _, graph, net = request.getfixturevalue("burlington")
+        return (graph, net) + BURLINGTON_ENDS
+    edges, net, origin, end = synthetic_network(int(request.param.split("=")[1]))
+    return (nx.from_pandas_edgelist(edges, source="u", target="v", edge_attr="length"), net, origin, end)
+
+
+def reseed():
+    # Every round of a model benchmark draws the same wrong turns
+    random.seed(0)
+
+
+def reset():
+    reseed()
+    get_tree_cache().clear()
+
+
+def test_generate_drivers(benchmark, num_drivers):
+    benchmark(complex_model.generate_drivers, num_drivers, 0.5, ["good", "bad"])
+
+
+def test_gen_driver_arrays(benchmark, num_drivers):
+    benchmark(gen_driver_arrays, num_drivers, 0.5, seed=0)
+
+
+def test_compile_edges(benchmark, synthetic_network, num_nodes):
+    edges = synthetic_network(num_nodes)[0]
+    benchmark(synthetic_net, edges)
+
+
+def test_gen_net(benchmark, burlington):
+    from gen_complex_net import gen_net
+
+    edges = burlington[0]
+    benchmark.pedantic(lambda: gen_net(data=edges.copy(), node_vals=["u", "v", "length"]), rounds=ROUNDS)
+
+
+def test_gen_net_compiled(benchmark, burlington):
+    from gen_complex_net import gen_net
+
+    edges = burlington[0]
+    benchmark.pedantic(lambda: gen_net(data=edges.copy(), node_vals=["u", "v", "length"], compiled=True),
+                       rounds=ROUNDS)
+
+
+def test_network_stats(benchmark, network):
+    benchmark.pedantic(network_stats, args=(network[1],), rounds=ROUNDS)
+
+
+def test_sink_tree(benchmark, network):
+    _, net, _, end = network
+    benchmark.pedantic(lambda: get_tree_cache().tree(net, net.index_of[end]), setup=get_tree_cache().clear,
+                       rounds=ROUNDS)
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.__name__)
+def test_engine(benchmark, engine, network, num_drivers, bad_prop):
+    _, net, origin, end = network
+    benchmark.pedantic(lambda: engine(gen_driver_arrays(num_drivers, bad_prop, seed=0), net, origin, end,
+                                      PROB_WRONG_TURN),
+                       setup=reseed, rounds=ROUNDS)
+
+
+def test_run_model_rand_init(benchmark, network, bad_prop):
+    net = network[1]
+    # Random destinations need a tree per distinct destination, keep them small
+    if net.num_nodes > 10000:
+        pytest.skip("one sink tree per driver")
+    benchmark.pedantic(lambda: complex_model.run_model_rand_init(gen_driver_arrays(100, bad_prop, seed=0), net,
+                                                                 PROB_WRONG_TURN),
+                       setup=reset, rounds=ROUNDS)
+
+
+def test_run_model_od(benchmark, network, bad_prop, request):
+    net = network[1]
+    # Many origins, one sink tree per destination zone
+    sizes = FULL if request.config.getoption("full_sizes") else QUICK
+    od = gravity_od_matrix(net, num_zones=20, total_trips=max(sizes["drivers"]), seed=0)
+    benchmark.extra_info["drivers"] = int(od.trips.sum())
+    benchmark.pedantic(lambda: complex_model.run_model_od(od_drivers(od, bad_prop, seed=0), net, PROB_WRONG_TURN),
+                       setup=reset, rounds=ROUNDS)
+
+
+@pytest.fixture
+def query_pairs(network):
+    """
+    query_pairs draws NUM_QUERIES pairs of nodes of the largest component
+    of the network
+    """
+
+    net = network[1]
+    _, labels = connected_components(net.to_csr_matrix(), directed=False)
+    largest = net.node_ids[labels == np.argmax(np.bincount(labels))]
+    return np.random.default_rng(0).choice(largest, size=(NUM_QUERIES, 2)).tolist()
+
+
+def test_nx_shortest_path(benchmark, network, query_pairs):
+    graph = network[0]
+    benchmark(lambda: [nx.shortest_path(graph, s, t, weight="length") for s, t in query_pairs])
+
+
+def test_landmark_route(benchmark, network, query_pairs):
+    index = LandmarkIndex.build(network[1])
+    benchmark(lambda: [index.shortest_path(s, t) for s, t in query_pairs])
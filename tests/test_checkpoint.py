@@ -0,0 +1,88 @@
+import os
+import random
+import networkx as nx
+import numpy as np
+import pytest
+from checkpoint import SweepCheckpoint
+from compiled_net import compile_net
+from complex_model import generate_drivers, run_model, run_model_batch
+from drivers import as_driver_arrays, gen_driver_arrays
+from limits import PartialResult, RunLimits
+from sim_context import SimContext
+from sweep import make_jobs, run_sweep
+
+
+def grid_net():
+    graph = nx.convert_node_labels_to_integers(nx.grid_2d_graph(10, 10))
+    nx.set_edge_attributes(graph, 1.0, "length")
+    return compile_net(graph)
+
+
+def test_sweep_resumes_from_checkpoint(tmp_path):
+    context = SimContext(grid_net(), origin_node=0, end_node=99)
+    jobs = make_jobs([0.2, 0.8], [0.1, 0.3], num_drivers=30, num_iters=3, seed=5)
+    expected = dict(run_sweep(context, jobs, max_workers=1))
+
+    path = str(tmp_path / "sweep.ckpt")
+    for count, _ in enumerate(run_sweep(context, jobs, max_workers=1, checkpoint=path), 1):
+        if count == 4:
+            break
+    # A record cut off by an interruption is dropped
+    with open(path, "ab") as f:
+        f.write(b"\x80\x04partial")
+    assert len(SweepCheckpoint(path, context.fingerprint).done) == 4
+    durations = dict()
+    assert dict(run_sweep(context, jobs, max_workers=1, checkpoint=path, durations=durations)) == expected
+    # Restored jobs keep the time they took, so a cell_budget survives a resume
+    assert set(durations) == set(jobs) and all(seconds > 0 for seconds in durations.values())
+    assert len(SweepCheckpoint(path, context.fingerprint).done) == len(jobs)
+
+
+def test_sweep_refuses_checkpoint_of_another_context(tmp_path):
+    net = grid_net()
+    jobs = make_jobs([0.5], [0.2], num_drivers=20, num_iters=2, seed=1)
+    path = str(tmp_path / "sweep.ckpt")
+    list(run_sweep(SimContext(net, origin_node=0, end_node=99), jobs, max_workers=1, checkpoint=path))
+    for context in (SimContext(net, origin_node=0, end_node=99, engine="batch"),
+                    SimContext(net, origin_node=0, end_node=90),
+                    SimContext(net, origin_node=0, end_node=99, limits=RunLimits(max_ticks=10))):
+        with pytest.raises(ValueError):
+            list(run_sweep(context, jobs, max_workers=1, checkpoint=path))
+    assert len(SweepCheckpoint(path, SimContext(net, origin_node=0, end_node=99).fingerprint).done) == 2
+
+
+def test_batch_run_resumes_from_checkpoint(tmp_path):
+    net = grid_net()
+    drivers = gen_driver_arrays(60, 0.5, seed=2)
+    expected = run_model_batch(drivers, net, 0, 99, 0.3, seed=7)
+    expected_iterations = drivers.iterations.copy()
+
+    path = str(tmp_path / "run.npz")
+    partial = run_model_batch(drivers, net, 0, 99, 0.3, seed=7, checkpoint=path, checkpoint_every=5,
+                              limits=RunLimits(max_ticks=expected // 2))
+    assert isinstance(partial, PartialResult) and os.path.exists(path)
+    # The seed is only used for a fresh run, a resumed one takes the
+    # generator state from the file
+    assert run_model_batch(drivers, net, 0, 99, 0.3, seed=0, checkpoint=path) == expected
+    assert np.array_equal(drivers.iterations, expected_iterations)
+    assert not os.path.exists(path)
+
+
+def test_run_model_resumes_from_checkpoint(tmp_path):
+    net = grid_net()
+    random.seed(3)
+    drivers = as_driver_arrays(generate_drivers(60, 0.7, ["good", "bad"]))
+    expected = run_model(drivers, net, 0, 99, 0.4)
+    expected_iterations = drivers.iterations.copy()
+
+    path = str(tmp_path / "run.npz")
+    random.seed(3)
+    generate_drivers(60, 0.7, ["good", "bad"])
+    partial = run_model(drivers, net, 0, 99, 0.4, checkpoint=path, checkpoint_every=5,
+                        limits=RunLimits(max_ticks=expected // 2))
+    assert isinstance(partial, PartialResult) and os.path.exists(path)
+    # The random module state comes from the file, not from the caller
+    random.seed(0)
+    assert run_model(drivers, net, 0, 99, 0.4, checkpoint=path) == expected
+    assert np.array_equal(drivers.iterations, expected_iterations)
+    assert not os.path.exists(path)
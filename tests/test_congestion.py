@@ -0,0 +1,11 @@
+from complex_model import run_model_congestion
+from drivers import gen_driver_arrays
+
+
+def test_reroutes_keep_routes_of_an_empty_network(synthetic_network):
+    # Primary roads are faster, so the quickest and the shortest routes differ
+    _, net, origin, end = synthetic_network(900, seed=1)
+    ticks = [run_model_congestion(gen_driver_arrays(1, 0.0, seed=0), net, origin, end, 0.0,
+                                  reroute_every=reroute_every)
+             for reroute_every in (1, 10**9)]
+    assert ticks[0] == ticks[1]
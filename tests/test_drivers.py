@@ -0,0 +1,43 @@
+import random
+import networkx as nx
+import numpy as np
+import complex_model
+from compiled_net import compile_net
+from drivers import as_driver_arrays, gen_driver_arrays
+
+
+def grid_net():
+    graph = nx.convert_node_labels_to_integers(nx.grid_2d_graph(8, 8))
+    nx.set_edge_attributes(graph, 1.0, "length")
+    return compile_net(graph)
+
+
+def test_reused_drivers_do_not_add_up():
+    net = grid_net()
+    drivers = gen_driver_arrays(40, 0.5, seed=0)
+    for engine in (complex_model.run_model, complex_model.run_model_events,
+                   complex_model.run_model_batch, complex_model.run_model_congestion):
+        runs = []
+        for _ in range(2):
+            random.seed(1)
+            engine(drivers, net, 0, 63, 0.3)
+            runs.append(drivers.iterations.copy())
+        assert np.array_equal(runs[0], runs[1]), engine.__name__
+        assert (runs[0] > 0).all()
+
+
+def test_paths_are_written_back():
+    driver_list = [{1: {'State': 'bad', 'Iterations': 0}, 'Path': list()},
+                   {2: {'State': 'good', 'Iterations': 0}, 'Path': list()}]
+    drivers = as_driver_arrays(driver_list)
+    steps = list(range(40))
+    for node in steps:
+        drivers.record_step(0, node)
+        drivers.iterations[0] += 1
+    drivers.write_back(driver_list)
+    assert driver_list[0]['Path'] == steps
+    assert driver_list[0][1]['Iterations'] == 40
+    assert driver_list[1]['Path'] == []
+    assert drivers.to_list()[0]['Path'] == steps
+    drivers.reset()
+    assert drivers.paths(0) == [] and drivers.iterations.sum() == 0
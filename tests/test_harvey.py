@@ -0,0 +1,45 @@
+import ast
+import importlib.util
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HARVEY = os.path.join(ROOT, "harvey_workstation")
+SCRIPTS = sorted(name for name in os.listdir(HARVEY) if name.endswith(".py"))
+
+
+def imported_modules(path: str, top_level: bool = False) -> set:
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    modules = set()
+    for node in (tree.body if top_level else ast.walk(tree)):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.add(node.module.split(".")[0])
+    return modules
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_local_imports_have_harvey_copies(script):
+    # A module of this repository imported by a harvey script must have its
+    # own copy in harvey_workstation, the scripts run from there
+    local = {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+    for module in imported_modules(os.path.join(HARVEY, script)) & local:
+        assert os.path.exists(os.path.join(HARVEY, module + ".py")), f"{script} imports {module}"
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_scripts_import(script):
+    harvey_modules = {name[:-3] for name in SCRIPTS}
+    # Imports inside functions are only needed when those functions run
+    modules = imported_modules(os.path.join(HARVEY, script), top_level=True)
+    missing = sorted(module for module in modules - harvey_modules
+                     if importlib.util.find_spec(module) is None)
+    if missing:
+        pytest.skip(f"needs {', '.join(missing)}")
+    result = subprocess.run([sys.executable, "-c", f"import {script[:-3]}"], cwd=HARVEY,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,73 @@
+import random
+import networkx as nx
+import numpy as np
+import pytest
+from compiled_net import compile_net
+from complex_model import (generate_drivers, run_model, run_model_batch, run_model_congestion,
+                           run_model_events, run_model_od, run_model_schedule)
+from drivers import DriverArrays, gen_driver_arrays
+from limits import RunLimits
+from schedules import Departure
+
+# Ticks of run_model at the baseline commit, 40 drivers from
+# generate_drivers after random.seed(seed), on synthetic_edges(400, seed=2)
+BASELINE_TICKS = [(0, 0.3, 0.1, 88), (0, 1.0, 0.5, 143), (2, 0.5, 0.3, 102), (5, 1.0, 0.5, 140),
+                  (8, 0.5, 0.3, 89), (9, 1.0, 0.5, 165)]
+
+
+@pytest.mark.parametrize("seed,bad_prop,prob_wrong_turn,ticks", BASELINE_TICKS)
+def test_run_model_matches_baseline(synthetic_network, seed, bad_prop, prob_wrong_turn, ticks):
+    _, net, origin, end = synthetic_network(400, seed=2)
+    random.seed(seed)
+    drivers = generate_drivers(40, bad_prop, ["good", "bad"])
+    assert run_model(drivers, net, origin, end, prob_wrong_turn) == ticks
+
+
+def test_drivers_starting_at_the_sink_have_arrived(synthetic_network):
+    _, net, _, end = synthetic_network(400, seed=2)
+    # run_model keeps the single pass of the original model, the others
+    # give the tick of the last arrival
+    for engine, ticks in ((run_model, 1), (run_model_batch, 1), (run_model_events, 0),
+                          (run_model_congestion, 0)):
+        drivers = gen_driver_arrays(5, 0.5, seed=0)
+        assert engine(drivers, net, end, end, 0.5) == ticks
+        assert not drivers.iterations.any() and (drivers.node == end).all()
+
+
+def dead_end_net():
+    # Drivers from 0 to 2 pass node 1, where a wrong turn to 3 strands
+    # them; 3 leads on to 4 and back, nothing leads to 0 or 2
+    graph = nx.DiGraph([(0, 1), (1, 2), (1, 3), (3, 4), (4, 3)])
+    nx.set_edge_attributes(graph, 1.0, "length")
+    return compile_net(graph)
+
+
+def test_od_drivers_stranded_by_a_wrong_turn_leave_the_run():
+    net = dead_end_net()
+    random.seed(0)
+    drivers = DriverArrays(ids=np.arange(20), state=np.ones(20), states=["good", "bad"], node=np.zeros(20),
+                           dest=np.full(20, 2), depart=np.arange(20) % 4)
+    assert run_model_od(drivers, net, 0.5) >= 3
+    stranded = drivers.arrive < 0
+    assert 0 < stranded.sum() < 20
+    assert (drivers.node[stranded] == 3).all() and (drivers.node[~stranded] == 2).all()
+
+
+def test_scheduled_drivers_stranded_by_a_wrong_turn_leave_the_run():
+    net = dead_end_net()
+    random.seed(0)
+    schedule = [Departure(i // 4, i, 1, 0, 2) for i in range(20)]
+    assert run_model_schedule(schedule, net, 0.5) >= 3
+    # Stranded drivers free their slots, the run stops short of max_ticks
+    random.seed(0)
+    partial = run_model_schedule(schedule + [Departure(100, 20, 1, 0, 2)], net, 0.5,
+                                 limits=RunLimits(max_ticks=101))
+    assert partial.reason == "max_ticks" and partial.num_drivers == 21
+    assert 0 < partial.stranded["bad"] < 20
+    assert partial.arrived["bad"] + partial.stranded["bad"] == 20
+
+
+def test_departure_that_cannot_reach_its_destination_raises():
+    schedule = [Departure(0, 1, 0, 0, 2), Departure(1, 2, 0, 3, 2)]
+    with pytest.raises(nx.NetworkXNoPath):
+        run_model_schedule(schedule, dead_end_net(), 0.5)
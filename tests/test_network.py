@@ -0,0 +1,52 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+from compiled_net import compile_edges, compile_net
+from gen_total_net import network_stats
+
+
+def small_graph() -> nx.Graph:
+    graph = nx.gnm_random_graph(40, 70, seed=3)
+    graph.add_edges_from([(5, 5), (12, 12)])
+    # A second component and an isolated pair
+    graph.add_edges_from([(100, 101), (101, 102), (102, 100), (200, 201)])
+    return graph
+
+
+def test_network_stats_matches_networkx():
+    graph = small_graph()
+    stats = network_stats(graph, num_samples=1000)
+    assert stats["num_nodes"] == graph.number_of_nodes()
+    assert stats["num_edges"] == graph.number_of_edges()
+    assert list(stats["degree"]) == [degree for _, degree in graph.degree()]
+    assert stats["density"] == pytest.approx(nx.density(graph))
+    assert stats["assortativity"] == pytest.approx(nx.degree_assortativity_coefficient(graph))
+    sizes = sorted((len(c) for c in nx.connected_components(graph)), reverse=True)
+    assert list(stats["component_sizes"]) == sizes
+    largest = graph.subgraph(max(nx.connected_components(graph), key=len))
+    assert stats["avg_path_length"] == pytest.approx(nx.average_shortest_path_length(largest))
+
+
+def test_network_stats_sample_is_close():
+    graph = nx.connected_watts_strogatz_graph(500, 6, 0.1, seed=1)
+    stats = network_stats(graph, num_samples=100)
+    assert stats["avg_path_length"] == pytest.approx(nx.average_shortest_path_length(graph), rel=0.05)
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_compile_edges_matches_compile_net(directed):
+    rng = np.random.default_rng(0)
+    edges = pd.DataFrame({"u": rng.integers(0, 60, 300) * 7 + 1000,
+                          "v": rng.integers(0, 60, 300) * 7 + 1000,
+                          "length": rng.uniform(1, 100, 300),
+                          "travel_time": rng.uniform(1, 10, 300)})
+    graph = nx.from_pandas_edgelist(edges, "u", "v", edge_attr=["length", "travel_time"],
+                                    create_using=nx.DiGraph if directed else nx.Graph)
+    expected = compile_net(graph, weights=["length", "travel_time"])
+    net = compile_edges(edges["u"].to_numpy(), edges["v"].to_numpy(), length=edges["length"].to_numpy(),
+                        travel_time=edges["travel_time"].to_numpy(), directed=directed)
+    assert net.directed == expected.directed
+    for name in ("node_ids", "indptr", "indices", "length", "travel_time"):
+        assert np.array_equal(getattr(net, name), getattr(expected, name)), name
+    assert net.fingerprint == expected.fingerprint
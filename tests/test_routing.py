@@ -0,0 +1,98 @@
+import random
+import networkx as nx
+import numpy as np
+from compiled_net import compile_net
+from routing import LandmarkIndex, SinkTrees, TreeCache, sink_tree, sink_tree_array, sink_tree_costs, tree_path, tree_path_array
+
+
+def tied_grid(side: int = 6, seed: int = 0) -> nx.Graph:
+    # Unit lengths, so most pairs have many shortest paths; nodes are added
+    # in a fixed order and edges in a shuffled one
+    grid = nx.grid_2d_graph(side, side)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(side * side))
+    edges = [(u[0] * side + u[1], v[0] * side + v[1]) for u, v in grid.edges]
+    random.Random(seed).shuffle(edges)
+    graph.add_edges_from(edges, length=1)
+    return graph
+
+
+def path_length(graph: nx.Graph, path: list) -> float:
+    return sum(graph.edges[u, v]["length"] for u, v in zip(path, path[1:]))
+
+
+def test_tied_paths_as_long_as_baseline():
+    graph = tied_grid()
+    end = 35
+    next_hop = sink_tree(graph, end)
+    for source in graph.nodes:
+        baseline = nx.shortest_path(graph, source=source, target=end, method="dijkstra", weight="length")
+        path = tree_path(next_hop, source, end)
+        assert nx.is_path(graph, path)
+        assert path_length(graph, path) == path_length(graph, baseline)
+
+
+def test_ties_do_not_depend_on_edge_order():
+    trees = [sink_tree(tied_grid(seed=seed), 35) for seed in range(5)]
+    assert all(tree == trees[0] for tree in trees)
+    nets = [compile_net(tied_grid(seed=seed)) for seed in range(5)]
+    arrays = [net.node_ids[sink_tree_array(net, net.index_of[35])] for net in nets]
+    assert all(np.array_equal(array, arrays[0]) for array in arrays)
+
+
+def test_compiled_tree_matches_networkx_tree():
+    for directed in (False, True):
+        graph = tied_grid(seed=1)
+        if directed:
+            graph = graph.to_directed()
+            graph.remove_edges_from([(u, v) for u, v in list(graph.edges) if (u * 7 + v) % 5 == 0])
+        net = compile_net(graph)
+        end = net.index_of[35]
+        next_hop = sink_tree(graph, 35)
+        array = sink_tree_array(net, end)
+        for node, i in net.index_of.items():
+            if node in next_hop:
+                assert net.node_ids[array[i]] == next_hop[node]
+            else:
+                assert array[i] == -1
+
+
+def test_cost_tree_matches_length_tree():
+    net = compile_net(tied_grid())
+    end = net.index_of[35]
+    assert np.array_equal(sink_tree_costs(net, end, net.length), sink_tree_array(net, end))
+    for source in range(net.num_nodes):
+        assert tree_path_array(sink_tree_array(net, end), source, end)[-1] == end
+
+
+def test_sink_trees_stay_in_cache_budget():
+    net = compile_net(tied_grid())
+    # Room for three int32 trees of 36 nodes
+    cache = TreeCache(max_bytes=3 * 4 * net.num_nodes)
+    trees = SinkTrees(net, chunk_size=8, cache=cache)
+    sinks = list(range(net.num_nodes))
+    trees.build(sinks)
+    assert len(cache) == 3 and cache.nbytes <= cache.max_bytes
+    offsets, nodes = trees.paths(sinks[::-1], sinks)
+    assert len(cache) == 3
+    for k, (source, end) in enumerate(zip(sinks[::-1], sinks)):
+        expected = tree_path_array(sink_tree_array(net, end), source, end)
+        assert np.array_equal(nodes[offsets[k]:offsets[k + 1]], expected)
+    assert np.array_equal(trees.tree(0), sink_tree_array(net, 0))
+
+
+def test_landmark_index_loads_on_small_graphs(tmp_path, monkeypatch):
+    graph = tied_grid()
+    net = compile_net(graph)
+    path = str(tmp_path / "landmarks.npz")
+    # More landmarks than nodes, build picks one per node
+    built = LandmarkIndex.load_or_build(net, path, num_landmarks=64)
+    assert len(built.landmarks) == net.num_nodes
+
+    def rebuild(*args, **kwargs):
+        raise AssertionError("the saved index was not used")
+    monkeypatch.setattr(LandmarkIndex, "build", rebuild)
+    index = LandmarkIndex.load_or_build(net, path, num_landmarks=64)
+    assert np.array_equal(index.landmarks, built.landmarks)
+    route = index.shortest_path(0, 35)
+    assert path_length(graph, route) == nx.shortest_path_length(graph, 0, 35, weight="length")